@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import employees, admin, users, vacantes, presupuesto, nomina, admin_maestra, ai_agent
+from app.api.v1.endpoints import employees, admin, users, vacantes, presupuesto, nomina, admin_maestra, ai_agent, jobs, search
 
 api_router = APIRouter()
 api_router.include_router(employees.router, prefix="/employees", tags=["employees"])
@@ -9,4 +9,6 @@ api_router.include_router(vacantes.router, prefix="/vacantes", tags=["vacantes"]
 api_router.include_router(presupuesto.router, prefix="/admin/presupuesto", tags=["presupuesto"])
 api_router.include_router(nomina.router, prefix="/admin", tags=["nomina"])
 api_router.include_router(admin_maestra.router, prefix="/admin", tags=["maestra"])
-api_router.include_router(ai_agent.router, prefix="/ai", tags=["ai_agent"])
+api_router.include_router(ai_agent.router, prefix="/ai", tags=["ai_agent"])
+api_router.include_router(jobs.router, prefix="/admin/jobs", tags=["jobs"])
+api_router.include_router(search.router, prefix="/search", tags=["search"])
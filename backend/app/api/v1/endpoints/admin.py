@@ -1,34 +1,38 @@
 import calendar
 from datetime import date, datetime
 from typing import Any, Dict, List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from app.core.security import get_current_user, require_role
-from app.core.database import engine, getconn, get_db
+from app.core.database import conexion, engine, getconn, get_db, fanout, fanout_async
 from app.core.constants import PAGO_EXPR
 from app.models.schemas import UserWhitelist, Incremento, PosicionSchema
 from app.core.utils import to_date
 # Use the optimized service
-from app.services.payroll_service_optimized import mensualizar_base_30_optimized as mensualizar_base_30, calculate_yearly_projections
+from app.services.payroll_service_optimized import mensualizar_base_30_optimized as mensualizar_base_30, mensualizar_base_30_parallel, iter_mensualizado, CONCEPTOS
+from app.services.export_stream import stream_rows
+from app.services.projection_cache import projection_key, get_projection, put_projection, bump_data_version, cache_stats
+from app.services.projection_state import anios_financiacion, normalize_ced, yearly_projection, invalidar_estado
+from app.services.reference_data import get_incrementos as cargar_incrementos, get_catalogo, invalidate_reference_data
+from app.services.proyeccion_mensual import solicitar_refresco, estado_materializador
+from app.services.search_index import PERSONA, condicion_in, ids_coincidentes
 
 router = APIRouter()
 
-def normalize_ced(v):
-    if v is None: return ""
-    s = str(v).strip()
-    if s.endswith('.0'): s = s[:-2]
-    return s
-
 
 
 
 
 @router.get("/dashboard-global")
-def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depends(get_current_user)):
+async def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin", "financiero", "user", "talento", "nomina"])
     try:
         curr_year = anio if anio else datetime.now().year
+        cache_key = projection_key("dashboard-global", curr_year)
+        cached = get_projection(cache_key)
+        if cached is not None: return cached
         # 1. Fetch Basic Data
         q_sw = text("""
             SELECT c.cedula, 
@@ -39,39 +43,38 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
             LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
             WHERE UPPER(c.estado) LIKE 'ACTIVO%'
         """)
-        
-        q_tramos = text("""
-            SELECT f.id_financiacion, f.cedula, f.id_proyecto, f.salario_base, f.fecha_inicio, f.fecha_fin, f.id_contrato,
-                   p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, p.Direccion, p.Planta, p.Base_Fuente, c.atep, c.gerencia,
-                   c.estado, c.fecha_terminacion_real,
-                   CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo
-            FROM BFinanciacion f
-            JOIN BContrato c ON f.id_contrato = c.id_contrato
+
+
+        # All Active Contracts metadata
+        q_contracts = text("""
+            SELECT c.cedula, 
+                   CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo, 
+                   c.fecha_terminacion
+            FROM BContrato c
             LEFT JOIN BData d ON c.cedula = d.cedula
-            LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
-            WHERE f.fecha_inicio <= :year_end 
-              AND f.fecha_fin >= :year_start
+            WHERE UPPER(c.estado) LIKE 'ACTIVO%'
         """)
 
-        with engine.connect() as conn:
-            active_emps = conn.execute(q_sw).mappings().all()
-            incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
-            
-            # Find years that actually have financing data
-            q_years = text("SELECT DISTINCT YEAR(fecha_inicio) as y FROM BFinanciacion UNION SELECT DISTINCT YEAR(fecha_fin) as y FROM BFinanciacion")
-            db_years = {r[0] for r in conn.execute(q_years).fetchall() if r[0]}
-            # Intersect with incrementos to ensure we have calculation rules for those years
-            available_years = sorted([y for y in db_years if y in incrementos])
-            
-            # Fallback to current and next year if nothing found
-            if not available_years:
-                available_years = [datetime.now().year, datetime.now().year + 1]
-            tramos_raw = conn.execute(q_tramos, {
-                "year_start": f"{curr_year}-01-01",
-                "year_end": f"{curr_year}-12-31"
-            }).mappings().all()
-            proy_names = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros")).mappings().all()}
+        # Independent queries run concurrently on separate connections
+        res = await fanout_async({
+            "active_emps": (q_sw, {}),
+            "contracts": (q_contracts, {}),
+            "incrementos": cargar_incrementos,
+            "proy_names": lambda: get_catalogo("proyectos"),
+        })
+        active_emps = res["active_emps"]
+        active_contracts_rows = res["contracts"]
+        incrementos = res["incrementos"]
+        proy_names = res["proy_names"]
+
+        # Años con financiación, tramos y alertas salen del estado incremental (sin releer BFinanciacion)
+        db_years = set(await run_in_threadpool(anios_financiacion))
+        # Intersect with incrementos to ensure we have calculation rules for those years
+        available_years = sorted([y for y in db_years if y in incrementos])
+        
+        # Fallback to current and next year if nothing found
+        if not available_years:
+            available_years = [datetime.now().year, datetime.now().year + 1]
             
         # 2. Process Statistics
         active_emp_map_stats = {normalize_ced(r["cedula"]): r["nombre_completo"] for r in active_emps}
@@ -85,65 +88,13 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
             dir_ = r["Direccion"] or "Sin definir"
             dist_direccion_total[dir_] = dist_direccion_total.get(dir_, 0) + 1
 
-        # 3. Monthly Calculation (Source of Truth)
-        tramos_list = []
-        inconsistency_alerts = []
-        for r in tramos_raw:
-            tr = dict(r)
-            est = (tr.get("estado") or "").upper()
-            term_real = to_date(tr.get("fecha_terminacion_real"))
-            tr_fin_orig = to_date(tr["fecha_fin"])
-            
-            if not est.startswith("ACTIVO"):
-                if term_real:
-                    if tr_fin_orig > term_real:
-                        tr["fecha_fin"] = term_real
-                        inconsistency_alerts.append({
-                            "cedula": tr["cedula"],
-                            "nombre": tr["nombre_completo"],
-                            "id_fin": tr["id_financiacion"],
-                            "tipo": "Tramo Excede Retiro",
-                            "msg": f"Terminó {term_real}, tramo iba hasta {tr_fin_orig}"
-                        })
-                else:
-                    # Inactive without term date - likely should not be counted at all or flagged
-                    inconsistency_alerts.append({
-                        "cedula": tr["cedula"],
-                        "nombre": tr["nombre_completo"],
-                        "id_fin": tr["id_financiacion"],
-                        "tipo": "Inactivo sin Fecha",
-                        "msg": "El contrato está inactivo pero no tiene fecha de terminación real."
-                    })
-
-            for k, v in tr.items():
-                if hasattr(v, '__float__') and v is not None: tr[k] = float(v)
-            
-            # Add project name for correct labeling in matrix
-            pid = tr.get("id_proyecto")
-            tr["proyecto"] = proy_names.get(pid, pid)
-            
-            tramos_list.append(tr)
-
-        # Create a lookup for meta-data because mensualizar_base_30 strips it
-        meta_lookup = {tr["id_financiacion"]: {"Direccion": tr.get("Direccion"), "Planta": tr.get("Planta")} for tr in tramos_list}
-        
-        # 3. Aggregation (Unified Calculation)
-        proj_calc = calculate_yearly_projections(tramos_list, incrementos, curr_year)
-        mensualizado = proj_calc["mensualizado_raw"]
+        # 3. Projection and tramo alerts from the incremental per-tramo state
+        # (built once per year in the threadpool; a tramo change only re-reads that tramo)
+        proj_calc = await run_in_threadpool(yearly_projection, curr_year, incrementos, proy_names)
+        inconsistency_alerts = proj_calc["inconsistency_alerts"]
         costo_vigencia_total = proj_calc["total"]
         
-        # 4. Fetch ALL Active Contracts metadata
-        q_contracts = text("""
-            SELECT c.cedula, 
-                   CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo, 
-                   c.fecha_terminacion
-            FROM BContrato c
-            LEFT JOIN BData d ON c.cedula = d.cedula
-            WHERE UPPER(c.estado) LIKE 'ACTIVO%'
-        """)
-        with engine.connect() as conn:
-            active_contracts_rows = conn.execute(q_contracts).mappings().all()
-            
+        # 4. Active Contracts metadata (fetched above)
         active_emp_map = {}
         contract_ends = {}
         active_cedulas_set = set()
@@ -161,8 +112,6 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
             
         # 5. Financial available years
         # Use the years found in DB increments/financing (restored for multi-year view)
-        if not available_years: 
-             available_years = sorted(list(set(tr["fecha_inicio"].year for tr in tramos_list if tr.get("fecha_inicio"))))
         if not available_years: available_years = [curr_year]
         
         for r in active_contracts_rows:
@@ -172,27 +121,9 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
             active_emp_map[ced] = r["nombre_completo"] or f"ID: {ced}"
             contract_ends[ced] = to_date(r["fecha_terminacion"])
 
-        # 5. Build Financing Map (Days per person per month)
-        # We use the 'mensualizado' results already calculated for the matrix
-        days_per_month_cedula = {} 
-        for m_group in mensualizado:
-            # Important: mensualizar_base_30_optimized returns "YYYY-MM-01" as string
-            am = m_group["anioMes"]
-            if am not in days_per_month_cedula:
-                days_per_month_cedula[am] = {}
-            for d in m_group["detalle"]:
-                ced = normalize_ced(d["cedula"])
-                days_per_month_cedula[am][ced] = days_per_month_cedula[am].get(ced, 0) + (d.get("dias") or 0)
-
         # 6. Detect Sin Financiación (Gap vs Contrato)
-        # Calculate max financing date per employee
-        financing_max_dates = {}
-        for r in tramos_list:
-            ced = normalize_ced(r["cedula"])
-            f_end = to_date(r["fecha_fin"])
-            if not f_end: continue
-            if ced not in financing_max_dates or f_end > financing_max_dates[ced]:
-                financing_max_dates[ced] = f_end
+        # Max financing date per employee (kept per cédula by the projection state)
+        financing_max_dates = proj_calc["fin_financiacion"]
                 
         missing_list = []
         fiscal_year_end = date(curr_year, 12, 31)
@@ -222,33 +153,11 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
                 })
 
 
-        # 7. Detect Overlaps
-        overlap_alerts = []
-        # Group all tramos by cedula
-        tramos_by_cedula = {}
-        for r in tramos_list:
-            ced = r["cedula"]
-            if ced not in tramos_by_cedula: tramos_by_cedula[ced] = []
-            tramos_by_cedula[ced].append(r)
-        
-        for ced, em_tramos in tramos_by_cedula.items():
-            if len(em_tramos) < 2: continue
-            
-            sorted_tramos = sorted(em_tramos, key=lambda x: to_date(x["fecha_inicio"]) or date.min)
-            has_overlap = False
-            for i in range(len(sorted_tramos) - 1):
-                curr_end = to_date(sorted_tramos[i]["fecha_fin"])
-                next_start = to_date(sorted_tramos[i+1]["fecha_inicio"])
-                
-                if curr_end and next_start and curr_end >= next_start:
-                    has_overlap = True
-                    break
-            
-            if has_overlap:
-                overlap_alerts.append({
-                    "cedula": ced,
-                    "nombre": active_emp_map.get(ced, "Desconocido")
-                })
+        # 7. Detect Overlaps (cédulas flagged by the projection state)
+        overlap_alerts = [
+            {"cedula": ced, "nombre": active_emp_map.get(ced, "Desconocido")}
+            for ced in proj_calc["traslapes"]
+        ]
 
         # dist_planta_fin is now provided by proj_calc["dist_planta_fin"]
         # dist_direccion_fin is also provided by proj_calc
@@ -260,39 +169,11 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
         lista_matriz = sorted(proj_calc["matrix_proyectos"], key=lambda x: x["total"], reverse=True)
         
         # 8. New Matrix: Trabajadores Sin Financiación (A01/A02) vs Planta
-        sin_finan_matrix = {} # planta -> [12 months heads: set()]
-        sin_finan_cost_matrix = {} # planta -> [12 months cost: float]
-        prefix_val = f"{curr_year}-"
-        for m_group in mensualizado:
-            if not m_group["anioMes"].startswith(prefix_val): continue
-            m_idx = int(m_group["anioMes"].split("-")[1]) - 1
-            for d in m_group["detalle"]:
-                pid = d["id_proyecto"]
-                if pid in ("A01", "A02"):
-                    planta = d.get("Planta") or "Sin Definir"
-                    if planta not in sin_finan_matrix:
-                        sin_finan_matrix[planta] = [set() for _ in range(12)]
-                        sin_finan_cost_matrix[planta] = [0.0 for _ in range(12)]
-                    sin_finan_matrix[planta][m_idx].add(d["cedula"])
-                    sin_finan_cost_matrix[planta][m_idx] += d["valor"]
-        
-        matrix_sin_finan = []
-        for planta, months_sets in sin_finan_matrix.items():
-            matrix_sin_finan.append({
-                "label": planta,
-                "months": [len(s) for s in months_sets],
-                "total": len(set().union(*months_sets))
-            })
+        # Aggregated by the projection engine (no monthly detail materialized)
+        matrix_sin_finan = proj_calc["matrix_sin_finan"]
+        matrix_costo_sin_finan = proj_calc["matrix_costo_sin_finan"]
 
-        matrix_costo_sin_finan = []
-        for planta, costs in sin_finan_cost_matrix.items():
-            matrix_costo_sin_finan.append({
-                "label": planta,
-                "months": costs,
-                "total": sum(costs)
-            })
-
-        return {
+        return put_projection(cache_key, {
             "ok": True,
             "available_years": available_years,
             "kpis": {
@@ -311,7 +192,7 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
             "matrix_proyectos": lista_matriz,
             "matrix_sin_finan": sorted(matrix_sin_finan, key=lambda x: x["total"], reverse=True),
             "matrix_costo_sin_finan": sorted(matrix_costo_sin_finan, key=lambda x: x["total"], reverse=True)
-        }
+        })
     except Exception as e:
         # Fallback for Local Debug without DB
         if user.get("source") == "local_debug":
@@ -347,69 +228,95 @@ def get_dashboard_global(anio: Optional[int] = None, user: Dict[str, Any] = Depe
             }
         raise HTTPException(status_code=500, detail=str(e))
 
+def _reporte_detallado_rows(direccion: Optional[str], gerencia: Optional[str], proyecto: Optional[str], search: Optional[str], anio: Optional[int], mes: Optional[int]) -> List[Dict[str, Any]]:
+    """Filas del reporte detallado (empleado x proyecto con 12 meses), compartidas por la vista JSON y la exportación."""
+    filters = []; params = {}
+    if direccion: filters.append("p.Direccion = :direccion"); params["direccion"] = direccion
+    if gerencia:
+        if gerencia == "Grupo de Trabajo": filters.append("(c.gerencia IS NULL OR c.gerencia = '' OR c.gerencia = ' ')")
+        else: filters.append("c.gerencia = :gerencia"); params["gerencia"] = gerencia
+    if proyecto: filters.append("f.id_proyecto LIKE :proyecto"); params["proyecto"] = f"%{proyecto}%"
+    if search:
+        # Índice de búsqueda en memoria; sin índice (o demasiadas coincidencias) el LIKE de siempre
+        cedulas = ids_coincidentes(search, PERSONA)
+        if cedulas is None: filters.append("(c.cedula LIKE :search OR CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) LIKE :search)"); params["search"] = f"%{search}%"
+        else:
+            cond, cond_params = condicion_in("c.cedula", cedulas, "search_")
+            filters.append(cond); params.update(cond_params)
+    where_clause = (" AND " + " AND ".join(filters)) if filters else ""
+    year_val = int(anio) if anio else datetime.now().year
+    if mes:
+        m_val = int(mes); start_d = date(year_val, m_val, 1)
+        end_d = date(year_val, 12, 31) if m_val == 12 else (date(year_val, m_val + 1, 1) - date.fromordinal(1).replace(year=1, month=1, day=2) + date.fromordinal(1)).replace(year=year_val, month=m_val) # simplified below
+        from datetime import timedelta
+        end_d = (date(year_val, m_val + 1, 1) if m_val < 12 else date(year_val + 1, 1, 1)) - timedelta(days=1)
+        params["year_start"] = start_d; params["year_end"] = end_d
+    else:
+        params["year_start"] = date(year_val, 1, 1); params["year_end"] = date(year_val, 12, 31)
+    query_sql = text(f"SELECT f.id_financiacion, f.cedula, f.salario_base, f.fecha_inicio, f.fecha_fin, f.id_proyecto, f.rubro, f.id_fuente, f.id_componente, f.id_subcomponente, f.id_categoria, f.id_responsable, c.atep, c.gerencia, c.fecha_terminacion, c.estado, c.fecha_terminacion_real, p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, p.Direccion, p.Planta, p.Tipo_planta, p.Base_Fuente, CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo, c.id_contrato FROM BFinanciacion f JOIN BContrato c ON f.id_contrato = c.id_contrato JOIN BData d ON c.cedula = d.cedula LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion WHERE f.fecha_fin >= :year_start AND f.fecha_inicio <= :year_end {where_clause}")
+    with engine.connect() as conn:
+        rows = conn.execute(query_sql, params).mappings().all()
+    incrementos = cargar_incrementos()
+    tramos_data = []; fin_info_map = {}
+    for r in rows:
+        d = dict(r)
+        est = (d.get("estado") or "").upper()
+        term_real = to_date(d.get("fecha_terminacion_real"))
+        if not est.startswith("ACTIVO") and term_real:
+            tr_fin = to_date(d["fecha_fin"])
+            if tr_fin > term_real:
+                d["fecha_fin"] = term_real
+        for k, v in d.items():
+            if hasattr(v, '__float__') and v is not None: d[k] = float(v)
+        tramos_data.append(d); fin_info_map[d["id_financiacion"]] = d
+    emp_matrix = {}
+    target_year = year_val
+    # Un mes de detalle a la vez, solo los meses del año objetivo
+    for item in iter_mensualizado(tramos_data, incrementos, date(target_year, 1, 1), date(target_year, 12, 1)):
+        anio_mes = item["anioMes"]
+        m_idx = int(anio_mes.split("-")[1]) - 1
+        for det in item["detalle"]:
+            info = fin_info_map.get(det["id"])
+            if not info: continue
+            key = f"{info['cedula']}-{info['id_proyecto']}"
+            if key not in emp_matrix: emp_matrix[key] = {"cedula": info["cedula"], "nombre": info["nombre_completo"], "direccion": info["Direccion"], "gerencia": info["gerencia"], "planta": info.get("Planta"), "tipo_planta": info.get("Tipo_planta"), "base_fuente": info.get("Base_Fuente"), "id_proyecto": info["id_proyecto"], "nombre_proyecto": info["id_proyecto"], "fecha_fin": info["fecha_terminacion"], "months": [0.0]*12, "total": 0.0}
+            if 0 <= m_idx < 12: emp_matrix[key]["months"][m_idx] += det["valor"]; emp_matrix[key]["total"] += det["valor"]
+    proy_names = get_catalogo("proyectos")
+    for v in emp_matrix.values():
+        if v["id_proyecto"] in proy_names: v["nombre_proyecto"] = f"{v['id_proyecto']} - {proy_names[v['id_proyecto']]}"
+    lista_emps = sorted(list(emp_matrix.values()), key=lambda x: (x["nombre"], x["id_proyecto"]))
+    return lista_emps
+
 @router.get("/reporte-detallado")
 def get_reporte_detallado(direccion: Optional[str] = None, gerencia: Optional[str] = None, proyecto: Optional[str] = None, search: Optional[str] = None, anio: Optional[int] = None, mes: Optional[int] = None, user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin", "financiero", "user", "talento", "nomina"])
     try:
-        filters = []; params = {}
-        if direccion: filters.append("p.Direccion = :direccion"); params["direccion"] = direccion
-        if gerencia:
-            if gerencia == "Grupo de Trabajo": filters.append("(c.gerencia IS NULL OR c.gerencia = '' OR c.gerencia = ' ')")
-            else: filters.append("c.gerencia = :gerencia"); params["gerencia"] = gerencia
-        if proyecto: filters.append("f.id_proyecto LIKE :proyecto"); params["proyecto"] = f"%{proyecto}%"
-        if search: filters.append("(c.cedula LIKE :search OR CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) LIKE :search)"); params["search"] = f"%{search}%"
-        where_clause = (" AND " + " AND ".join(filters)) if filters else ""
-        year_val = int(anio) if anio else datetime.now().year
-        if mes:
-            m_val = int(mes); start_d = date(year_val, m_val, 1)
-            end_d = date(year_val, 12, 31) if m_val == 12 else (date(year_val, m_val + 1, 1) - date.fromordinal(1).replace(year=1, month=1, day=2) + date.fromordinal(1)).replace(year=year_val, month=m_val) # simplified below
-            from datetime import timedelta
-            end_d = (date(year_val, m_val + 1, 1) if m_val < 12 else date(year_val + 1, 1, 1)) - timedelta(days=1)
-            params["year_start"] = start_d; params["year_end"] = end_d
-        else:
-            params["year_start"] = date(year_val, 1, 1); params["year_end"] = date(year_val, 12, 31)
-        query_sql = text(f"SELECT f.id_financiacion, f.cedula, f.salario_base, f.fecha_inicio, f.fecha_fin, f.id_proyecto, f.rubro, f.id_fuente, f.id_componente, f.id_subcomponente, f.id_categoria, f.id_responsable, c.atep, c.gerencia, c.fecha_terminacion, c.estado, c.fecha_terminacion_real, p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, p.Direccion, p.Planta, p.Tipo_planta, p.Base_Fuente, CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo, c.id_contrato FROM BFinanciacion f JOIN BContrato c ON f.id_contrato = c.id_contrato JOIN BData d ON c.cedula = d.cedula LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion WHERE f.fecha_fin >= :year_start AND f.fecha_inicio <= :year_end {where_clause}")
-        with engine.connect() as conn:
-            rows = conn.execute(query_sql, params).mappings().all(); incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
-        tramos_data = []; fin_info_map = {}
-        for r in rows:
-            d = dict(r)
-            est = (d.get("estado") or "").upper()
-            term_real = to_date(d.get("fecha_terminacion_real"))
-            if not est.startswith("ACTIVO") and term_real:
-                tr_fin = to_date(d["fecha_fin"])
-                if tr_fin > term_real:
-                    d["fecha_fin"] = term_real
-            for k, v in d.items():
-                if hasattr(v, '__float__') and v is not None: d[k] = float(v)
-            tramos_data.append(d); fin_info_map[d["id_financiacion"]] = d
-        mensualizado_list = mensualizar_base_30(tramos_data, incrementos); emp_matrix = {}
-        target_year = year_val
-        for item in mensualizado_list:
-            anio_mes = item["anioMes"]
-            if not anio_mes.startswith(str(target_year)): continue
-            m_idx = int(anio_mes.split("-")[1]) - 1
-            for det in item["detalle"]:
-                info = fin_info_map.get(det["id"])
-                if not info: continue
-                key = f"{info['cedula']}-{info['id_proyecto']}"
-                if key not in emp_matrix: emp_matrix[key] = {"cedula": info["cedula"], "nombre": info["nombre_completo"], "direccion": info["Direccion"], "gerencia": info["gerencia"], "planta": info.get("Planta"), "tipo_planta": info.get("Tipo_planta"), "base_fuente": info.get("Base_Fuente"), "id_proyecto": info["id_proyecto"], "nombre_proyecto": info["id_proyecto"], "fecha_fin": info["fecha_terminacion"], "months": [0.0]*12, "total": 0.0}
-                if 0 <= m_idx < 12: emp_matrix[key]["months"][m_idx] += det["valor"]; emp_matrix[key]["total"] += det["valor"]
-        with engine.connect() as conn:
-            proy_names = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros")).mappings().all()}
-        for v in emp_matrix.values():
-            if v["id_proyecto"] in proy_names: v["nombre_proyecto"] = f"{v['id_proyecto']} - {proy_names[v['id_proyecto']]}"
-        lista_emps = sorted(list(emp_matrix.values()), key=lambda x: (x["nombre"], x["id_proyecto"]))
-        return {"ok": True, "data": lista_emps}
+        return {"ok": True, "data": _reporte_detallado_rows(direccion, gerencia, proyecto, search, anio, mes)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+REPORTE_DETALLADO_COLUMNS = ["cedula", "nombre", "direccion", "gerencia", "planta", "tipo_planta", "base_fuente", "id_proyecto", "nombre_proyecto", "fecha_fin"] + [f"m{m:02d}" for m in range(1, 13)] + ["total"]
+
+@router.get("/reporte-detallado/stream")
+def stream_reporte_detallado(request: Request, formato: str = "csv", direccion: Optional[str] = None, gerencia: Optional[str] = None, proyecto: Optional[str] = None, search: Optional[str] = None, anio: Optional[int] = None, mes: Optional[int] = None, user: Dict[str, Any] = Depends(get_current_user)):
+    """Reporte detallado como descarga NDJSON/CSV en streaming (gzip por bloques)."""
+    require_role(user, ["admin", "financiero", "user", "talento", "nomina"])
+    try:
+        rows = _reporte_detallado_rows(direccion, gerencia, proyecto, search, anio, mes)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if formato == "csv":
+        rows = ({**r, **{f"m{i + 1:02d}": v for i, v in enumerate(r["months"])}} for r in rows)
+    return stream_rows(request, rows, formato, f"reporte_detallado_{anio or datetime.now().year}", REPORTE_DETALLADO_COLUMNS)
 
 @router.get("/flujo-caja")
 def get_flujo_caja(anio: Optional[int] = None, user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin", "financiero", "user", "talento", "nomina"])
     try:
         target_year = anio if anio else datetime.now().year
+        cache_key = projection_key("flujo-caja", target_year)
+        cached = get_projection(cache_key)
+        if cached is not None: return cached
         # Optimized query with date filters to reduce processing
         query_sql = text("""
             SELECT f.*, c.atep, c.gerencia, c.id_contrato, c.fecha_ingreso, c.estado, c.fecha_terminacion_real, 
@@ -422,20 +329,21 @@ def get_flujo_caja(anio: Optional[int] = None, user: Dict[str, Any] = Depends(ge
             LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
             WHERE f.fecha_inicio <= :year_end AND f.fecha_fin >= :year_start
         """)
-        with engine.connect() as conn:
-            rows = conn.execute(query_sql, {
-                "year_start": f"{target_year}-01-01",
-                "year_end": f"{target_year}-12-31"
-            }).mappings().all()
-            incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
-            # Fetch Mappings
-            proy_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros")).mappings().all()}
-            fuente_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_fuentes")).mappings().all()}
-            comp_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_componentes")).mappings().all()}
-            sub_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_subcomponentes")).mappings().all()}
-            cat_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_categorias")).mappings().all()}
-            resp_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_responsables")).mappings().all()}
+        # Tramos + catálogos en paralelo (los catálogos salen de caché si ya están cargados)
+        res = fanout({
+            "rows": (query_sql, {"year_start": f"{target_year}-01-01", "year_end": f"{target_year}-12-31"}),
+            "incrementos": cargar_incrementos,
+            **{nombre: (lambda n=nombre: get_catalogo(n)) for nombre in ("proyectos", "fuentes", "componentes", "subcomponentes", "categorias", "responsables")},
+        })
+        rows = res["rows"]
+        incrementos = res["incrementos"]
+        # Fetch Mappings
+        proy_map = res["proyectos"]
+        fuente_map = res["fuentes"]
+        comp_map = res["componentes"]
+        sub_map = res["subcomponentes"]
+        cat_map = res["categorias"]
+        resp_map = res["responsables"]
 
         tramos_data = []
         for r in rows:
@@ -572,42 +480,51 @@ def get_flujo_caja(anio: Optional[int] = None, user: Dict[str, Any] = Depends(ge
                     final_report[m_idx]["detalle"].append(det)
                     final_report[m_idx]["total"] += flow_val
 
-        return {"ok": True, "data": sorted(final_report.values(), key=lambda x: x["anioMes"])}
+        return put_projection(cache_key, {"ok": True, "data": sorted(final_report.values(), key=lambda x: x["anioMes"])})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _tramos_mensualizado_global() -> List[Dict[str, Any]]:
+    """Todos los tramos de BFinanciacion listos para mensualizar (fin recortado a la terminación real)."""
+    query_sql = text("SELECT f.*, c.atep, c.gerencia, c.id_contrato, c.estado, c.fecha_terminacion_real, c.fecha_terminacion, p.Planta, p.Tipo_planta, p.Base_Fuente, p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, p.Direccion, CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo FROM BFinanciacion f JOIN BContrato c ON f.id_contrato = c.id_contrato JOIN BData d ON c.cedula = d.cedula LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion")
+    with engine.connect() as conn:
+        rows = conn.execute(query_sql).mappings().all()
+
+    tramos_data = []
+    for r in rows:
+        d = dict(r)
+        est = (d.get("estado") or "").upper()
+        term_real = to_date(d.get("fecha_terminacion_real"))
+        if not est.startswith("ACTIVO") and term_real:
+            tr_fin = to_date(d["fecha_fin"])
+            if tr_fin > term_real:
+                d["fecha_fin"] = term_real
+        for k, v in d.items():
+            if hasattr(v, '__float__') and v is not None: d[k] = float(v)
+        tramos_data.append(d)
+    return tramos_data
+
+# Campo del detalle -> catálogo para mostrar "Código | Nombre"
+MAPEO_CATALOGOS = {"id_proyecto": "proyectos", "fuente": "fuentes", "componente": "componentes", "subcomponente": "subcomponentes", "categoria": "categorias", "responsable": "responsables"}
+
+def _mapear_codigos(d: Dict[str, Any], maps: Dict[str, Any]) -> None:
+    for campo, catalogo in MAPEO_CATALOGOS.items():
+        if d.get(campo): d[campo] = f"{d[campo]} | {maps[catalogo].get(d[campo], d[campo])}"
+
 @router.get("/mensualizado-global")
 def get_mensualizado_global(user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin", "financiero", "talento", "nomina"])
     try:
-        query_sql = text("SELECT f.*, c.atep, c.gerencia, c.id_contrato, c.estado, c.fecha_terminacion_real, c.fecha_terminacion, p.Planta, p.Tipo_planta, p.Base_Fuente, p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, p.Direccion, CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo FROM BFinanciacion f JOIN BContrato c ON f.id_contrato = c.id_contrato JOIN BData d ON c.cedula = d.cedula LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion")
-        with engine.connect() as conn:
-            rows = conn.execute(query_sql).mappings().all()
-            incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
-            
-            # Fetch Mappings
-            proy_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros")).mappings().all()}
-            fuente_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_fuentes")).mappings().all()}
-            comp_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_componentes")).mappings().all()}
-            sub_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_subcomponentes")).mappings().all()}
-            cat_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_categorias")).mappings().all()}
-            resp_map = {r["codigo"]: r["nombre"] for r in conn.execute(text("SELECT codigo, nombre FROM dim_responsables")).mappings().all()}
-
-        tramos_data = []
-        for r in rows:
-            d = dict(r)
-            est = (d.get("estado") or "").upper()
-            term_real = to_date(d.get("fecha_terminacion_real"))
-            if not est.startswith("ACTIVO") and term_real:
-                tr_fin = to_date(d["fecha_fin"])
-                if tr_fin > term_real:
-                    d["fecha_fin"] = term_real
-            for k, v in d.items():
-                if hasattr(v, '__float__') and v is not None: d[k] = float(v)
-            tramos_data.append(d)
+        cache_key = projection_key("mensualizado-global", datetime.now().year)
+        cached = get_projection(cache_key)
+        if cached is not None: return cached
+        tramos_data = _tramos_mensualizado_global()
+        incrementos = cargar_incrementos()
+        # Fetch Mappings
+        maps = {c: get_catalogo(c) for c in MAPEO_CATALOGOS.values()}
         
-        mensualizado_raw = mensualizar_base_30(tramos_data, incrementos)
+        # Full table: sharded across worker processes (in-process for small inputs)
+        mensualizado_raw = mensualizar_base_30_parallel(tramos_data, incrementos)
         
         # Apply Mappings "Code | Name"
         curr_year = datetime.now().year
@@ -617,17 +534,38 @@ def get_mensualizado_global(user: Dict[str, Any] = Depends(get_current_user)):
         
         for m in filtered_data:
             for d in m["detalle"]:
-                if d.get("id_proyecto"): d["id_proyecto"] = f"{d['id_proyecto']} | {proy_map.get(d['id_proyecto'], d['id_proyecto'])}"
-                if d.get("fuente"): d["fuente"] = f"{d['fuente']} | {fuente_map.get(d['fuente'], d['fuente'])}"
-                if d.get("componente"): d["componente"] = f"{d['componente']} | {comp_map.get(d['componente'], d['componente'])}"
-                if d.get("subcomponente"): d["subcomponente"] = f"{d['subcomponente']} | {sub_map.get(d['subcomponente'], d['subcomponente'])}"
-                if d.get("categoria"): d["categoria"] = f"{d['categoria']} | {cat_map.get(d['categoria'], d['categoria'])}"
-                if d.get("responsable"): d["responsable"] = f"{d['responsable']} | {resp_map.get(d['responsable'], d['responsable'])}"
-
-        return {"ok": True, "data": filtered_data}
+                _mapear_codigos(d, maps)
+
+        return put_projection(cache_key, {"ok": True, "data": filtered_data})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+MENSUALIZADO_COLUMNS = ["anioMes", "id", "cedula", "nombre", "fecha_inicio", "fecha_fin", "id_proyecto", "proyecto", "rubro", "fuente", "componente", "subcomponente", "categoria", "responsable", "contrato", "fecha_ingreso", "fecha_terminacion", "Planta", "Tipo_planta", "Base_Fuente", "Direccion", "gerencia", "cargo", "posicion_c", "Estado", "dias", "valor"] + list(CONCEPTOS)
+
+@router.get("/mensualizado-global/stream")
+def stream_mensualizado_global(request: Request, formato: str = "ndjson", user: Dict[str, Any] = Depends(get_current_user)):
+    """
+    Mensualizado global (año en curso + enero siguiente) como descarga NDJSON/CSV en streaming:
+    una fila por tramo-mes, generada mes a mes sin armar el documento completo.
+    """
+    require_role(user, ["admin", "financiero", "talento", "nomina"])
+    try:
+        curr_year = datetime.now().year
+        maps = {c: get_catalogo(c) for c in MAPEO_CATALOGOS.values()}
+        meses = iter_mensualizado(_tramos_mensualizado_global(), cargar_incrementos(), date(curr_year, 1, 1), date(curr_year + 1, 1, 1))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    def filas():
+        for m in meses:
+            for d in m["detalle"]:
+                _mapear_codigos(d, maps)
+                row = {"anioMes": m["anioMes"], **d}
+                if formato == "csv":
+                    row.update(row.pop("conceptos"))
+                yield row
+    return stream_rows(request, filas(), formato, f"mensualizado_{curr_year}", MENSUALIZADO_COLUMNS)
+
 @router.get("/incrementos")
 def get_incrementos(user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin"])
@@ -642,6 +580,9 @@ def upsert_incremento(data: Incremento, user: Dict[str, Any] = Depends(get_curre
     try:
         query = text("INSERT INTO BIncremento (id, anio, smlv, transporte, dotacion, porcentaje_aumento) VALUES (:id, :anio, :smlv, :transporte, :dotacion, :porc) ON DUPLICATE KEY UPDATE smlv = :smlv, transporte = :transporte, dotacion = :dotacion, porcentaje_aumento = :porc")
         with engine.begin() as conn: conn.execute(query, {"id": str(data.anio), "anio": data.anio, "smlv": data.smlv, "transporte": data.transporte, "dotacion": data.dotacion, "porc": data.porcentaje_aumento})
+        invalidate_reference_data("incrementos")
+        bump_data_version()
+        solicitar_refresco()
         return {"ok": True, "mensaje": "Incremento actualizado"}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
@@ -651,6 +592,9 @@ def delete_incremento(anio: int, user: Dict[str, Any] = Depends(get_current_user
     try:
         query = text("DELETE FROM BIncremento WHERE anio = :anio")
         with engine.begin() as conn: conn.execute(query, {"anio": anio})
+        invalidate_reference_data("incrementos")
+        bump_data_version()
+        solicitar_refresco()
         return {"ok": True, "mensaje": "Registro eliminado"}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
@@ -659,6 +603,25 @@ def delete_incremento(anio: int, user: Dict[str, Any] = Depends(get_current_user
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/cache/stats")
+def get_cache_stats(user: Dict[str, Any] = Depends(get_current_user)):
+    """Hit rate y uso de memoria de la caché de proyecciones."""
+    require_role(user, ["admin"])
+    return {"ok": True, "proyecciones": cache_stats()}
+
+@router.get("/proyeccion-mensual/estado")
+def get_proyeccion_mensual_estado(user: Dict[str, Any] = Depends(get_current_user)):
+    """Estado del materializador de BProyeccion_Mensual."""
+    require_role(user, ["admin"])
+    return {"ok": True, "estado": estado_materializador()}
+
+@router.post("/proyeccion-mensual/refrescar")
+def refrescar_proyeccion_mensual(user: Dict[str, Any] = Depends(get_current_user)):
+    """Encola una reconstrucción completa de BProyeccion_Mensual (en segundo plano)."""
+    require_role(user, ["admin"])
+    solicitar_refresco()
+    return {"ok": True, "message": "Refresco completo encolado."}
+
 @router.get("/catalogos")
 def get_catalogos(user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin", "financiero", "talento", "nomina"])
@@ -793,7 +756,7 @@ def proyectar_vacante(
         # 2. Get ARL (atep) from last contract if available, else default
         q_atep = text("SELECT atep FROM BContrato WHERE posicion = :id_posicion ORDER BY fecha_ingreso DESC LIMIT 1")
         
-        with engine.connect() as conn:
+        with conexion() as conn:
             pos = conn.execute(q_pos, {"id_posicion": id_posicion}).mappings().first()
             if not pos:
                 raise HTTPException(status_code=404, detail="Posición no encontrada")
@@ -802,8 +765,7 @@ def proyectar_vacante(
             atep = float(atep_row["atep"]) if atep_row and atep_row["atep"] else 0.00522 # Default Risk Class 1
             
             # 3. Fetch Increments
-            incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
+            incrementos = cargar_incrementos()
             
         # 4. Create Mock Tramo
         mock_tramo = {
@@ -862,6 +824,7 @@ def create_posicion(pos: PosicionSchema, user: Dict[str, Any] = Depends(get_curr
             data = pos.model_dump() # Use field names (id, salario...) to match placeholders
             data["usuario"] = user.get("email")
             conn.execute(query, data)
+        invalidar_estado()
             
         # Audit Log
         audit.log_event(
@@ -909,6 +872,8 @@ def update_posicion(id_posicion: str, pos: PosicionSchema, user: Dict[str, Any]
         
         with engine.begin() as conn:
             conn.execute(update_q, data)
+        invalidar_estado()
+        solicitar_refresco()
             
         # Audit Log
         audit.log_event(
@@ -944,6 +909,8 @@ def delete_posicion(id_posicion: str, user: Dict[str, Any] = Depends(get_current
         delete_q = text("DELETE FROM BPosicion WHERE IDPosicion = :id")
         with engine.begin() as conn:
             conn.execute(delete_q, {"id": id_posicion})
+        invalidar_estado()
+        solicitar_refresco()
         
         # Audit Log
         audit.log_event(
@@ -1021,6 +988,9 @@ def get_reporte_cars(anio: Optional[int] = None, user: Dict[str, Any] = Depends(
 
     try:
         target_year = anio if anio else datetime.now().year
+        cache_key = projection_key("reporte-cars", target_year)
+        cached = get_projection(cache_key)
+        if cached is not None: return cached
         
         # 1. Fetch data
         q_sql = text("""
@@ -1039,7 +1009,7 @@ def get_reporte_cars(anio: Optional[int] = None, user: Dict[str, Any] = Depends(
         
         cats = {"proy": {}, "fuente": {}, "comp": {}, "subcomp": {}, "cat": {}, "resp": {}}
 
-        with engine.connect() as conn:
+        with conexion() as conn:
             # Main Data
             rows = conn.execute(q_sql, {
                 "y_start": f"{target_year}-01-01", 
@@ -1047,25 +1017,23 @@ def get_reporte_cars(anio: Optional[int] = None, user: Dict[str, Any] = Depends(
             }).mappings().all()
             
             # Increments
-            incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
-            
-            # --- Load Catalogs (Best Effort) ---
-            def safe_load(k, q):
-                try:
-                    res = conn.execute(text(q)).fetchall()
-                    # Mapping: Code (str) -> Name (str)
-                    cats[k] = {str(r[0]).strip(): str(r[1]).strip() for r in res if len(r) >= 2 and r[1]}
-                except Exception as e:
-                    print(f"Warning: Could not load catalog '{k}': {e}")
+            incrementos = cargar_incrementos()
             
-            # Try to load names. Using correct dim tables.
-            safe_load("proy", "SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros")
-            safe_load("fuente", "SELECT codigo, nombre FROM dim_fuentes")
-            safe_load("comp", "SELECT codigo, nombre FROM dim_componentes")
-            safe_load("subcomp", "SELECT codigo, nombre FROM dim_subcomponentes")
-            safe_load("cat", "SELECT codigo, nombre FROM dim_categorias")
-            safe_load("resp", "SELECT codigo, nombre FROM dim_responsables")
+        # --- Load Catalogs (Best Effort) ---
+        def safe_load(k, nombre):
+            try:
+                # Mapping: Code (str) -> Name (str)
+                cats[k] = {str(c).strip(): str(n).strip() for c, n in get_catalogo(nombre).items() if n}
+            except Exception as e:
+                print(f"Warning: Could not load catalog '{k}': {e}")
+        
+        # Try to load names. Using correct dim tables.
+        safe_load("proy", "proyectos")
+        safe_load("fuente", "fuentes")
+        safe_load("comp", "componentes")
+        safe_load("subcomp", "subcomponentes")
+        safe_load("cat", "categorias")
+        safe_load("resp", "responsables")
             
         # 2. Monthly Calculation
         tramos_data = []
@@ -1090,7 +1058,7 @@ def get_reporte_cars(anio: Optional[int] = None, user: Dict[str, Any] = Depends(
             
             tramos_data.append(d)
 
-        mensualizado = mensualizar_base_30(tramos_data, incrementos)
+        mensualizado = mensualizar_base_30_parallel(tramos_data, incrementos)
         
         # 3. Grouping
         grouped_data = {}
@@ -1180,7 +1148,7 @@ def get_reporte_cars(anio: Optional[int] = None, user: Dict[str, Any] = Depends(
                 "Valor_Total": round(v["valor_total"])
             })
             
-        return {"ok": True, "data": sorted(final_list, key=lambda x: x["Nombre"])}
+        return put_projection(cache_key, {"ok": True, "data": sorted(final_list, key=lambda x: x["Nombre"])})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,11 +1,17 @@
-from datetime import datetime
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
 from typing import Any, Dict, List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from app.core.security import get_current_user, require_role
 from app.core.database import get_db, engine
 from app.services.audit_service import AuditService
+from app.services.projection_state import tramo_changed
+from app.services.reference_data import get_catalogo
+from app.services.search_index import PERSONA, PROYECTO, condicion_in, ids_coincidentes
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -31,47 +37,168 @@ class MaestraFinanciacionItem(BaseModel):
 # ──────────────────────────────────────────────────────────────
 # GET  /maestra/financiacion
 # ──────────────────────────────────────────────────────────────
+# Columnas que puede pedir la grilla (campos=) -> expresión SQL
+MAESTRA_CAMPOS = {
+    **{c: f"f.{c}" for c in (
+        "id_financiacion", "id_contrato", "posicion", "cedula", "fecha_inicio", "fecha_fin",
+        "salario_base", "salario_t", "pago_proyectado", "rubro", "id_proyecto", "id_fuente",
+        "id_componente", "id_subcomponente", "id_categoria", "id_responsable",
+        "modifico", "modifico_app", "fecha_modificacion",
+    )},
+    "nombre_completo": "CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)",
+    "cargo_posicion": "p.Cargo",
+}
+# Proyección por defecto: lo que muestra la grilla (el detalle se pide por id)
+MAESTRA_CAMPOS_GRILLA = ("id_financiacion", "cedula", "nombre_completo", "id_proyecto",
+                         "salario_base", "pago_proyectado", "fecha_modificacion")
+# Columnas ordenables (desempate siempre por id_financiacion): solo las que tienen índice
+# (col, id_financiacion) en BFinanciacion, para que cada página sea un rango del índice
+MAESTRA_ORDEN = ("fecha_modificacion", "id_financiacion", "cedula", "id_proyecto",
+                 "salario_base", "pago_proyectado")
+
+MAESTRA_FROM = """
+    FROM BFinanciacion f
+    LEFT JOIN BData d ON f.cedula = d.cedula
+    LEFT JOIN BPosicion p ON f.posicion = p.IDPosicion
+"""
+
+
+def _cursor_encode(valor: Any, id_financiacion: str) -> str:
+    if isinstance(valor, (datetime, date)):
+        valor = valor.isoformat(sep=" ") if isinstance(valor, datetime) else valor.isoformat()
+    elif isinstance(valor, Decimal):
+        valor = str(valor)
+    raw = json.dumps([valor, id_financiacion], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _cursor_decode(cursor: str):
+    try:
+        valor, id_financiacion = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return valor, str(id_financiacion)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def _keyset(col: str, desc: bool, valor: Any) -> str:
+    """
+    Predicado "después del cursor" para ORDER BY col, f.id_financiacion en la misma dirección.
+    MySQL ordena NULL primero en ASC y último en DESC.
+    """
+    op = "<" if desc else ">"
+    if valor is None:
+        if desc:
+            return f"({col} IS NULL AND f.id_financiacion {op} :cur_id)"
+        return f"(({col} IS NULL AND f.id_financiacion {op} :cur_id) OR {col} IS NOT NULL)"
+    siguiente = f"({col} {op} :cur_val OR ({col} = :cur_val AND f.id_financiacion {op} :cur_id))"
+    return f"({siguiente} OR {col} IS NULL)" if desc else siguiente
+
+
 @router.get("/maestra/financiacion")
 def get_maestra_financiacion(
     search: Optional[str] = None,
+    cedula: Optional[str] = None,
+    id_proyecto: Optional[str] = None,
+    id_fuente: Optional[str] = None,
+    nombre: Optional[str] = None,
+    sort: str = "fecha_modificacion",
+    dir: str = "desc",
+    campos: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     user: Any = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Obtiene todos los registros de BFinanciacion para la tabla maestra. Solo admin."""
+    """
+    Página de BFinanciacion para la tabla maestra (keyset sobre sort + id_financiacion). Solo admin.
+    Los filtros y la búsqueda son por prefijo (usan índice). Retorna {items, next_cursor}:
+    next_cursor va en la siguiente llamada con los mismos filtros y orden.
+    """
     require_role(user, ["admin"])
+    if sort not in MAESTRA_ORDEN:
+        raise HTTPException(status_code=400, detail=f"Orden no permitido: {sort}")
+    if dir.lower() not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"Dirección no permitida: {dir}")
+    desc = dir.lower() == "desc"
+    pedidos = [c.strip() for c in campos.split(",") if c.strip()] if campos else list(MAESTRA_CAMPOS_GRILLA)
+    invalidos = [c for c in pedidos if c not in MAESTRA_CAMPOS]
+    if invalidos:
+        raise HTTPException(status_code=400, detail=f"Campos no permitidos: {', '.join(invalidos)}")
+    # La llave del cursor siempre viaja en la fila
+    for c in dict.fromkeys((sort, "id_financiacion")):
+        if c not in pedidos:
+            pedidos.append(c)
+
     try:
         # BUG FIX: Always use parameterized queries — never f-string a WHERE clause
+        where, params = [], {"lim": limit + 1}
         if search:
-            query = text("""
-                SELECT f.*,
-                       CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) as nombre_completo,
-                       p.Cargo as cargo_posicion
-                FROM BFinanciacion f
-                LEFT JOIN BData d ON f.cedula = d.cedula
-                LEFT JOIN BPosicion p ON f.posicion = p.IDPosicion
-                WHERE f.cedula LIKE :s OR f.id_proyecto LIKE :s
-                   OR d.p_nombre LIKE :s OR d.p_apellido LIKE :s
-                ORDER BY f.fecha_modificacion DESC
-                LIMIT 2000
-            """)
-            params = {"s": f"%{search}%"}
-        else:
-            query = text("""
-                SELECT f.*,
-                       CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) as nombre_completo,
-                       p.Cargo as cargo_posicion
-                FROM BFinanciacion f
-                LEFT JOIN BData d ON f.cedula = d.cedula
-                LEFT JOIN BPosicion p ON f.posicion = p.IDPosicion
-                ORDER BY f.fecha_modificacion DESC
-                LIMIT 2000
-            """)
-            params = {}
-
-        result = db.execute(query, params).mappings().all()
-        return [dict(r) for r in result]
+            # Personas y proyectos (también por nombre) desde el índice de búsqueda en memoria
+            cedulas, proyectos = ids_coincidentes(search, PERSONA), ids_coincidentes(search, PROYECTO)
+            if cedulas is None or proyectos is None:
+                where.append("(f.cedula LIKE :s OR f.id_proyecto LIKE :s OR d.p_nombre LIKE :s OR d.p_apellido LIKE :s)")
+            else:
+                cond_ced, p_ced = condicion_in("f.cedula", cedulas, "s_ced_")
+                cond_proy, p_proy = condicion_in("f.id_proyecto", proyectos, "s_proy_")
+                where.append(f"({cond_ced} OR {cond_proy} OR f.id_proyecto LIKE :s)")
+                params.update(p_ced); params.update(p_proy)
+            params["s"] = f"{search.strip()}%"
+        for campo, valor in (("f.cedula", cedula), ("f.id_proyecto", id_proyecto), ("f.id_fuente", id_fuente)):
+            if valor:
+                key = campo.split(".")[1]
+                where.append(f"{campo} LIKE :{key}")
+                params[key] = f"{valor.strip()}%"
+        if nombre:
+            cedulas = ids_coincidentes(nombre, PERSONA)
+            if cedulas is None:
+                where.append("(d.p_nombre LIKE :nom OR d.p_apellido LIKE :nom)")
+                params["nom"] = f"{nombre.strip()}%"
+            else:
+                cond, cond_params = condicion_in("f.cedula", cedulas, "nom_")
+                where.append(cond); params.update(cond_params)
+
+        col = MAESTRA_CAMPOS[sort]
+        if cursor:
+            params["cur_val"], params["cur_id"] = _cursor_decode(cursor)
+            where.append(_keyset(col, desc, params["cur_val"]))
+        sentido = "DESC" if desc else "ASC"
+        query = text(f"""
+            SELECT {", ".join(f"{MAESTRA_CAMPOS[c]} AS {c}" for c in pedidos)}
+            {MAESTRA_FROM}
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {col} {sentido}, f.id_financiacion {sentido}
+            LIMIT :lim
+        """)
+        rows = [dict(r) for r in db.execute(query, params).mappings().all()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _cursor_encode(rows[-1][sort], rows[-1]["id_financiacion"])
+        return {"items": rows, "next_cursor": next_cursor}
+    except HTTPException: raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/maestra/financiacion/{id_financiacion}")
+def get_maestra_financiacion_detalle(
+    id_financiacion: str,
+    user: Any = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Registro completo de BFinanciacion para el panel de detalle. Solo admin."""
+    require_role(user, ["admin"])
+    try:
+        row = db.execute(text(f"""
+            SELECT {", ".join(f"{e} AS {c}" for c, e in MAESTRA_CAMPOS.items())}
+            {MAESTRA_FROM}
+            WHERE f.id_financiacion = :id
+        """), {"id": id_financiacion}).mappings().first()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not row:
+        raise HTTPException(status_code=404, detail="Registro no encontrado")
+    return dict(row)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -125,6 +252,7 @@ def update_maestra_financiacion(
             params
         )
         db.commit()
+        tramo_changed(id_financiacion)
 
         # 3. Auditoría con firma correcta del servicio
         audit_svc.log_event(
@@ -134,7 +262,8 @@ def update_maestra_financiacion(
             resource_id=id_financiacion,
             old_values=dict(old_row),
             new_values=item_dict,
-            details=f"Edición directa en Tabla Maestra. Justificación: {item_dict.get('justificacion', 'N/A')}"
+            details=f"Edición directa en Tabla Maestra. Justificación: {item_dict.get('justificacion', 'N/A')}",
+            sincrono=True
         )
 
         return {"ok": True, "message": "Registro actualizado"}
@@ -171,6 +300,7 @@ def delete_maestra_financiacion(
             {"id": id_financiacion}
         )
         db.commit()
+        tramo_changed(id_financiacion)
 
         audit_svc.log_event(
             actor_email=user["email"],
@@ -179,7 +309,8 @@ def delete_maestra_financiacion(
             resource_id=id_financiacion,
             old_values=dict(old_row),
             new_values=None,
-            details="Eliminación directa en Tabla Maestra por administrador"
+            details="Eliminación directa en Tabla Maestra por administrador",
+            sincrono=True
         )
 
         return {"ok": True, "message": "Registro eliminado"}
@@ -236,6 +367,7 @@ def create_maestra_financiacion(
             params
         )
         db.commit()
+        tramo_changed(new_id)
 
         audit_svc.log_event(
             actor_email=user["email"],
@@ -244,7 +376,8 @@ def create_maestra_financiacion(
             resource_id=new_id,
             old_values=None,
             new_values=item_dict,
-            details="Creación directa en Tabla Maestra por administrador"
+            details="Creación directa en Tabla Maestra por administrador",
+            sincrono=True
         )
 
         return {"ok": True, "id": new_id}
@@ -263,25 +396,24 @@ def get_catalogos_nombres(
 ):
     """
     Obtiene diccionarios de códigos a nombres para todos los catálogos financieros.
-    Solo admin. Usa la sesión db existente para eficiencia.
+    Solo admin. Usa la caché de datos de referencia.
     """
     require_role(user, ["admin"])
     try:
-        def safe_fetch(query_str: str) -> dict:
-            """Ejecuta una query y devuelve dict {codigo: nombre}. Silencia errores si la tabla no existe."""
+        def safe_fetch(nombre: str) -> dict:
+            """Devuelve dict {codigo: nombre} del catálogo. Silencia errores si la tabla no existe."""
             try:
-                rows = db.execute(text(query_str)).fetchall()
-                return {r[0]: r[1] for r in rows if r[0]}
+                return {k: v for k, v in get_catalogo(nombre).items() if k}
             except Exception:
                 return {}
 
         catalogos = {
-            "id_proyecto":      safe_fetch("SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros"),
-            "id_fuente":        safe_fetch("SELECT codigo, nombre FROM dim_fuentes"),
-            "id_componente":    safe_fetch("SELECT codigo, nombre FROM dim_componentes"),
-            "id_subcomponente": safe_fetch("SELECT codigo, nombre FROM dim_subcomponentes"),
-            "id_categoria":     safe_fetch("SELECT codigo, nombre FROM dim_categorias"),
-            "id_responsable":   safe_fetch("SELECT codigo, nombre FROM dim_responsables"),
+            "id_proyecto":      safe_fetch("proyectos"),
+            "id_fuente":        safe_fetch("fuentes"),
+            "id_componente":    safe_fetch("componentes"),
+            "id_subcomponente": safe_fetch("subcomponentes"),
+            "id_categoria":     safe_fetch("categorias"),
+            "id_responsable":   safe_fetch("responsables"),
         }
 
         return {"ok": True, "catalogos": catalogos}
@@ -1,16 +1,24 @@
 import math
 import json
+import time
+import asyncio
 import datetime
 from typing import Any, Dict, List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy import text
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from app.core.config import settings
 from app.core.security import get_current_user, require_role
-from app.core.database import engine
+from app.core.database import conexion, engine, transaccion
 from app.core.constants import PAGO_EXPR
 from app.models.schemas import TramoFinanciacion
 from app.core.utils import to_date
 from app.services.payroll_service_optimized import mensualizar_base_30_optimized as mensualizar_base_30
 from app.services.audit_service import AuditService
+from app.services.notificaciones import contar_no_leidas, desuscribir, formato_sse, publicar, suscribir
+from app.services.reference_data import get_incrementos, get_catalogo
+from app.services.payroll_rules import calcular_mes, conceptos_tramos
 from app.core.database import get_db
 from sqlalchemy.orm import Session
 
@@ -83,6 +91,39 @@ def get_my_notifications(user: Dict[str, Any] = Depends(get_current_user), db: S
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/me/notifications/stream")
+async def stream_my_notifications(request: Request, user: Dict[str, Any] = Depends(get_current_user)):
+    """
+    Stream SSE de notificaciones: al conectar envía `estado` ({no_leidas}) y luego cada
+    `notificacion` nueva en cuanto se publica. Lo publicado en otra instancia de Cloud Run lo
+    trae el sondeo compartido de notificaciones.py; el stream no consulta la BD después de conectar.
+    """
+    require_role(user, ["admin", "user", "financiero", "talento", "nomina"])
+    email = user["email"]
+    cola = suscribir(email)
+
+    async def eventos():
+        try:
+            no_leidas = await run_in_threadpool(contar_no_leidas, email)
+            yield "retry: 5000\n" + formato_sse({"tipo": "estado", "data": {"no_leidas": no_leidas}})
+            fin = time.monotonic() + settings.NOTIFICACIONES_STREAM_MAX_SECONDS
+            while time.monotonic() < fin:
+                if await request.is_disconnected():
+                    break
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=settings.NOTIFICACIONES_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield formato_sse(evento)
+        finally:
+            desuscribir(email, cola)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
 @router.post("/me/notifications/read-all")
 def mark_all_notifications_as_read(user: Dict[str, Any] = Depends(get_current_user), db: Session = Depends(get_db)):
     """ Marca todas las notificaciones como leídas """
@@ -90,97 +131,61 @@ def mark_all_notifications_as_read(user: Dict[str, Any] = Depends(get_current_us
     try:
         db.execute(text("UPDATE BNotificaciones SET leido = 1 WHERE usuario_email = :email"), {"email": user["email"]})
         db.commit()
+        # Las otras pestañas del usuario limpian su contador
+        publicar(user["email"], {"tipo": "estado", "data": {"no_leidas": 0}})
         return {"ok": True}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/financiacion/{cedula}")
-def obtener_financiacion(cedula: str, _user: Dict[str, Any] = Depends(get_current_user)):
-    require_role(_user, ["admin", "user", "financiero", "talento", "nomina"])
-    query = text(f"""
-    WITH CalculosBase AS (
-        SELECT 
-            f.id_financiacion, f.id_contrato, f.cedula,
-            f.fecha_inicio, f.fecha_fin, f.id_proyecto,
-            f.salario_base,
-            {PAGO_EXPR} AS pago,
-            f.rubro, f.id_fuente, f.id_componente, f.id_subcomponente, f.id_categoria, f.id_responsable,
-            p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, c.atep,
-            i.anio, i.smlv, i.transporte, i.porcentaje_aumento, i.dotacion AS i_dotacion,
-
-            CEILING(f.salario_base * (CASE WHEN COALESCE(i.porcentaje_aumento, 0) > 0 THEN i.porcentaje_aumento / 100 ELSE 1 END) / 1000) * 1000 AS salario_calc
-        FROM BFinanciacion f
-        LEFT JOIN BContrato c ON f.id_contrato = c.id_contrato
-        LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
-        LEFT JOIN BIncremento i ON YEAR(f.fecha_inicio) = i.anio
-        WHERE f.cedula = :cedula
-    ),
-    CalculosPrestacionales AS (
-        SELECT 
-            *,
-            CASE 
-                WHEN cargo <> 'Lectiva' AND salario_calc <= (2 * COALESCE(smlv, 0)) THEN COALESCE(transporte, 0)
-                ELSE 0 
-            END AS aux_transporte,
-            CASE
-                WHEN cargo = 'Lectiva' OR salario_calc > (COALESCE(smlv, 0) * 2) THEN 0
-                ELSE CEILING(COALESCE(i_dotacion, 0) / 12)
-            END AS dotacion
-        FROM CalculosBase
-    ),
-    CalculosFinales AS (
-        SELECT 
-            *,
-            CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN 0 ELSE FLOOR((salario_calc + aux_transporte) * 0.0834) END AS primas,
-            CASE WHEN cargo = 'Lectiva' THEN 0 ELSE FLOOR(salario_calc * 0.0417) END AS s_vacaciones,
-            CASE WHEN cargo = 'Lectiva' THEN 0 ELSE FLOOR(salario_calc * 0.0417) END AS sueldo_vacaciones,
-            CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN 0 ELSE FLOOR((salario_calc + aux_transporte) * 0.0834) END AS cesantias,
-            CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN 0 ELSE FLOOR((salario_calc + aux_transporte) * 0.01) END AS i_cesantias,
-            CASE 
-                WHEN cargo = 'Lectiva' THEN (ROUND((COALESCE(smlv, 0) * 0.125) / 100) * 100) 
-                WHEN banda = 'B01' THEN (ROUND(((salario_calc * 0.7) * 0.125) / 100) * 100 - FLOOR((salario_calc * 0.7) * 0.04))
-                ELSE (ROUND((salario_calc * 0.125) / 100) * 100) - FLOOR(salario_calc * 0.04) 
-            END AS salud,
-            CASE
-                WHEN cargo = 'Lectiva' OR posicion_c IN ('IHPO_119', 'IHPO_6ac') THEN 0
-                WHEN banda = 'B01' THEN (ROUND(((salario_calc * 0.7) * 0.16) / 100) * 100) - FLOOR((salario_calc * 0.7) * 0.04)
-                ELSE (ROUND((salario_calc * 0.16) / 100) * 100) - FLOOR(salario_calc * 0.04)
-            END AS pension,
-            CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN ROUND((salario_calc * 0.7 * 0.04)/100)*100 ELSE ROUND((salario_calc * 0.04)/100)*100 END AS ccf,
-            CASE WHEN familia = 'Aprendiz' THEN 0 WHEN banda = 'B01' THEN ROUND((salario_calc * 0.7 * 0.02)/100)*100 ELSE ROUND((salario_calc * 0.02)/100)*100 END AS sena,
-            CASE WHEN familia = 'Aprendiz' THEN 0 WHEN banda = 'B01' THEN ROUND((salario_calc * 0.7 * 0.03)/100)*100 ELSE ROUND((salario_calc * 0.03)/100)*100 END AS icbf,
-            CASE 
-                WHEN familia = 'Aprendiz' OR cargo = 'Lectiva' THEN ROUND((COALESCE(smlv, 0) * COALESCE(atep, 0)) / 100) * 100
-                WHEN banda = 'B01' THEN ROUND(((salario_calc * 0.7) * COALESCE(atep, 0)) / 100) * 100
-                ELSE ROUND((salario_calc * COALESCE(atep, 0)) / 100) * 100
-            END AS arl
-        FROM CalculosPrestacionales
-    )
-    SELECT 
-        *,
-        -- Override stored value with real-time calculation to ensure consistency
-        (salario_calc + aux_transporte + dotacion + primas + s_vacaciones + sueldo_vacaciones + 
-         cesantias + i_cesantias + salud + pension + arl + ccf + sena + icbf) AS salario_t,
-         
-        (salario_calc + aux_transporte + dotacion + primas + s_vacaciones + sueldo_vacaciones + 
-         cesantias + i_cesantias + salud + pension + arl + ccf + sena + icbf) AS salario_final_calculado
-    FROM CalculosFinales;
-    """)
-
-    with engine.connect() as conn:
-        result = conn.execute(query, {"cedula": cedula})
-        rows = result.mappings().all()
+# Columnas históricas de los tramos (antes calculadas en CTEs SQL) -> concepto de payroll_rules
+COLUMNAS_CONCEPTOS = {
+    "salario_calc": "salario_mes", "aux_transporte": "aux_transporte", "dotacion": "dotacion",
+    "primas": "primas", "s_vacaciones": "prima_vacaciones", "sueldo_vacaciones": "sueldo_vacaciones",
+    "cesantias": "cesantias", "i_cesantias": "i_cesantias", "salud": "salud", "pension": "pension",
+    "arl": "arl", "ccf": "ccf", "sena": "sena", "icbf": "icbf",
+}
 
+def _calcular_tramos(rows, incrementos) -> List[Dict[str, Any]]:
+    """Tramos con el incremento del año de inicio y los conceptos del mes completo."""
     tramos = []
     for row in rows:
         d = dict(row)
         for k, v in d.items():
             if hasattr(v, '__float__') and v is not None:
                 d[k] = float(v)
+        inc = incrementos.get(d["fecha_inicio"].year) if d.get("fecha_inicio") else None
+        d["anio"] = inc.get("anio") if inc else None
+        for k, col in (("smlv", "smlv"), ("transporte", "transporte"), ("porcentaje_aumento", "porcentaje_aumento"), ("i_dotacion", "dotacion")):
+            v = inc.get(col) if inc else None
+            d[k] = float(v) if v is not None else None
         tramos.append(d)
 
-    return {"ok": True, "tramos": tramos}
+    res = conceptos_tramos(tramos, incrementos)
+    for i, d in enumerate(tramos):
+        for col, concepto in COLUMNAS_CONCEPTOS.items():
+            d[col] = float(res[concepto][i])
+        d["salario_t"] = d["salario_final_calculado"] = float(res["total"][i])
+    return tramos
+
+@router.get("/financiacion/{cedula}")
+def obtener_financiacion(cedula: str, _user: Dict[str, Any] = Depends(get_current_user)):
+    require_role(_user, ["admin", "user", "financiero", "talento", "nomina"])
+    query = text(f"""
+        SELECT f.id_financiacion, f.id_contrato, f.cedula, f.fecha_inicio, f.fecha_fin, f.id_proyecto, f.salario_base,
+               {PAGO_EXPR} AS pago, f.rubro, f.id_fuente, f.id_componente, f.id_subcomponente, f.id_categoria, f.id_responsable,
+               p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, c.atep
+        FROM BFinanciacion f
+        LEFT JOIN BContrato c ON f.id_contrato = c.id_contrato
+        LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
+        WHERE f.cedula = :cedula
+    """)
+
+    incrementos = get_incrementos()
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"cedula": cedula}).mappings().all()
+
+    return {"ok": True, "tramos": _calcular_tramos(rows, incrementos)}
 
 @router.get("/consulta/{cedula}")
 def obtener_consulta_individual(
@@ -205,7 +210,7 @@ def obtener_consulta_individual(
     try:
         empleado_query = text("SELECT cedula, p_nombre, s_nombre, p_apellido, s_apellido, correo_electronico FROM BData WHERE cedula = :cedula LIMIT 1")
         contrato_query = text("""
-            SELECT c.id_contrato, c.posicion, p.Cargo as cargo, p.Rol as rol, p.Banda as banda, c.salario, c.nivel_riesgo, c.atep,
+            SELECT c.id_contrato, c.posicion, p.Cargo as cargo, p.Rol as rol, p.Banda as banda, p.Familia as familia, c.salario, c.nivel_riesgo, c.atep,
                    p.Direccion as direccion, p.Gerencia as gerencia, p.Area as area, p.Subarea as subarea, p.Planta as planta,
                    p.Tipo_planta as tipo_planta, c.num_contrato, c.fecha_ingreso, c.fecha_terminacion, c.fecha_terminacion_real, c.prorrogas_fecha, c.estado, p.Base_Fuente as base_fuente
             FROM BContrato c
@@ -215,58 +220,18 @@ def obtener_consulta_individual(
             LIMIT 1
         """)
         tramos_query = text(f"""
-        WITH CalculosBase AS (
             SELECT f.id_financiacion, f.id_contrato, f.cedula, f.fecha_inicio, f.fecha_fin, f.id_proyecto, f.salario_base,
                    {PAGO_EXPR} AS pago, f.rubro, f.id_fuente, f.id_componente, f.id_subcomponente, f.id_categoria, f.id_responsable,
-                   p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, c.atep, c.estado, c.fecha_terminacion_real,
-                   i.anio, i.smlv, i.transporte, i.porcentaje_aumento, i.dotacion AS i_dotacion,
-                   CEILING(f.salario_base * (CASE WHEN COALESCE(i.porcentaje_aumento, 0) > 0 THEN i.porcentaje_aumento / 100 ELSE 1 END) / 1000) * 1000 AS salario_calc
+                   p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, c.atep, c.estado, c.fecha_terminacion_real
             FROM BFinanciacion f
             LEFT JOIN BContrato c ON f.id_contrato = c.id_contrato
             LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
-            LEFT JOIN BIncremento i ON YEAR(f.fecha_inicio) = i.anio
             WHERE f.cedula = :cedula
-        ),
-        CalculosPrestacionales AS (
-            SELECT *,
-                CASE WHEN cargo <> 'Lectiva' AND salario_calc <= (2 * COALESCE(smlv, 0)) THEN COALESCE(transporte, 0) ELSE 0 END AS aux_transporte,
-                CASE WHEN cargo = 'Lectiva' OR salario_calc > (COALESCE(smlv, 0) * 2) THEN 0 ELSE CEILING(COALESCE(i_dotacion, 0) / 12) END AS dotacion
-            FROM CalculosBase
-        ),
-        CalculosFinales AS (
-            SELECT *,
-                CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN 0 ELSE FLOOR((salario_calc + aux_transporte) * 0.0834) END AS primas,
-                CASE WHEN cargo = 'Lectiva' THEN 0 ELSE FLOOR(salario_calc * 0.0417) END AS s_vacaciones,
-                CASE WHEN cargo = 'Lectiva' THEN 0 ELSE FLOOR(salario_calc * 0.0417) END AS sueldo_vacaciones,
-                CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN 0 ELSE FLOOR((salario_calc + aux_transporte) * 0.0834) END AS cesantias,
-                CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN 0 ELSE FLOOR((salario_calc + aux_transporte) * 0.01) END AS i_cesantias,
-                CASE WHEN cargo = 'Lectiva' THEN (ROUND((COALESCE(smlv, 0) * 0.125) / 100) * 100) 
-                     WHEN banda = 'B01' THEN (ROUND(((salario_calc * 0.7) * 0.125) / 100) * 100 - FLOOR((salario_calc * 0.7) * 0.04))
-                     ELSE (ROUND((salario_calc * 0.125) / 100) * 100 - FLOOR(salario_calc * 0.04)) END AS salud,
-                CASE WHEN cargo = 'Lectiva' OR posicion_c IN ('IHPO_119', 'IHPO_6ac') THEN 0
-                     WHEN banda = 'B01' THEN (ROUND(((salario_calc * 0.7) * 0.16) / 100) * 100 - FLOOR((salario_calc * 0.7) * 0.04))
-                     ELSE (ROUND((salario_calc * 0.16) / 100) * 100 - FLOOR(salario_calc * 0.04)) END AS pension,
-                CASE WHEN cargo = 'Lectiva' THEN 0 WHEN banda = 'B01' THEN ROUND((salario_calc * 0.7 * 0.04)/100)*100 ELSE ROUND((salario_calc * 0.04)/100)*100 END AS ccf,
-                CASE WHEN familia = 'Aprendiz' THEN 0 WHEN banda = 'B01' THEN ROUND((salario_calc * 0.7 * 0.02)/100)*100 ELSE ROUND((salario_calc * 0.02)/100)*100 END AS sena,
-                CASE WHEN familia = 'Aprendiz' THEN 0 
-                     WHEN banda = 'B01' THEN ROUND((salario_calc * 0.7 * 0.03)/100)*100 
-                     ELSE ROUND((salario_calc * 0.03)/100)*100 END AS icbf,
-                CASE WHEN familia = 'Aprendiz' THEN ROUND(COALESCE(smlv, 0) * 1.0 * COALESCE(atep, 0) / 100) * 100
-                     WHEN banda = 'B01' THEN ROUND(((salario_calc * 0.7) * 1.0 * COALESCE(atep, 0)) / 100) * 100
-                     ELSE ROUND(salario_calc * 1.0 * COALESCE(atep, 0) / 100) * 100 END AS arl
-            FROM CalculosPrestacionales
-        )
-        SELECT *,
-            (salario_calc + aux_transporte + dotacion + primas + s_vacaciones + sueldo_vacaciones + 
-             cesantias + i_cesantias + salud + pension + arl + ccf + sena + icbf) AS salario_t
-        FROM CalculosFinales
-        ORDER BY fecha_inicio ASC;
+            ORDER BY f.fecha_inicio ASC
         """)
 
-        inc_query = text("SELECT * FROM BIncremento")
-        with engine.connect() as conn:
-            incs = conn.execute(inc_query).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs}
+        incrementos = get_incrementos()
+        with conexion() as conn:
             empleado = conn.execute(empleado_query, {"cedula": cedula}).mappings().first()
             if not empleado:
                 raise HTTPException(status_code=404, detail="No se encontró el trabajador.")
@@ -277,28 +242,21 @@ def obtener_consulta_individual(
             comp_lookup = {}
             proj_lookup = {}
             try:
-                c_rows = conn.execute(text("SELECT codigo, nombre FROM dim_componentes")).fetchall()
-                comp_lookup = {r[0]: r[1] for r in c_rows}
-                
-                p_rows = conn.execute(text("SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros")).fetchall()
-                proj_lookup = {r[0]: r[1] for r in p_rows}
+                comp_lookup = get_catalogo("componentes")
+                proj_lookup = get_catalogo("proyectos")
             except: pass
 
         nombre_parts = [empleado.get("p_nombre"), empleado.get("s_nombre"), empleado.get("p_apellido"), empleado.get("s_apellido")]
         nombre = " ".join(part for part in nombre_parts if part).strip()
 
-        tramos_data = []
-        for row in tramos_rows:
-            d = dict(row)
+        tramos_data = _calcular_tramos(tramos_rows, incrementos)
+        for d in tramos_data:
             est = (d.get("estado") or "").upper()
             term_real = to_date(d.get("fecha_terminacion_real"))
             if "ACTIVO" not in est and term_real:
                 tr_fin = to_date(d["fecha_fin"])
                 if tr_fin > term_real:
                     d["fecha_fin"] = term_real
-            for k, v in d.items():
-                if hasattr(v, '__float__') and v is not None: d[k] = float(v)
-            tramos_data.append(d)
 
         mensualizado = mensualizar_base_30(tramos_data, incrementos)
         
@@ -385,61 +343,18 @@ def obtener_consulta_individual(
             sal_base_con = float(c_dict.get("salario") or 0)
             # Fetch increment for current year to be precise in "Estimated" cost
             current_year = datetime.datetime.now().year
-            inc_con = incrementos.get(current_year) or {}
-            porc_c = float(inc_con.get("porcentaje_aumento") or 0)
-            smlv_c = float(inc_con.get("smlv") or 0)
-            trans_c = float(inc_con.get("transporte") or 0)
-            dot_c_val = float(inc_con.get("dotacion") or 0)
-
-            sal_calc_c = sal_base_con * (porc_c / 100.0 if porc_c > 0 else 1.0)
-            sal_calc_c = float(int(sal_calc_c / 1000 + 0.999) * 1000)
-            
-            aux_t_c = trans_c if (sal_calc_c <= 2 * smlv_c and c_dict.get("cargo") != "Lectiva") else 0
-            dot_c = 0 if (c_dict.get("cargo") == "Lectiva" or sal_calc_c > (smlv_c * 2)) else int(dot_c_val / 12)
-            
-            # Simplified Logic for Header KPI (1 Month) - RESTORED ORIGINAL
-            is_l = (c_dict.get("cargo") == "Lectiva")
-            is_b = (c_dict.get("banda") == "B01")
-            
-            primas_c = 0 if (is_l or is_b) else int((sal_calc_c + aux_t_c) * 0.0834)
-            s_vac_c = 0 if is_l else int(sal_calc_c * 0.0417)
-            ces_c = 0 if (is_l or is_b) else int((sal_calc_c + aux_t_c) * 0.0834)
-            i_ces_c = 0 if (is_l or is_b) else int((sal_calc_c + aux_t_c) * 0.01)
-            
-            # Salud
-            if is_l:
-                salud_c = (int(sal_calc_c * 0.125 / 100.0 + 0.5) * 100.0)
-            elif is_b:
-                base_i = sal_calc_c * 0.7
-                total_s = (int(base_i * 0.125 / 100.0 + 0.5) * 100.0)
-                emp_s = int(base_i * 0.04)
-                salud_c = total_s - emp_s
-            else:
-                total_s = (int(sal_calc_c * 0.125 / 100.0 + 0.5) * 100.0)
-                emp_s = int(sal_calc_c * 0.04)
-                salud_c = total_s - emp_s
-
-            pension_c = 0
-            if not(is_l or c_dict.get("posicion") in ("IHPO_119", "IHPO_6ac")):
-                base_p = sal_calc_c * 0.7 if is_b else sal_calc_c
-                total_p = (int(base_p * 0.16 / 100.0 + 0.5) * 100.0)
-                emp_p = int(base_p * 0.04)
-                pension_c = total_p - emp_p
-            
-            ccf_c = 0 if is_l else int((sal_calc_c * (0.7 if is_b else 1.0) * 0.04 / 100.0 + 0.5)) * 100.0
-            sena_c = 0 if (c_dict.get("familia") == "Aprendiz") else int((sal_calc_c * (0.7 if is_b else 1.0) * 0.02 / 100.0 + 0.5)) * 100.0
-            icbf_c = 0 if (c_dict.get("familia") == "Aprendiz") else int((sal_calc_c * (0.7 if is_b else 1.0) * 0.03 / 100.0 + 0.5)) * 100.0
-            arl_c = int((sal_calc_c * (0.7 if is_b else 1.0) * (c_dict.get("atep") or 0) / 100.0 / 100.0 + 0.5)) * 100.0
-            
-            total_carga_con = (sal_calc_c + aux_t_c + dot_c + primas_c + (s_vac_c * 2) + ces_c + i_ces_c + salud_c + pension_c + arl_c + ccf_c + sena_c + icbf_c)
-            
-            cabecera["TOTAL_CARGA_SALARIAL"] = total_carga_con
+            mes_c = calcular_mes(sal_base_con, incrementos.get(current_year), {
+                "cargo": c_dict.get("cargo"), "banda": c_dict.get("banda"), "familia": c_dict.get("familia"),
+                "posicion_c": c_dict.get("posicion"), "atep": c_dict.get("atep"),
+            })
+
+            cabecera["TOTAL_CARGA_SALARIAL"] = mes_c["total"]
             cabecera["ULTIMO_MES_LABEL"] = f"Calculado según Contrato (Base: ${sal_base_con:,.0f})"
             cabecera["CONCEPTOS_MES"] = {
-                "Salario_Calc": sal_calc_c, "Aux_Transporte": aux_t_c, "Dotacion": dot_c,
-                "PrimaS": primas_c, "sueldo_vacaciones": s_vac_c, "prima_vacaciones": s_vac_c, 
-                "Cesantias": ces_c, "ICesantias": i_ces_c,
-                "Salud": salud_c, "Pension": pension_c, "ARL": arl_c, "Parafiscales": (ccf_c + sena_c + icbf_c)
+                "Salario_Calc": mes_c["salario_mes"], "Aux_Transporte": mes_c["aux_transporte"], "Dotacion": mes_c["dotacion"],
+                "PrimaS": mes_c["primas"], "sueldo_vacaciones": mes_c["sueldo_vacaciones"], "prima_vacaciones": mes_c["prima_vacaciones"], 
+                "Cesantias": mes_c["cesantias"], "ICesantias": mes_c["i_cesantias"],
+                "Salud": mes_c["salud"], "Pension": mes_c["pension"], "ARL": mes_c["arl"], "Parafiscales": (mes_c["ccf"] + mes_c["sena"] + mes_c["icbf"])
             }
 
         ret_dict = {
@@ -491,13 +406,13 @@ def guardar_tramo(
         resource_id = None
         new_values = None
         
-        with engine.connect() as conn:
+        with conexion() as conn:
             # Check Employee Name (to include in justification)
             q_emp = text("SELECT CONCAT_WS(' ', p_nombre, s_nombre, p_apellido, s_apellido) FROM BData WHERE cedula = :ced")
             empleado_nombre = conn.execute(q_emp, {"ced": dato.cedula}).scalar() or "Desconocido"
 
             # Check Contract
-            q_contrato = text("SELECT id_contrato, posicion, cargo, banda, familia, salario FROM BContrato WHERE cedula = :ced ORDER BY CASE WHEN estado LIKE 'Activo' THEN 0 ELSE 1 END, fecha_ingreso DESC LIMIT 1")
+            q_contrato = text("SELECT id_contrato, posicion, cargo, banda, familia, salario, atep FROM BContrato WHERE cedula = :ced ORDER BY CASE WHEN estado LIKE 'Activo' THEN 0 ELSE 1 END, fecha_ingreso DESC LIMIT 1")
             con_row = conn.execute(q_contrato, {"ced": dato.cedula}).mappings().first()
             if not con_row: raise HTTPException(status_code=400, detail="El empleado no tiene un contrato registrado.")
             
@@ -509,40 +424,10 @@ def guardar_tramo(
                     detail=f"El salario del tramo (${dato.salario:,.0f}) no puede ser menor al salario pactado en contrato (${contract_salary:,.0f})."
                 )
             
-            # Fetch Increment Data
-            anio_inicio = dato.fechaInicio.year
-            q_inc = text("SELECT * FROM BIncremento WHERE anio = :anio")
-            inc = conn.execute(q_inc, {"anio": anio_inicio}).mappings().first()
-            
-            # Pre-calculation Logic (Preserved from original)
-            salario_base = float(dato.salario); porc = float(inc.get("porcentaje_aumento") or 0) if inc else 0; smlv = float(inc.get("smlv") or 0) if inc else 0; transporte = float(inc.get("transporte") or 0) if inc else 0; i_dotacion = float(inc.get("dotacion") or 0) if inc else 0
-            salario_calc = salario_base * (porc / 100 if porc > 0 else 1.0); salario_calc = float(int(salario_calc / 1000 + 0.999) * 1000)
-            aux_t = transporte if (salario_calc <= 2 * smlv and con_row["cargo"] != "Lectiva") else 0; dotacion = 0 if (con_row["cargo"] == "Lectiva" or salario_calc > (smlv * 2)) else int(i_dotacion / 12)
-            primas = 0 if (con_row["cargo"] == "Lectiva" or con_row["banda"] == "B01") else int((salario_calc + aux_t) * 0.0834); s_vac = 0 if (con_row["cargo"] == "Lectiva") else int(salario_calc * 0.0417); ces = 0 if (con_row["cargo"] == "Lectiva" or con_row["banda"] == "B01") else int((salario_calc + aux_t) * 0.0834); i_ces = 0 if (con_row["cargo"] == "Lectiva" or con_row["banda"] == "B01") else int((salario_calc + aux_t) * 0.01)
-            
-            if con_row["cargo"] == "Lectiva":
-                salud = (int(smlv * 0.125 / 100 + 0.5) * 100)
-            elif con_row["banda"] == "B01":
-                base_integral = salario_calc * 0.7
-                salud = (int(base_integral * 0.125 / 100 + 0.5) * 100) - (int(base_integral * 0.04))
-            else:
-                salud = (int(salario_calc * 0.125 / 100 + 0.5) * 100) - (int(salario_calc * 0.04))
-            
-            pension = 0
-            if not(con_row["cargo"] == "Lectiva" or con_row["posicion"] in ("IHPO_119", "IHPO_6ac")):
-                base_p = salario_calc * 0.7 if con_row["banda"] == "B01" else salario_calc
-                pension = (int(base_p * 0.16 / 100 + 0.5) * 100) - (int(base_p * 0.04))
-            
-            ccf = 0 if con_row["cargo"] == "Lectiva" else int(salario_calc * (0.7 if con_row["banda"] == "B01" else 1.0) * 0.04 / 100 + 0.5) * 100
-            sena = 0 if con_row["familia"] == "Aprendiz" else int(salario_calc * (0.7 if con_row["banda"] == "B01" else 1.0) * 0.02 / 100 + 0.5) * 100
-            icbf = 0 if con_row["familia"] == "Aprendiz" else int(salario_calc * (0.7 if con_row["banda"] == "B01" else 1.0) * 0.03 / 100 + 0.5) * 100
-            
-            # Add ARL (Missing from original guardar_tramo)
-            atep_val = float(con_row.get("atep") or 0)
-            base_arl = smlv if con_row["familia"] == "Aprendiz" else (salario_calc * 0.7 if con_row["banda"] == "B01" else salario_calc)
-            arl = int(base_arl * 1.0 * atep_val / 100 + 0.5) * 100 # Standard 30 days month (pago=1.0)
-
-            salario_t = (salario_calc + aux_t + dotacion + primas + (s_vac * 2) + ces + i_ces + salud + pension + arl + ccf + sena + icbf)
+            # Carga del mes completo con las reglas de payroll_rules (incremento del año de inicio)
+            inc = get_incrementos().get(dato.fechaInicio.year)
+            conceptos = calcular_mes(dato.salario, inc, {**con_row, "posicion_c": con_row["posicion"]})
+            salario_t = conceptos["total"]
             
             params = {
                 "fecha_inicio": dato.fechaInicio, 
@@ -654,7 +539,7 @@ def guardar_tramo(
                 }
                 msg_final = "✅ Solicitud enviada exitosamente. El cambio quedará en estado 'Pendiente' hasta que sea autorizado por la Dirección."
 
-            with engine.begin() as tx:
+            with transaccion() as tx:
                 tx.execute(sql_req, params_req)
                 
             # --- LOG DE AUDITORÍA CENTRAL (BAuditoria) ---
@@ -691,7 +576,7 @@ def eliminar_tramo(id_f: str, user: Dict[str, Any] = Depends(get_current_user),
     try:
         old_values = None
         
-        with engine.connect() as conn:
+        with conexion() as conn:
             q_old = text("SELECT * FROM BFinanciacion WHERE id_financiacion = :id")
             old_row = conn.execute(q_old, {"id": id_f}).mappings().first()
             if old_row:
@@ -755,7 +640,7 @@ def eliminar_tramo(id_f: str, user: Dict[str, Any] = Depends(get_current_user),
                 }
                 msg = "Solicitud de eliminación enviada a aprobación. El registro seguirá visible hasta ser autorizado."
             
-            with engine.begin() as tx:
+            with transaccion() as tx:
                 tx.execute(sql_req, params_req)
         
         return {
@@ -770,20 +655,11 @@ def eliminar_tramo(id_f: str, user: Dict[str, Any] = Depends(get_current_user),
 def obtener_catalogos(_user: Dict[str, Any] = Depends(get_current_user)):
     require_role(_user, ["admin", "user", "financiero", "talento", "nomina"])
     try:
-        dimensiones = {"fuentes": "dim_fuentes", "componentes": "dim_componentes", "subcomponentes": "dim_subcomponentes", "categorias": "dim_categorias", "responsables": "dim_responsables"}
         output = {}
-        with engine.connect() as conn:
+        for key in ("proyectos", "fuentes", "componentes", "subcomponentes", "categorias", "responsables"):
             try:
-                q_proy = text("SELECT codigo AS id, nombre FROM dim_proyectos UNION SELECT codigo AS id, nombre FROM dim_proyectos_otros")
-                res_proy = conn.execute(q_proy).mappings().all()
-                output["proyectos"] = [dict(r) for r in res_proy]
-            except Exception: output["proyectos"] = []
-            for key, table in dimensiones.items():
-                try:
-                    q = text(f"SELECT codigo AS id, nombre FROM {table}")
-                    res = conn.execute(q).mappings().all()
-                    output[key] = [dict(r) for r in res]
-                except Exception: output[key] = []
+                output[key] = [{"id": codigo, "nombre": nombre} for codigo, nombre in get_catalogo(key).items()]
+            except Exception: output[key] = []
         return output
     except Exception as e:
         if _user.get("source") == "local_debug":
@@ -0,0 +1,103 @@
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from app.core.security import get_current_user, require_role
+from app.services.jobs import (
+    JobContext, cancelar, encolar, listar_jobs, obtener_job, reintentar, registrar_tarea, tipos_registrados
+)
+from app.services.projection_state import invalidar_estado
+from app.services.search_index import solicitar_reconstruccion
+# Registran sus trabajos al importarse ("nomina_upload")
+import app.services.nomina_ingesta  # noqa: F401
+
+router = APIRouter()
+
+# --- Sincronizaciones (scripts en backend/) como trabajos ---
+
+@registrar_tarea("sync_posiciones")
+def _sync_posiciones(ctx: JobContext) -> Dict[str, Any]:
+    from sync_vacantes import sync_posicion_states
+    ctx.verificar()
+    res = sync_posicion_states()
+    # El estado de las posiciones alimenta el tablero de vacantes y la proyección por año
+    invalidar_estado()
+    return {**res, "mensaje": f"Posiciones: {res['activas']} activas, {res['vacantes']} vacantes"}
+
+@registrar_tarea("sync_novasoft")
+def _sync_novasoft(ctx: JobContext) -> Dict[str, Any]:
+    from sync_novasoft import run_sync
+    ctx.verificar()
+    resumen = run_sync(progreso=lambda pct, msg: ctx.progreso(pct, msg))
+    # Catálogos de proyectos actualizados: el índice de búsqueda se reconstruye
+    solicitar_reconstruccion()
+    errores = [t for t, v in resumen.items() if isinstance(v, str)]
+    if errores:
+        raise RuntimeError(f"Sincronización con errores en: {', '.join(errores)} ({resumen})")
+    return {"tablas": resumen, "mensaje": f"Novasoft sincronizado: {sum(resumen.values())} registros nuevos"}
+
+SYNC_TIPOS = ("sync_posiciones", "sync_novasoft")
+
+
+def _visible(job: Optional[Dict[str, Any]], user: Dict[str, Any]) -> Dict[str, Any]:
+    """Admin ve todos los trabajos; los demás roles solo los propios."""
+    if not job or (user.get("role") != "admin" and job.get("creado_por") != user.get("email")):
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@router.get("")
+def get_jobs(
+    tipo: Optional[str] = None,
+    estado: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    user: Any = Depends(get_current_user)
+):
+    """ Trabajos recientes (más nuevos primero) """
+    require_role(user, ["admin", "nomina"])
+    try:
+        jobs = listar_jobs(tipo, estado, limit)
+        if user.get("role") != "admin":
+            jobs = [j for j in jobs if j.get("creado_por") == user.get("email")]
+        return jobs
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/tipos")
+def get_job_tipos(user: Any = Depends(get_current_user)):
+    require_role(user, ["admin"])
+    return tipos_registrados()
+
+@router.get("/{job_id}")
+def get_job(job_id: str, user: Any = Depends(get_current_user)):
+    """ Estado, progreso y resultado de un trabajo """
+    require_role(user, ["admin", "nomina"])
+    return _visible(obtener_job(job_id), user)
+
+@router.post("/sync/{tipo}", status_code=202)
+def lanzar_sync(tipo: str, user: Any = Depends(get_current_user)):
+    """ Lanza una sincronización (sync_posiciones, sync_novasoft) en segundo plano """
+    require_role(user, ["admin"])
+    if tipo not in SYNC_TIPOS:
+        raise HTTPException(status_code=400, detail=f"Sincronización desconocida: {tipo}. Use {', '.join(SYNC_TIPOS)}.")
+    try:
+        return {"job_id": encolar(tipo, {}, user.get("email"))}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/{job_id}/cancelar")
+async def cancelar_job(job_id: str, user: Any = Depends(get_current_user)):
+    require_role(user, ["admin", "nomina"])
+    _visible(await run_in_threadpool(obtener_job, job_id), user)
+    try:
+        return await run_in_threadpool(cancelar, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.post("/{job_id}/reintentar")
+async def reintentar_job(job_id: str, user: Any = Depends(get_current_user)):
+    require_role(user, ["admin", "nomina"])
+    _visible(await run_in_threadpool(obtener_job, job_id), user)
+    try:
+        return await run_in_threadpool(reintentar, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
@@ -1,119 +1,53 @@
 from typing import Any, List, Optional
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from app.core.database import get_db, engine
+from app.core.database import get_db, get_async_db, fanout_async
 from app.core.security import get_current_user, require_role
 from app.services.payroll_service_optimized import mensualizar_base_30_optimized
-import csv
-import io
+from app.services.reference_data import get_incrementos, get_catalogo
+from app.services.proyeccion_mensual import CONCILIACION_SQL, proyeccion_disponible
+from app.services.jobs import encolar, guardar_archivo
+from app.services.snapshots import cadena_version_async, estado_sql
+from app.services.search_index import PERSONA, condicion_in, ids_coincidentes
+from app.core.utils import normalizar_cedula, rango_anio, rango_periodo
 import datetime
 import traceback
 
 router = APIRouter()
 
-@router.post("/nomina/upload")
+# Los filtros por fecha de BNomina deben ser sargables: mes por la columna generada `periodo`
+# (idx_periodo) y año por rango semiabierto de fec_liq (idx_fec_liq), nunca funciones sobre fec_liq.
+# Los cruces por cédula y proyecto usan las llaves normalizadas (cod_emp_norm, proyecto_norm,
+# BData.cedula_norm, BContrato.cedula_norm, dim_*.codigo_norm), que se calculan al cargar; nunca TRIM/REPLACE en el JOIN.
+
+def _validar_periodo(periodo: str) -> str:
+    """Valida 'YYYY-MM' y lo devuelve normalizado (mismo formato que BNomina.periodo)."""
+    try:
+        return rango_periodo(periodo)[0].strftime('%Y-%m')
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/nomina/upload", status_code=202)
 async def upload_nomina(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
     user: Any = Depends(get_current_user)
 ):
-    """ Sube un archivo CSV de nómina. Borra automáticamente si ya existen datos del mes detectado. """
+    """
+    Sube un archivo CSV de nómina. Borra automáticamente si ya existen datos del mes detectado.
+    La carga corre como trabajo en segundo plano: responde con job_id y el avance se consulta
+    en /admin/jobs/{job_id}.
+    """
     require_role(user, ["admin", "nomina"])
     
     try:
-        content = await file.read()
-        decoded = content.decode('utf-8-sig')
-        
-        # Auto-detect delimiter (comma or semicolon)
-        sample = decoded[:2000]
-        try:
-            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
-            delimiter = dialect.delimiter
-        except csv.Error:
-            # Fallback: count occurrences in first line
-            first_line = sample.split('\n')[0]
-            delimiter = ';' if first_line.count(';') > first_line.count(',') else ','
-        
-        reader = csv.DictReader(io.StringIO(decoded), delimiter=delimiter)
-        
-        # Normalize headers: lowercase + map alternative names
-        HEADER_MAP = {
-            'idproyecto': 'id_proyecto',
-            'idfuente': 'id_fuente',
-            'idcomponente': 'id_componente',
-            'idsubcomponente': 'id_subcomponente',
-            'idcategoria': 'id_categoria',
-            'idresponsable': 'id_responsable',
-        }
-        
-        def normalize_row(raw_row):
-            """Normalize a CSV row: lowercase keys & map alternative header names."""
-            normalized = {}
-            for k, v in raw_row.items():
-                if k is None:
-                    continue
-                key_lower = k.strip().lower()
-                mapped = HEADER_MAP.get(key_lower, key_lower)
-                normalized[mapped] = v.strip() if isinstance(v, str) else v
-            return normalized
-        
-        rows_to_insert = []
-        now = datetime.datetime.now()
-        
-        # Detectar periodo del primer registro para limpieza automática
-        first_row = True
-        target_period = None
-
-        for raw_row in reader:
-            row = normalize_row(raw_row)
-            
-            if first_row:
-                fec = row.get('fec_liq')
-                if fec:
-                    dt = datetime.datetime.strptime(fec, '%Y-%m-%d')
-                    target_period = dt.strftime('%Y-%m')
-                first_row = False
-
-            try:
-                raw_val = row.get('val_liq', '0') or '0'
-                val = float(str(raw_val).replace(',', '.'))
-            except:
-                val = 0
-                
-            rows_to_insert.append({
-                "cod_emp": row.get('cod_emp'),
-                "id_proyecto": row.get('id_proyecto'),
-                "id_fuente": row.get('id_fuente'),
-                "id_componente": row.get('id_componente'),
-                "id_subcomponente": row.get('id_subcomponente'),
-                "id_categoria": row.get('id_categoria'),
-                "id_responsable": row.get('id_responsable'),
-                "val_liq": val,
-                "fec_liq": row.get('fec_liq'),
-                "nom_liq": row.get('nom_liq') or row.get('nom_con') or row.get('nom_emp'),
-                "fdec": row.get('fdec'),
-                "rubro": row.get('rubro'),
-                "fecha_carga": now
-            })
-
-        if not rows_to_insert:
-            return {"ok": False, "message": "No hay datos para insertar"}
-
-        with engine.begin() as conn:
-            # LIMPIEZA AUTOMÁTICA
-            if target_period:
-                conn.execute(text("DELETE FROM BNomina WHERE DATE_FORMAT(fec_liq, '%Y-%m') = :p"), {"p": target_period})
-            
-            # Insertar en bloques (Bulk)
-            query = text("""
-                INSERT INTO BNomina (cod_emp, id_proyecto, id_fuente, id_componente, id_subcomponente, id_categoria, id_responsable, val_liq, fec_liq, nom_liq, fdec, rubro, fecha_carga)
-                VALUES (:cod_emp, :id_proyecto, :id_fuente, :id_componente, :id_subcomponente, :id_categoria, :id_responsable, :val_liq, :fec_liq, :nom_liq, :fdec, :rubro, :fecha_carga)
-            """)
-            conn.execute(query, rows_to_insert)
-
-        return {"ok": True, "message": f"Se cargaron {len(rows_to_insert)} registros. (Limpieza previa de {target_period} realizada)"}
-        
+        archivo = await run_in_threadpool(guardar_archivo, file.file, file.filename)
+        job_id = await run_in_threadpool(
+            encolar, "nomina_upload", {"archivo": archivo, "nombre": file.filename}, user.get("email")
+        )
+        return {"ok": True, "job_id": job_id, "message": "Carga de nómina en proceso"}
     except Exception as e:
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
@@ -124,7 +58,7 @@ def get_nomina_summary(db: Session = Depends(get_db), user: Any = Depends(get_cu
     require_role(user, ["admin", "financiero", "nomina"])
     try:
         query = text("""
-            SELECT DATE_FORMAT(fec_liq, '%Y-%m') as periodo, 
+            SELECT periodo, 
                    SUM(val_liq) as total, 
                    COUNT(*) as registros, 
                    MAX(fecha_carga) as ultima_carga
@@ -141,8 +75,9 @@ def get_nomina_summary(db: Session = Depends(get_db), user: Any = Depends(get_cu
 def delete_nomina_month(periodo: str, db: Session = Depends(get_db), user: Any = Depends(get_current_user)):
     """ Borra los registros de un mes específico (YYYY-MM) """
     require_role(user, ["admin"])
+    periodo = _validar_periodo(periodo)
     try:
-        query = text("DELETE FROM BNomina WHERE DATE_FORMAT(fec_liq, '%Y-%m') = :p")
+        query = text("DELETE FROM BNomina WHERE periodo = :p")
         db.execute(query, {"p": periodo})
         db.commit()
         return {"ok": True, "message": f"Registros del periodo {periodo} eliminados"}
@@ -153,12 +88,14 @@ def delete_nomina_month(periodo: str, db: Session = Depends(get_db), user: Any =
 @router.get("/nomina/ejecucion/fdec")
 def get_ejecucion_fdec(periodo: Optional[str] = None, db: Session = Depends(get_db), user: Any = Depends(get_current_user)):
     """ Resumen de ejecución por FDEC """
-    require_role(user, ["admin", "financiero", "nomina"])
-    try:
+    require_role(user, ["admin", "financiero", "nomina"])
+    if periodo:
+        periodo = _validar_periodo(periodo)
+    try:
         where_clause = ""
         params = {}
         if periodo:
-            where_clause = "WHERE DATE_FORMAT(fec_liq, '%Y-%m') = :p"
+            where_clause = "WHERE periodo = :p"
             params["p"] = periodo
 
         query = text(f"""
@@ -174,27 +111,22 @@ def get_ejecucion_fdec(periodo: Optional[str] = None, db: Session = Depends(get_
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/nomina/reconciliation")
-def get_reconciliation(
-    version_id: int, 
-    periodo: str, # YYYY-MM
-    db: Session = Depends(get_db), 
+async def get_reconciliation(
+    version_id: int, 
+    periodo: str, # YYYY-MM
+    db: AsyncSession = Depends(get_async_db), 
     user: Any = Depends(get_current_user)
 ):
     """ 
     Conciliación: Compara lo pagado (BNomina) vs lo proyectado (BFinanciacion o Snapshot) 
     """
     require_role(user, ["admin", "financiero", "nomina"])
+    periodo = _validar_periodo(periodo)
     try:
         # Mapa canónico de códigos de proyecto para preservar ceros a la izquierda (ej: 013 vs 13)
-        project_rows = db.execute(text("""
-            SELECT TRIM(codigo) as codigo FROM dim_proyectos
-            UNION
-            SELECT TRIM(codigo) as codigo FROM dim_proyectos_otros
-        """)).mappings().all()
-
         canonical_project_codes = {}
-        for row in project_rows:
-            code = str(row.get("codigo") or "").strip()
+        for codigo in await run_in_threadpool(get_catalogo, "proyectos"):
+            code = str(codigo or "").strip()
             if not code:
                 continue
             canonical_project_codes[code] = code
@@ -216,14 +148,14 @@ def get_reconciliation(
 
         # 1. Obtener Real (BNomina) agrupado por la granularidad solicitada (Manejo de ONLY_FULL_GROUP_BY)
         query_real = text("""
-            SELECT 
-                TRIM(n.cod_emp) as cedula, 
-                MAX(COALESCE(
+            SELECT 
+                n.cod_emp_norm as cedula, 
+                MAX(COALESCE(
                     NULLIF(TRIM(CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)), ''), 
                     NULLIF(TRIM(n.nom_liq), ''),
                     TRIM(n.cod_emp)
                 )) as nombre,
-                TRIM(n.id_proyecto) as cod_proyecto, 
+                n.proyecto_norm as cod_proyecto, 
                 TRIM(n.id_fuente) as cod_fuente, 
                 TRIM(n.id_componente) as cod_componente, 
                 TRIM(n.id_subcomponente) as cod_subcomponente, 
@@ -231,120 +163,129 @@ def get_reconciliation(
                 TRIM(n.id_responsable) as cod_responsable,
                 SUM(n.val_liq) as real_pagado
             FROM BNomina n
-            LEFT JOIN BData d ON TRIM(n.cod_emp) = TRIM(d.cedula)
-            WHERE DATE_FORMAT(n.fec_liq, '%Y-%m') = :p
+            LEFT JOIN BData d ON d.cedula_norm = n.cod_emp_norm
+            WHERE n.periodo = :p
             GROUP BY 1, 3, 4, 5, 6, 7, 8
         """)
-        real_data = [dict(r) for r in db.execute(query_real, {"p": periodo}).mappings().all()]
+        real_data = [dict(r) for r in (await db.execute(query_real, {"p": periodo})).mappings().all()]
         for r in real_data:
             r["cod_proyecto"] = normalize_project_code(r.get("cod_proyecto"))
 
-        # 2. Obtener Proyectado (Snapshot o Actual)
-        if version_id == 0:
-            # USAR EL VIVO (BFinanciacion) + FILTRO ESTADO ACTIVO
-            query_proj = text("""
-                SELECT TRIM(f.cedula) as cedula, 
-                       COALESCE(NULLIF(TRIM(CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)), ''), f.cedula) as nombre,
-                       TRIM(f.id_proyecto) as cod_proyecto, 
-                       TRIM(f.id_fuente) as cod_fuente, 
-                       TRIM(f.id_componente) as cod_componente, 
-                       TRIM(f.id_subcomponente) as cod_subcomponente, 
-                       TRIM(f.id_categoria) as cod_categoria, 
-                       TRIM(f.id_responsable) as cod_responsable,
-                       f.salario_base, 
-                       f.fecha_inicio, 
-                       f.fecha_fin,
-                       f.id_contrato,
-                       c.atep,
-                       p.cargo,
-                       p.banda,
-                       p.familia,
-                       p.IDPosicion as posicion_c,
-                       p.Direccion,
-                       p.Gerencia as gerencia,
-                       p.Base_Fuente
-                FROM BFinanciacion f
-                LEFT JOIN BData d ON TRIM(f.cedula) = TRIM(d.cedula)
-                INNER JOIN BContrato c ON TRIM(f.cedula) = TRIM(c.cedula)
-                LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
-                WHERE f.fecha_inicio <= LAST_DAY(STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d'))
-                AND f.fecha_fin >= STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d')
-                AND c.estado LIKE 'Activo%'
-            """)
-            proj_rows = [dict(r) for r in db.execute(query_proj, {"p": periodo}).mappings().all()]
-    
+        # 2. Obtener Proyectado: vivo desde BProyeccion_Mensual (GROUP BY indexado por mes)
+        if version_id == 0 and proyeccion_disponible():
+            proyectado_mes = [dict(r) for r in (await db.execute(text(CONCILIACION_SQL), {"mes": f"{periodo}-01"})).mappings().all()]
+            for p in proyectado_mes:
+                p["valor"] = float(p["valor"] or 0)
         else:
-            # USAR SNAPSHOT
-            query_proj = text("""
-                SELECT TRIM(s.cedula) as cedula, 
-                       COALESCE(NULLIF(TRIM(CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)), ''), s.cedula) as nombre,
-                       TRIM(s.cod_proyecto) as cod_proyecto, 
-                       TRIM(s.cod_fuente) as cod_fuente, 
-                       TRIM(s.cod_componente) as cod_componente, 
-                       TRIM(s.cod_subcomponente) as cod_subcomponente, 
-                       TRIM(s.cod_categoria) as cod_categoria, 
-                       TRIM(s.cod_responsable) as cod_responsable,
-                       s.valor_mensual as salario_base, 
-                       s.fecha_inicio, 
-                       s.fecha_fin, 
-                       s.salario_t, 
-                       s.posicion as posicion_c,
-                       c.atep,
-                       p.cargo,
-                       p.banda,
-                       p.familia,
-                       p.Direccion,
-                       p.Gerencia as gerencia,
-                       p.Base_Fuente
-                FROM BFinanciacion_Snapshot s
-                LEFT JOIN BData d ON TRIM(s.cedula) = TRIM(d.cedula)
-                LEFT JOIN BPosicion p ON TRIM(s.posicion) = TRIM(p.IDPosicion)
-                LEFT JOIN BContrato c ON TRIM(s.cedula) = TRIM(c.cedula) AND c.posicion = s.posicion
-                WHERE s.version_id = :vid
-                AND s.fecha_inicio <= LAST_DAY(STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d'))
-                AND s.fecha_fin >= STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d')
-            """)
-            proj_rows = [dict(r) for r in db.execute(query_proj, {"vid": version_id, "p": periodo}).mappings().all()]
+            # Snapshot o Actual calculado en Python
+            if version_id == 0:
+                # USAR EL VIVO (BFinanciacion) + FILTRO ESTADO ACTIVO del contrato del tramo
+                # (mismas filas que CONCILIACION_SQL sobre BProyeccion_Mensual)
+                query_proj = text("""
+                    SELECT TRIM(f.cedula) as cedula, 
+                           COALESCE(NULLIF(TRIM(CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)), ''), f.cedula) as nombre,
+                           TRIM(f.id_proyecto) as cod_proyecto, 
+                           TRIM(f.id_fuente) as cod_fuente, 
+                           TRIM(f.id_componente) as cod_componente, 
+                           TRIM(f.id_subcomponente) as cod_subcomponente, 
+                           TRIM(f.id_categoria) as cod_categoria, 
+                           TRIM(f.id_responsable) as cod_responsable,
+                           f.salario_base, 
+                           f.fecha_inicio, 
+                           f.fecha_fin,
+                           f.id_contrato,
+                           c.atep,
+                           p.cargo,
+                           p.banda,
+                           p.familia,
+                           p.IDPosicion as posicion_c,
+                           p.Direccion,
+                           p.Gerencia as gerencia,
+                           p.Base_Fuente
+                    FROM BFinanciacion f
+                    LEFT JOIN BData d ON d.cedula = f.cedula
+                    INNER JOIN BContrato c ON c.id_contrato = f.id_contrato
+                    LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
+                    WHERE f.fecha_inicio <= LAST_DAY(STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d'))
+                    AND f.fecha_fin >= STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d')
+                    AND c.estado LIKE 'Activo%'
+                """)
+                proj_rows = [dict(r) for r in (await db.execute(query_proj, {"p": periodo})).mappings().all()]
+    
+            else:
+                # USAR SNAPSHOT (estado reconstruido desde la cadena de deltas de la versión)
+                cadena = await cadena_version_async(db, version_id)
+                if not cadena:
+                    raise HTTPException(status_code=404, detail="Versión no encontrada")
+                query_proj = text(f"""
+                    SELECT TRIM(s.cedula) as cedula, 
+                           COALESCE(NULLIF(TRIM(CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)), ''), s.cedula) as nombre,
+                           TRIM(s.cod_proyecto) as cod_proyecto, 
+                           TRIM(s.cod_fuente) as cod_fuente, 
+                           TRIM(s.cod_componente) as cod_componente, 
+                           TRIM(s.cod_subcomponente) as cod_subcomponente, 
+                           TRIM(s.cod_categoria) as cod_categoria, 
+                           TRIM(s.cod_responsable) as cod_responsable,
+                           s.valor_mensual as salario_base, 
+                           s.fecha_inicio, 
+                           s.fecha_fin, 
+                           s.salario_t, 
+                           s.posicion as posicion_c,
+                           c.atep,
+                           p.cargo,
+                           p.banda,
+                           p.familia,
+                           p.Direccion,
+                           p.Gerencia as gerencia,
+                           p.Base_Fuente
+                    FROM {estado_sql(cadena)} s
+                    LEFT JOIN BData d ON d.cedula = s.cedula
+                    LEFT JOIN BPosicion p ON p.IDPosicion = s.posicion
+                    LEFT JOIN BContrato c ON c.cedula = s.cedula AND c.posicion = s.posicion
+                    WHERE s.fecha_inicio <= LAST_DAY(STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d'))
+                    AND s.fecha_fin >= STR_TO_DATE(CONCAT(:p, '-01'), '%Y-%m-%d')
+                """)
+                proj_rows = [dict(r) for r in (await db.execute(query_proj, {"p": periodo})).mappings().all()]
 
-        for p in proj_rows:
-            p["cod_proyecto"] = normalize_project_code(p.get("cod_proyecto"))
+            for p in proj_rows:
+                p["cod_proyecto"] = normalize_project_code(p.get("cod_proyecto"))
     
-        # Preparar para mensualizar
-        tramos_dict = []
-        for s in proj_rows:
-            d = dict(s)
-            # El servicio espera id_proyecto, id_fuente, etc. para la lógica interna
-            d["id_proyecto"] = normalize_project_code(d.get("cod_proyecto"))
-            d["id_fuente"] = d["cod_fuente"]
-            d["id_componente"] = d["cod_componente"]
-            d["id_subcomponente"] = d["cod_subcomponente"]
-            d["id_categoria"] = d["cod_categoria"]
-            d["id_responsable"] = d["cod_responsable"]
-            tramos_dict.append(d)
+            # Preparar para mensualizar
+            tramos_dict = []
+            for s in proj_rows:
+                d = dict(s)
+                # El servicio espera id_proyecto, id_fuente, etc. para la lógica interna
+                d["id_proyecto"] = normalize_project_code(d.get("cod_proyecto"))
+                d["id_fuente"] = d["cod_fuente"]
+                d["id_componente"] = d["cod_componente"]
+                d["id_subcomponente"] = d["cod_subcomponente"]
+                d["id_categoria"] = d["cod_categoria"]
+                d["id_responsable"] = d["cod_responsable"]
+                tramos_dict.append(d)
         
-        # Incrementos para el año
-        anio_int = int(periodo.split('-')[0])
-        inc_res = db.execute(text("SELECT * FROM BIncremento WHERE anio = :a"), {"a": anio_int}).mappings().all()
-        incrementos = {r['anio']: dict(r) for r in inc_res}
-        if not incrementos:
-             print(f"WARNING: No hay incrementos para el año {anio_int}")
+            # Incrementos para el año
+            anio_int = int(periodo.split('-')[0])
+            inc_anio = (await run_in_threadpool(get_incrementos)).get(anio_int)
+            incrementos = {anio_int: inc_anio} if inc_anio else {}
+            if not incrementos:
+                 print(f"WARNING: No hay incrementos para el año {anio_int}")
 
-        # Mensualización
-        proyeccion = mensualizar_base_30_optimized(tramos_dict, incrementos)
+            # Mensualización (CPU-bound: fuera del event loop)
+            proyeccion = await run_in_threadpool(mensualizar_base_30_optimized, tramos_dict, incrementos)
         
-        target_key = f"{periodo}-01"
-        proyectado_mes = []
-        for p in proyeccion:
-            if p["anioMes"] == target_key:
-                proyectado_mes = p["detalle"]
-                break
+            target_key = f"{periodo}-01"
+            proyectado_mes = []
+            for p in proyeccion:
+                if p["anioMes"] == target_key:
+                    proyectado_mes = p["detalle"]
+                    break
 
         # 3. Cruzar datos en memoria
         combined = {}
         
         def get_key(d):
             # Cruce por la granularidad visible en UI: Cédula + Proyecto + Fuente + Responsable.
-            ced = str(d.get('cedula') or d.get('cod_emp') or '').strip()
+            ced = normalizar_cedula(d.get('cedula') or d.get('cod_emp')) or ''
             
             c_proy = normalize_project_code(d.get('cod_proyecto') or d.get('id_proyecto') or '')
             c_fuen = str(d.get('cod_fuente') or d.get('id_fuente') or d.get('fuente') or '').strip()
@@ -402,40 +343,50 @@ def get_reconciliation(
             
         return final_list
 
+    except HTTPException: raise
     except Exception as e:
         print("ERROR EN CONCILIACION:")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/nomina/dashboard")
-def get_nomina_dashboard(
+async def get_nomina_dashboard(
     anio: Optional[int] = None, 
     periodo: Optional[str] = None, 
     trabajador: Optional[str] = None,
     direccion: Optional[str] = None,
-    db: Session = Depends(get_db), 
     user: Any = Depends(get_current_user)
-):
+):
     """ Retorna KPIs y datos para el Dashboard de Nómina con filtros avanzados (v3) """
     require_role(user, ["admin", "financiero", "nomina"])
     try:
         curr_year = anio if anio else datetime.datetime.now().year
         
         # Base filters (Globales: Solo año y periodo afectarán KPIs y Gráficos)
-        global_where = "WHERE YEAR(n.fec_liq) = :anio"
-        global_params = {"anio": curr_year}
+        anio_ini, anio_fin = rango_anio(curr_year)
+        global_where = "WHERE n.fec_liq >= :anio_ini AND n.fec_liq < :anio_fin"
+        global_params = {"anio_ini": anio_ini, "anio_fin": anio_fin}
         
         if periodo:
-            global_where += " AND DATE_FORMAT(n.fec_liq, '%Y-%m') = :periodo"
-            global_params["periodo"] = periodo
+            global_where += " AND n.periodo = :periodo"
+            global_params["periodo"] = _validar_periodo(periodo)
 
         # Detail filters (Solo afectan a la tabla de detalle)
         detail_where = global_where
         detail_params = global_params.copy()
             
         if trabajador:
-            detail_where += " AND (n.cod_emp LIKE :trab OR d.p_nombre LIKE :trab OR d.p_apellido LIKE :trab)"
-            detail_params["trab"] = f"%{trabajador}%"
+            # Nombres/cédulas vía índice de búsqueda en memoria -> IN sobre cod_emp_norm (indexado);
+            # el prefijo de cod_emp_norm cubre empleados que no están en BData
+            cedulas = ids_coincidentes(trabajador, PERSONA)
+            if cedulas is None:
+                detail_where += " AND (n.cod_emp LIKE :trab OR d.p_nombre LIKE :trab OR d.p_apellido LIKE :trab)"
+                detail_params["trab"] = f"%{trabajador}%"
+            else:
+                cond, cond_params = condicion_in("n.cod_emp_norm", {normalizar_cedula(c) for c in cedulas}, "trab_")
+                detail_where += f" AND ({cond} OR n.cod_emp_norm LIKE :trab)"
+                detail_params.update(cond_params)
+                detail_params["trab"] = f"{normalizar_cedula(trabajador) or trabajador}%"
 
         if direccion:
             detail_where += " AND p.Direccion = :dir"
@@ -446,40 +397,37 @@ def get_nomina_dashboard(
             SELECT 
                 SUM(val_liq) as total_anual,
                 COUNT(DISTINCT n.cod_emp) as total_empleados,
-                COUNT(DISTINCT DATE_FORMAT(n.fec_liq, '%Y-%m')) as meses_activos
+                COUNT(DISTINCT n.periodo) as meses_activos
             FROM BNomina n
             {global_where}
         """)
-        kpis = db.execute(q_kpis, global_params).mappings().first()
         
         # 2. Distribución por Dirección
         q_dir = text(f"""
             SELECT p.Direccion as label, SUM(n.val_liq) as value
             FROM BNomina n
-            JOIN BContrato c ON TRIM(n.cod_emp) = TRIM(c.cedula)
+            JOIN BContrato c ON c.cedula_norm = n.cod_emp_norm
             JOIN BPosicion p ON c.posicion = p.IDPosicion
             {global_where}
             GROUP BY p.Direccion
             ORDER BY value DESC
         """)
-        dist_direccion = db.execute(q_dir, global_params).mappings().all()
         
         # 3. Top 10 Proyectos
         q_proy = text(f"""
             SELECT COALESCE(dp.nombre, dpo.nombre, n.id_proyecto) as label, SUM(n.val_liq) as value
             FROM BNomina n
-            LEFT JOIN dim_proyectos dp ON TRIM(n.id_proyecto) = TRIM(dp.codigo)
-            LEFT JOIN dim_proyectos_otros dpo ON TRIM(n.id_proyecto) = TRIM(dpo.codigo)
+            LEFT JOIN dim_proyectos dp ON dp.codigo_norm = n.proyecto_norm
+            LEFT JOIN dim_proyectos_otros dpo ON dpo.codigo_norm = n.proyecto_norm
             {global_where}
             GROUP BY label
             ORDER BY value DESC
             LIMIT 10
         """)
-        top_proyectos = db.execute(q_proy, global_params).mappings().all()
 
         # 4. Parametros para Selects (Toda la data del año)
-        all_periods = [r[0] for r in db.execute(text("SELECT DISTINCT DATE_FORMAT(fec_liq, '%Y-%m') FROM BNomina WHERE YEAR(fec_liq) = :anio ORDER BY 1 DESC"), {"anio": curr_year}).fetchall()]
-        all_dirs = [r[0] for r in db.execute(text("SELECT DISTINCT Direccion FROM BPosicion WHERE Direccion IS NOT NULL ORDER BY 1")).fetchall()]
+        q_periods = text("SELECT DISTINCT periodo FROM BNomina WHERE fec_liq >= :anio_ini AND fec_liq < :anio_fin ORDER BY 1 DESC")
+        q_dirs = text("SELECT DISTINCT Direccion FROM BPosicion WHERE Direccion IS NOT NULL ORDER BY 1")
 
         # 5. Granularidad Agrupada
         q_detalled = text(f"""
@@ -495,38 +443,50 @@ def get_nomina_dashboard(
                 COALESCE(dc.nombre, n.id_componente) as component, 
                 SUM(n.val_liq) as pagado
             FROM BNomina n
-            LEFT JOIN BData d ON TRIM(n.cod_emp) = TRIM(d.cedula)
-            LEFT JOIN dim_proyectos dp ON TRIM(n.id_proyecto) = TRIM(dp.codigo)
-            LEFT JOIN dim_proyectos_otros dpo ON TRIM(n.id_proyecto) = TRIM(dpo.codigo)
+            LEFT JOIN BData d ON d.cedula_norm = n.cod_emp_norm
+            LEFT JOIN dim_proyectos dp ON dp.codigo_norm = n.proyecto_norm
+            LEFT JOIN dim_proyectos_otros dpo ON dpo.codigo_norm = n.proyecto_norm
             LEFT JOIN dim_fuentes df ON TRIM(n.id_fuente) = TRIM(df.codigo)
             LEFT JOIN dim_componentes dc ON TRIM(n.id_componente) = TRIM(dc.codigo)
-            LEFT JOIN BContrato c ON TRIM(n.cod_emp) = TRIM(c.cedula)
+            LEFT JOIN BContrato c ON c.cedula_norm = n.cod_emp_norm
             LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
             {detail_where}
             GROUP BY n.cod_emp, nombre, proyecto, fuente, component
             ORDER BY nombre ASC, pagado DESC
         """)
-        detalle = db.execute(q_detalled, detail_params).mappings().all()
 
         # 6. Matriz Proyectos vs Periodos (Agrupado)
-        matrix_data = []
-        try:
-            q_matrix = text(f"""
-                SELECT 
-                    COALESCE(dp.nombre, dpo.nombre, n.id_proyecto) as proyecto, 
-                    DATE_FORMAT(n.fec_liq, '%Y-%m') as periodo,
-                    SUM(n.val_liq) as total
-                FROM BNomina n
-                LEFT JOIN dim_proyectos dp ON TRIM(n.id_proyecto) = TRIM(dp.codigo)
-                LEFT JOIN dim_proyectos_otros dpo ON TRIM(n.id_proyecto) = TRIM(dpo.codigo)
-                {global_where}
-                GROUP BY proyecto, periodo
-                ORDER BY total DESC
-            """)
-            matrix_data = db.execute(q_matrix, global_params).mappings().all()
-        except Exception as e:
-            print(f"Error cargando matriz de proyectos: {e}")
-            # Non-critical, continue with empty matrix
+        q_matrix = text(f"""
+            SELECT 
+                COALESCE(dp.nombre, dpo.nombre, n.id_proyecto) as proyecto, 
+                n.periodo,
+                SUM(n.val_liq) as total
+            FROM BNomina n
+            LEFT JOIN dim_proyectos dp ON dp.codigo_norm = n.proyecto_norm
+            LEFT JOIN dim_proyectos_otros dpo ON dpo.codigo_norm = n.proyecto_norm
+            {global_where}
+            GROUP BY proyecto, periodo
+            ORDER BY total DESC
+        """)
+
+        # Consultas independientes: se ejecutan en paralelo, cada una en su propia conexión.
+        # La matriz es no crítica: si falla se continúa con matriz vacía.
+        res = await fanout_async({
+            "kpis": (q_kpis, global_params),
+            "dist_direccion": (q_dir, global_params),
+            "top_proyectos": (q_proy, global_params),
+            "periods": (q_periods, {"anio_ini": anio_ini, "anio_fin": anio_fin}),
+            "dirs": (q_dirs, {}),
+            "detalle": (q_detalled, detail_params),
+            "matrix": (q_matrix, global_params),
+        }, optional=("matrix",))
+        kpis = res["kpis"][0]
+        dist_direccion = res["dist_direccion"]
+        top_proyectos = res["top_proyectos"]
+        all_periods = [r["periodo"] for r in res["periods"]]
+        all_dirs = [r["Direccion"] for r in res["dirs"]]
+        detalle = res["detalle"]
+        matrix_data = res["matrix"]
 
         return {
             "ok": True,
@@ -1,15 +1,24 @@
 from typing import Any, List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from app.core.database import get_db
+from app.core.database import get_db, get_async_db, engine, fanout_async, transaccion
 from app.core.security import get_current_user, require_role
 from app.core.constants import PAGO_EXPR
 from pydantic import BaseModel
 import datetime
 import json
+from functools import partial
 from app.services.audit_service import AuditService
+from app.services.jobs import JobContext, encolar, registrar_tarea
+from app.services.notificaciones import insertar_notificacion, publicar
+from app.services.snapshots import VERSIONES_SQL, cadena_version_async, crear_version, diferencias, estado_sql, proyeccion_version, eliminar_version as eliminar_version_snapshot
 from app.services.payroll_service_optimized import mensualizar_base_30_optimized as mensualizar_base_30, calculate_yearly_projections
+from app.services.projection_cache import get_projection, projection_key, put_projection
+from app.services.projection_state import tramo_changed
+from app.services.reference_data import get_incrementos, get_catalogo
 from app.core.utils import to_date
 
 router = APIRouter()
@@ -27,11 +36,6 @@ class SolicitudCreate(BaseModel):
     valor_nuevo: Any
     justificacion: str
 
-class SnapshotResponse(BaseModel):
-    version_id: int
-    tramos_copiados: int
-    mensaje: str
-
 class SolicitudCambioBase(BaseModel):
     tipo_solicitud: str # 'MODIFICAR', 'CREAR', 'ELIMINAR'
     cedula: str
@@ -41,102 +45,50 @@ class SolicitudCambioBase(BaseModel):
 
 # --- ENDPOINTS ---
 
-@router.post("/congelar", response_model=SnapshotResponse)
+@registrar_tarea("snapshot")
+def _crear_snapshot(ctx: JobContext, nombre_version: str, descripcion: Optional[str] = None, creado_por: Optional[str] = None):
+    """
+    Toma una fotografía inmutable de BFinanciacion (trabajo "snapshot"): checkpoint completo
+    o delta contra la versión anterior (app/services/snapshots.py).
+    Versión y contenido van en una sola transacción: si falla no queda versión vacía.
+    """
+    ctx.verificar()
+    with engine.begin() as conn:
+        res = crear_version(conn, nombre_version, descripcion, creado_por)
+
+    # La proyección del año en curso queda lista para las comparaciones
+    ctx.progreso(90, "Calculando proyección de la versión", forzar=True)
+    try:
+        proyeccion_version(res["version_id"], datetime.datetime.now().year, get_incrementos())
+    except Exception as e:
+        print(f"Warning: proyección de la versión {res['version_id']} no guardada ({e})")
+
+    if res["es_checkpoint"]:
+        detalle = f"checkpoint de {res['tramos_copiados']} registros"
+    else:
+        detalle = (f"{res['tramos_copiados']} registros; delta vs versión {res['base_version_id']}: "
+                   f"{res['agregados']} nuevos, {res['modificados']} modificados, {res['eliminados']} eliminados")
+    return {**res, "mensaje": f"Snapshot '{nombre_version}' creado exitosamente ({detalle})."}
+
+
+@router.post("/congelar", status_code=202)
 def crear_snapshot(
     snapshot_in: SnapshotCreate,
-    db: Session = Depends(get_db),
     current_user: Any = Depends(get_current_user), # Admin Only ideally
 ):
     """
-    Toma una fotografía inmutable de BFinanciacion.
-    Esta operación puede tardar unos segundos dependiendo del volumen de datos.
+    Encola la fotografía inmutable de BFinanciacion y responde con el job_id.
+    El resultado (version_id, tramos_copiados) queda en /admin/jobs/{job_id}.
     """
     require_role(current_user, ["admin"])
-    # 1. Crear el registro de la versión
     try:
-        # Insert Version
-        result = db.execute(text("""
-            INSERT INTO Presupuesto_Versiones (nombre_version, descripcion, creado_por, fecha_creacion, bloqueada)
-            VALUES (:nom, :desc, :user, NOW(), 1)
-        """), {
-            "nom": snapshot_in.nombre_version,
-            "desc": snapshot_in.descripcion,
-            "user": current_user.get("email", "admin")
-        })
-        db.commit()
-        
-        # Get the new ID (MySQL Way)
-        # Using separate query to be safe across drivers or relying on result.lastrowid
-        # SQLAlchemy returns result.lastrowid for simple inserts usually
-        version_id = result.lastrowid
-        if not version_id:
-             # Fallback explicit fetch
-             version_id = db.execute(text("SELECT MAX(id) FROM Presupuesto_Versiones")).scalar()
-
-        # 2. Copia Masiva (Bulk Insert)
-        # Mapeamos columnas de BFinanciacion a Snapshot
-        # Asumimos que BFinanciacion tiene columnas compatibles.
-        # Ajustaremos la query según el esquema real que inferimos.
-        
-        query_snapshot = text(f"""
-            INSERT INTO BFinanciacion_Snapshot (
-                version_id,
-                original_id_financiacion,
-                cedula,
-                id_proyecto,
-                id_contrato,
-                cod_proyecto,
-                cod_fuente,
-                cod_componente,
-                cod_subcomponente,
-                cod_rubro,
-                cod_categoria,
-                cod_responsable,
-                posicion,
-                valor_mensual,
-                salario_t,
-                pago_proyectado,
-                fecha_inicio,
-                fecha_fin
-            )
-            SELECT 
-                :ver_id,
-                BF.id_financiacion,
-                BF.cedula,
-                BF.id_proyecto,
-                BF.id_contrato,
-                BF.id_proyecto, -- Usamos ID como Codigo por ahora
-                BF.id_fuente,
-                BF.id_componente,
-                BF.id_subcomponente,
-                BF.rubro,
-                BF.id_categoria,
-                BF.id_responsable,
-                BF.posicion,
-                BF.salario_base,
-                BF.salario_t,
-                BF.pago_proyectado,
-                BF.fecha_inicio,
-                BF.fecha_fin
-            FROM BFinanciacion BF
-        """)
-        
-        result_copy = db.execute(query_snapshot, {"ver_id": version_id})
-        rows_copied = result_copy.rowcount
-        db.commit()
-
-        # 3. Log Audit
-        # Reusing BAuditoria if exists, or just log to print for now in MVP
-        # db.execute("INSERT INTO BAuditoria ...") 
-
-        return {
-            "version_id": version_id,
-            "tramos_copiados": rows_copied,
-            "mensaje": f"Snapshot '{snapshot_in.nombre_version}' creado exitosamente con {rows_copied} registros."
-        }
-
+        job_id = encolar("snapshot", {
+            "nombre_version": snapshot_in.nombre_version,
+            "descripcion": snapshot_in.descripcion,
+            "creado_por": current_user.get("email", "admin"),
+        }, current_user.get("email"))
+        return {"job_id": job_id, "mensaje": f"Snapshot '{snapshot_in.nombre_version}' en proceso"}
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/versiones/{version_id}")
@@ -148,27 +100,25 @@ def eliminar_version(
     """ Elimina una versión y todos sus datos históricos asociados """
     require_role(current_user, ["admin"])
     try:
-        # 1. Borrar detalle (Snapshot data)
-        db.execute(text("DELETE FROM BFinanciacion_Snapshot WHERE version_id = :vid"), {"vid": version_id})
-        
-        # 2. Borrar cabecera
-        result = db.execute(text("DELETE FROM Presupuesto_Versiones WHERE id = :vid"), {"vid": version_id})
+        # Detalle y cabecera; las versiones delta que dependían de esta absorben su contenido
+        borradas = eliminar_version_snapshot(db, version_id)
         db.commit()
         
-        if result.rowcount == 0:
+        if borradas == 0:
              raise HTTPException(status_code=404, detail="Versión no encontrada")
              
         return {"message": "Versión eliminada correctamente"}
 
+    except HTTPException: raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/comparar/{version_id}")
-def comparar_presupuesto(
+async def comparar_presupuesto(
     version_id: int,
     anio: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Any = Depends(get_current_user)
 ):
     """ 
@@ -180,52 +130,47 @@ def comparar_presupuesto(
         target_year = anio if anio else datetime.datetime.now().year
         
         # 1. Fetch Necessaries (Increments & Metadata)
-        incs_rows = db.execute(text("SELECT * FROM BIncremento")).mappings().all()
-        incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
+        incrementos = await run_in_threadpool(get_incrementos)
         
-        proy_names = {r["codigo"]: r["nombre"] for r in db.execute(text("SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros")).mappings().all()}
-
-        # 2. Obtener datos de la Foto (Join con contrato para ATEP/Gerencia necesario en calculo)
-        # Nota: Usamos datos de contrato actuales ya que no se guardaron en el snapshot original.
-        q_snap = text("""
-            SELECT s.*, c.atep, c.gerencia, c.estado, c.fecha_terminacion_real,
-                   p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c,
-                   p.Direccion, p.Planta,
-                   CONCAT_WS(' ', d.p_nombre, d.p_apellido) as nombre_completo,
-                   1 AS is_snapshot
-            FROM BFinanciacion_Snapshot s
-            LEFT JOIN BContrato c ON s.id_contrato = c.id_contrato
-            LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
+        proy_names = await run_in_threadpool(get_catalogo, "proyectos")
+
+        # Estado de la versión reconstruido desde su cadena de deltas
+        cadena = await cadena_version_async(db, version_id)
+        if not cadena:
+            raise HTTPException(status_code=404, detail="Versión no encontrada")
+        snap = estado_sql(cadena)
+
+        # 2. Lado de la versión: la proyección del año se lee guardada (se calcula una sola vez
+        # por versión y año, ver snapshots.proyeccion_version); para el diff basta una lectura
+        # angosta de sus tramos, todas las vigencias.
+        snap_proj_full = await run_in_threadpool(proyeccion_version, version_id, target_year, incrementos)
+        q_snap = text(f"""
+            SELECT s.original_id_financiacion, s.cedula, s.id_proyecto, s.salario_t,
+                   s.fecha_inicio, s.fecha_fin,
+                   CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) as nombre
+            FROM {snap} s
             LEFT JOIN BData d ON s.cedula = d.cedula
-            WHERE s.version_id = :vid
-              AND s.fecha_inicio <= :y_end AND s.fecha_fin >= :y_start
         """)
-        snap_rows = db.execute(q_snap, {
-            "vid": version_id, 
-            "y_start": f"{target_year}-01-01", 
-            "y_end": f"{target_year}-12-31"
-        }).mappings().all()
+        snap_rows = (await db.execute(q_snap)).mappings().all()
 
-        # 3. Obtener datos Actuales
+        # 3. Lado actual: para los eliminados basta el conjunto de ids (solo la PK); nuevos y
+        # modificados salen de una lectura angosta de los tramos del año (sin contrato también cuentan)
+        y_start, y_end = datetime.date(target_year, 1, 1), datetime.date(target_year, 12, 31)
+        live_ids = (await db.execute(text("SELECT id_financiacion FROM BFinanciacion"))).scalars().all()
         q_live = text("""
-            SELECT f.*, c.atep, c.gerencia, c.estado, c.fecha_terminacion_real,
-                   p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c,
-                   p.Direccion, p.Planta,
-                   CONCAT_WS(' ', d.p_nombre, d.p_apellido) as nombre_completo
+            SELECT f.id_financiacion, f.cedula, f.id_proyecto, f.salario_t, f.fecha_inicio, f.fecha_fin,
+                   CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) as nombre
             FROM BFinanciacion f
-            JOIN BContrato c ON f.id_contrato = c.id_contrato
-            LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
             LEFT JOIN BData d ON f.cedula = d.cedula
             WHERE f.fecha_inicio <= :y_end AND f.fecha_fin >= :y_start
         """)
-        live_rows = db.execute(q_live, {
-            "y_start": f"{target_year}-01-01", 
-            "y_end": f"{target_year}-12-31"
-        }).mappings().all()
+        live_anio = (await db.execute(q_live, {"y_start": y_start, "y_end": y_end})).mappings().all()
 
-        # 5. Calculate both sides using the Unified Projection Engine
-        snap_proj_full = calculate_yearly_projections(snap_rows, incrementos, target_year)
-        live_proj_full = calculate_yearly_projections(live_rows, incrementos, target_year)
+        # 4. Diff por hash join (una pasada por lado)
+        cambios = await run_in_threadpool(diferencias, snap_rows, live_anio, live_ids, y_start, y_end, proy_names)
+
+        # 5. Proyección actual del año (caché de proyecciones, misma que comparar-versiones)
+        live_proj_full = await run_in_threadpool(_proyeccion_actual, target_year, incrementos)
         
         # Extract results for comparison logic
         snap_total = snap_proj_full["total"]
@@ -256,21 +201,6 @@ def comparar_presupuesto(
                 "head_live": l["headcount"]
             }
 
-        # 7. Analysis of discrete changes (Tramos added/removed)
-        q_nuevos = text("""
-            SELECT COUNT(*) FROM BFinanciacion 
-            WHERE id_financiacion NOT IN (SELECT original_id_financiacion FROM BFinanciacion_Snapshot WHERE version_id = :vid)
-              AND fecha_inicio <= :y_end AND fecha_fin >= :y_start
-        """)
-        nuevos_count = db.execute(q_nuevos, {"vid": version_id, "y_start": f"{target_year}-01-01", "y_end": f"{target_year}-12-31"}).scalar()
-
-        q_removidos = text("""
-            SELECT COUNT(*) FROM BFinanciacion_Snapshot 
-            WHERE version_id = :vid AND original_id_financiacion NOT IN (SELECT id_financiacion FROM BFinanciacion)
-              AND fecha_inicio <= :y_end AND fecha_fin >= :y_start
-        """)
-        removidos_count = db.execute(q_removidos, {"vid": version_id, "y_start": f"{target_year}-01-01", "y_end": f"{target_year}-12-31"}).scalar()
-
         return {
             "version_id": version_id,
             "anio": target_year,
@@ -281,46 +211,117 @@ def comparar_presupuesto(
                 "porcentaje_variacion": ( (live_total / snap_total) - 1 ) * 100 if snap_total > 0 else 0,
                 "headcount_base": snap_head,
                 "headcount_actual": live_head,
-                "tramos_nuevos": nuevos_count,
-                "tramos_eliminados": removidos_count
+                "tramos_nuevos": len(cambios["nuevos"]),
+                "tramos_eliminados": len(cambios["eliminados"])
             },
             "proyectos": sorted(proyectos.values(), key=lambda x: x["actual"], reverse=True),
-            "detalle_cambios": {
-                "nuevos": [dict(r) for r in db.execute(text(f"""
-                    SELECT b.id_financiacion, b.cedula, COALESCE(dp.nombre, dpo.nombre, b.id_proyecto) as id_proyecto, b.salario_t, 
-                           CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) as nombre
-                    FROM BFinanciacion b
-                    JOIN BData d ON b.cedula = d.cedula
-                    LEFT JOIN dim_proyectos dp ON b.id_proyecto = dp.codigo
-                    LEFT JOIN dim_proyectos_otros dpo ON b.id_proyecto = dpo.codigo
-                    WHERE b.id_financiacion NOT IN (SELECT original_id_financiacion FROM BFinanciacion_Snapshot WHERE version_id = :vid)
-                      AND b.fecha_inicio <= :y_end AND b.fecha_fin >= :y_start
-                """), {"vid": version_id, "y_start": f"{target_year}-01-01", "y_end": f"{target_year}-12-31"}).mappings().all()],
-                "eliminados": [dict(r) for r in db.execute(text(f"""
-                    SELECT s.original_id_financiacion as id_financiacion, s.cedula, COALESCE(dp.nombre, dpo.nombre, s.id_proyecto) as id_proyecto, s.salario_t,
-                           CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) as nombre
-                    FROM BFinanciacion_Snapshot s
-                    LEFT JOIN BData d ON s.cedula = d.cedula
-                    LEFT JOIN dim_proyectos dp ON s.id_proyecto = dp.codigo
-                    LEFT JOIN dim_proyectos_otros dpo ON s.id_proyecto = dpo.codigo
-                    WHERE s.version_id = :vid AND s.original_id_financiacion NOT IN (SELECT id_financiacion FROM BFinanciacion)
-                      AND s.fecha_inicio <= :y_end AND s.fecha_fin >= :y_start
-                """), {"vid": version_id, "y_start": f"{target_year}-01-01", "y_end": f"{target_year}-12-31"}).mappings().all()],
-                "modificados": [dict(r) for r in db.execute(text(f"""
-                    SELECT b.id_financiacion, b.cedula, COALESCE(dp.nombre, dpo.nombre, b.id_proyecto) as id_proyecto, 
-                           b.salario_t as valor_actual, s.salario_t as valor_base,
-                           (b.salario_t - s.salario_t) as diff,
-                           CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) as nombre
-                    FROM BFinanciacion b
-                    JOIN BFinanciacion_Snapshot s ON b.id_financiacion = s.original_id_financiacion
-                    JOIN BData d ON b.cedula = d.cedula
-                    LEFT JOIN dim_proyectos dp ON b.id_proyecto = dp.codigo
-                    LEFT JOIN dim_proyectos_otros dpo ON b.id_proyecto = dpo.codigo
-                    WHERE s.version_id = :vid AND ABS(b.salario_t - s.salario_t) > 1
-                      AND b.fecha_inicio <= :y_end AND b.fecha_fin >= :y_start
-                """), {"vid": version_id, "y_start": f"{target_year}-01-01", "y_end": f"{target_year}-12-31"}).mappings().all()]
-            }
+            "detalle_cambios": cambios
+        }
+    except HTTPException: raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Máximo de versiones por consulta de trayectoria
+MAX_VERSIONES_COMPARAR = 24
+
+# Tramos actuales del año (con contrato) para el motor de proyección
+TRAMOS_ACTUALES_SQL = """
+    SELECT f.*, c.atep, c.gerencia, c.estado, c.fecha_terminacion_real,
+           p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c,
+           p.Direccion, p.Planta,
+           CONCAT_WS(' ', d.p_nombre, d.p_apellido) as nombre_completo
+    FROM BFinanciacion f
+    JOIN BContrato c ON f.id_contrato = c.id_contrato
+    LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
+    LEFT JOIN BData d ON f.cedula = d.cedula
+    WHERE f.fecha_inicio <= :y_end AND f.fecha_fin >= :y_start
+"""
+
+def _proyeccion_actual(anio: int, incrementos):
+    """Proyección anual del estado actual (caché de proyecciones, se invalida con cada escritura)."""
+    cache_key = projection_key("presupuesto-actual", anio)
+    cached = get_projection(cache_key)
+    if cached is not None: return cached
+    with engine.connect() as conn:
+        rows = conn.execute(text(TRAMOS_ACTUALES_SQL), {
+            "y_start": f"{anio}-01-01", "y_end": f"{anio}-12-31"
+        }).mappings().all()
+    return put_projection(cache_key, calculate_yearly_projections(rows, incrementos, anio))
+
+@router.get("/comparar-versiones")
+async def comparar_versiones(
+    versiones: str = Query(..., description="Ids de versión separados por coma, p.ej. 3,5,8"),
+    anio: Optional[int] = None,
+    incluir_actual: bool = True,
+    current_user: Any = Depends(get_current_user)
+):
+    """
+    Trayectoria de un año a través de varias versiones congeladas (y el estado actual).
+    Retorna series alineadas con `series`: total, headcount y meses global y por proyecto.
+    """
+    require_role(current_user, ["admin"])
+    try:
+        ids = list(dict.fromkeys(int(v) for v in versiones.split(",") if v.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="versiones debe ser una lista de ids separados por coma")
+    if not ids and not incluir_actual:
+        raise HTTPException(status_code=400, detail="Indique al menos una versión")
+    if len(ids) > MAX_VERSIONES_COMPARAR:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_VERSIONES_COMPARAR} versiones por consulta")
+    try:
+        target_year = anio if anio else datetime.datetime.now().year
+
+        # Datos de referencia una sola vez para todas las versiones
+        ref = await fanout_async({
+            "versiones": (text(VERSIONES_SQL), {}),
+            "meta": (text("SELECT id, nombre_version, fecha_creacion FROM Presupuesto_Versiones"), {}),
+            "incrementos": get_incrementos,
+            "proy_names": lambda: get_catalogo("proyectos"),
+        })
+        meta = {r["id"]: r for r in ref["meta"]}
+        faltantes = [v for v in ids if v not in meta]
+        if faltantes:
+            raise HTTPException(status_code=404, detail=f"Versiones no encontradas: {', '.join(map(str, faltantes))}")
+        incrementos, proy_names = ref["incrementos"], ref["proy_names"]
+
+        # Cada versión (proyección guardada o calculada una vez) y el estado actual en paralelo
+        tareas = {vid: partial(proyeccion_version, vid, target_year, incrementos, ref["versiones"]) for vid in ids}
+        if incluir_actual:
+            tareas["actual"] = partial(_proyeccion_actual, target_year, incrementos)
+        resultados = await fanout_async(tareas)
+
+        series, por_proyecto = [], {}
+        for i, (clave, proy) in enumerate(resultados.items()):
+            if proy is None:
+                raise HTTPException(status_code=404, detail=f"Versión no encontrada: {clave}")
+            if clave == "actual":
+                series.append({"version_id": None, "nombre_version": "Actual", "fecha_creacion": None})
+            else:
+                m = meta[clave]
+                series.append({"version_id": clave, "nombre_version": m["nombre_version"], "fecha_creacion": m["fecha_creacion"]})
+            meses = [0.0] * 12
+            for p in proy["matrix_proyectos"]:
+                pid = p["codigo"]
+                if pid not in por_proyecto:
+                    por_proyecto[pid] = {
+                        "codigo": pid,
+                        "proyecto": str(proy_names.get(pid, p.get("proyecto") or pid)).strip(),
+                        "total": [0.0] * len(resultados),
+                        "headcount": [0] * len(resultados),
+                        "months": [[0.0] * 12 for _ in resultados],
+                    }
+                por_proyecto[pid]["total"][i] = p["total"]
+                por_proyecto[pid]["headcount"][i] = p["headcount"]
+                por_proyecto[pid]["months"][i] = p["months"]
+                meses = [a + b for a, b in zip(meses, p["months"])]
+            series[-1].update({"total": proy["total"], "headcount": proy["headcount"], "months": meses})
+
+        return {
+            "anio": target_year,
+            "series": series,
+            "proyectos": sorted(por_proyecto.values(), key=lambda x: x["total"][-1], reverse=True),
         }
+    except HTTPException: raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -426,7 +427,7 @@ def aprobar_solicitud(req_id: int, user: dict = Depends(get_current_user), db: S
     """ Aprueba una solicitud y aplica los cambios a BFinanciacion """
     require_role(user, ["admin"])
     try:
-        with db.bind.begin() as conn:
+        with transaccion() as conn:
             # 1. Obtener Solicitud
             q_req = text("SELECT * FROM BSolicitud_Cambio WHERE id = :id FOR UPDATE")
             req = conn.execute(q_req, {"id": req_id}).mappings().first()
@@ -438,6 +439,7 @@ def aprobar_solicitud(req_id: int, user: dict = Depends(get_current_user), db: S
 
             datos_nuevos = json.loads(req['datos_nuevos']) if req['datos_nuevos'] else {}
             tipo = req['tipo_solicitud']
+            id_aplicado = req['id_financiacion_afectado']
             
             # 2. Aplicar Cambio
             if tipo == 'ELIMINACION':
@@ -512,20 +514,18 @@ def aprobar_solicitud(req_id: int, user: dict = Depends(get_current_user), db: S
                 
                 # Actualizar el ID afectado en la solicitud (ahora ya no es NUEVO, es el real)
                 conn.execute(text("UPDATE BSolicitud_Cambio SET id_financiacion_afectado = :real_id WHERE id = :rid"), {"real_id": new_id, "rid": req_id})
+                id_aplicado = new_id
 
             # 3. Actualizar Estado Solicitud
             conn.execute(text("UPDATE BSolicitud_Cambio SET estado = 'APROBADO', aprobador = :ap, fecha_aprobacion = CONVERT_TZ(NOW(), '+00:00', '-05:00') WHERE id = :rid"), 
                          {"ap": user['email'], "rid": req_id})
             
-            # 5. Notificar al solicitante
-            conn.execute(text("""
-                INSERT INTO BNotificaciones (usuario_email, mensaje, solicitud_id, tipo)
-                VALUES (:email, :msg, :rid, 'SUCCESS')
-            """), {
-                "email": req['solicitante'],
-                "msg": f"Tu solicitud de {tipo} para la cédula {req.get('cedula')} ha sido APROBADA.",
-                "rid": req_id
-            })
+            # 5. Notificar al solicitante (se publica en vivo tras el commit)
+            notificacion = insertar_notificacion(
+                conn, req['solicitante'],
+                f"Tu solicitud de {tipo} para la cédula {req.get('cedula')} ha sido APROBADA.",
+                req_id, 'SUCCESS'
+            )
 
             # --- LOG DE AUDITORÍA CENTRAL (BAuditoria) ---
             audit_svc = AuditService(db)
@@ -534,9 +534,13 @@ def aprobar_solicitud(req_id: int, user: dict = Depends(get_current_user), db: S
                 module='Financiacion',
                 action='APROBADO',
                 resource_id=str(req['id_financiacion_afectado']),
-                details=f"Aprobación de solicitud {req_id} ({tipo}) para la cédula {req.get('cedula')}. Solicitado por: {req['solicitante']}"
+                details=f"Aprobación de solicitud {req_id} ({tipo}) para la cédula {req.get('cedula')}. Solicitado por: {req['solicitante']}",
+                sincrono=True
             )
 
+        # BFinanciacion cambió: actualizar la proyección incremental e invalidar la caché
+        tramo_changed(id_aplicado)
+        publicar(req['solicitante'], notificacion)
         return {"ok": True, "message": "Cambios aplicados exitosamente"}
 
     except Exception as e:
@@ -547,7 +551,7 @@ def rechazar_solicitud(req_id: int, user: dict = Depends(get_current_user), db:
     """ Rechaza una solicitud """
     require_role(user, ["admin", "financiero", "talento", "nomina"])
     try:
-        with db.bind.begin() as conn:
+        with transaccion() as conn:
             # Obtener datos para la notificación y validación
             req = conn.execute(text("SELECT solicitante, tipo_solicitud, cedula, id_financiacion_afectado, estado FROM BSolicitud_Cambio WHERE id = :id FOR UPDATE"), {"id": req_id}).mappings().first()
             
@@ -566,15 +570,11 @@ def rechazar_solicitud(req_id: int, user: dict = Depends(get_current_user), db:
             conn.execute(text("UPDATE BSolicitud_Cambio SET estado = 'RECHAZADO', aprobador = :ap, fecha_aprobacion = CONVERT_TZ(NOW(), '+00:00', '-05:00') WHERE id = :rid"),
                          {"ap": user['email'], "rid": req_id})
             
-            if req:
-                conn.execute(text("""
-                    INSERT INTO BNotificaciones (usuario_email, mensaje, solicitud_id, tipo)
-                    VALUES (:email, :msg, :rid, 'ERROR')
-                """), {
-                    "email": req['solicitante'],
-                    "msg": f"Tu solicitud de {req['tipo_solicitud']} para la cédula {req['cedula']} ha sido RECHAZADA.",
-                    "rid": req_id
-                })
+            notificacion = insertar_notificacion(
+                conn, req['solicitante'],
+                f"Tu solicitud de {req['tipo_solicitud']} para la cédula {req['cedula']} ha sido RECHAZADA.",
+                req_id, 'ERROR'
+            )
             
             # --- LOG DE AUDITORÍA CENTRAL (BAuditoria) ---
             audit_svc = AuditService(db)
@@ -583,8 +583,10 @@ def rechazar_solicitud(req_id: int, user: dict = Depends(get_current_user), db:
                 module='Financiacion',
                 action='RECHAZADO',
                 resource_id=str(req['id_financiacion_afectado']) if req else str(req_id),
-                details=f"Rechazo de solicitud {req_id} para la cédula {req.get('cedula') if req else 'N/A'}. Solicitado por: {req['solicitante'] if req else 'N/A'}"
+                details=f"Rechazo de solicitud {req_id} para la cédula {req.get('cedula') if req else 'N/A'}. Solicitado por: {req['solicitante'] if req else 'N/A'}",
+                sincrono=True
             )
+        publicar(req['solicitante'], notificacion)
         return {"ok": True, "message": "Solicitud rechazada"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
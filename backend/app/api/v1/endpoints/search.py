@@ -0,0 +1,36 @@
+import time
+from typing import Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.core.security import get_current_user, require_role
+from app.services.search_index import TIPOS, buscar, estado_busqueda, solicitar_reconstruccion
+
+router = APIRouter()
+
+@router.get("")
+def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    tipo: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    user: Any = Depends(get_current_user)
+):
+    """ Búsqueda tipo typeahead de personas (nombre/cédula) y proyectos (código/nombre), por relevancia """
+    require_role(user, ["admin", "financiero", "user", "talento", "nomina"])
+    if tipo and tipo not in TIPOS:
+        raise HTTPException(status_code=400, detail=f"Tipo inválido: {tipo}. Use {', '.join(TIPOS)}.")
+    inicio = time.perf_counter()
+    resultados = buscar(q, tipo, limit)
+    if resultados is None:
+        raise HTTPException(status_code=503, detail="El índice de búsqueda se está construyendo. Intenta en unos segundos.")
+    return {"q": q, "resultados": resultados, "ms": round((time.perf_counter() - inicio) * 1000, 2)}
+
+@router.get("/estado")
+def search_estado(user: Any = Depends(get_current_user)):
+    require_role(user, ["admin"])
+    return estado_busqueda()
+
+@router.post("/reconstruir", status_code=202)
+def search_reconstruir(user: Any = Depends(get_current_user)):
+    """ Fuerza la reconstrucción del índice (en segundo plano) """
+    require_role(user, ["admin"])
+    solicitar_reconstruccion()
+    return {"ok": True, "message": "Reconstrucción del índice solicitada"}
@@ -1,10 +1,11 @@
 from typing import Any, Dict, List
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import text
-from app.core.security import get_current_user, require_role
+from app.core.security import get_current_user, require_role, invalidate_principal
 from app.core.database import engine, get_db
 from app.models.schemas import UserWhitelist
 from app.services.audit_service import AuditService
+from app.core.utils import normalizar_cedula
 from sqlalchemy.orm import Session
 
 router = APIRouter()
@@ -14,8 +15,8 @@ def get_whitelist(user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin"])
     try:
         # Join Strategy: Prefer Cedula if available, else Email.
-        # REGEXP_REPLACE is used to normalize both sides to digits only for comparison (MySQL 8.0+)
-        # Fallback to nested REPLACE if needed, but starting with robust digits match.
+        # La cédula cruza por las llaves normalizadas e indexadas (BWhitelist.cedula_norm = BData.cedula_norm);
+        # el cruce por correo solo aplica a los usuarios sin cédula.
         query = text("""
             SELECT 
                 w.email, 
@@ -31,11 +32,9 @@ def get_whitelist(user: Dict[str, Any] = Depends(get_current_user)):
                 COALESCE(d.cedula, w.cedula) as display_cedula,
                 CASE WHEN d.cedula IS NOT NULL THEN 1 ELSE 0 END as is_mapped
             FROM BWhitelist w
-            LEFT JOIN BData d ON 
-                 (w.cedula IS NOT NULL AND 
-                  REPLACE(REPLACE(REPLACE(CAST(d.cedula AS CHAR), '.', ''), '-', ''), ' ', '') = 
-                  REPLACE(REPLACE(REPLACE(CAST(w.cedula AS CHAR), '.', ''), '-', ''), ' ', '')) 
-              OR (w.cedula IS NULL AND LOWER(TRIM(d.correo_electronico)) = LOWER(TRIM(w.email)))
+            LEFT JOIN BData dc ON dc.cedula_norm = w.cedula_norm
+            LEFT JOIN BData de ON w.cedula_norm IS NULL AND LOWER(TRIM(de.correo_electronico)) = LOWER(TRIM(w.email))
+            LEFT JOIN BData d ON d.cedula = COALESCE(dc.cedula, de.cedula)
             LEFT JOIN BContrato c ON d.cedula = c.cedula AND c.estado = 'Activo'
             LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
             ORDER BY w.email
@@ -82,17 +81,19 @@ def upsert_whitelist(data: UserWhitelist, user: Dict[str, Any] = Depends(get_cur
                 action = "UPDATE"
         
         query = text("""
-            INSERT INTO BWhitelist (email, role, cedula) 
-            VALUES (:email, :role, :cedula) 
+            INSERT INTO BWhitelist (email, role, cedula, cedula_norm) 
+            VALUES (:email, :role, :cedula, :cedula_norm) 
             ON DUPLICATE KEY UPDATE 
                 role = :role, 
-                cedula = :cedula
+                cedula = :cedula,
+                cedula_norm = :cedula_norm
         """)
         
         new_values = {"email": email_val, "role": data.role, "cedula": cedula_raw}
         
         with engine.begin() as conn:
-            conn.execute(query, new_values)
+            conn.execute(query, {**new_values, "cedula_norm": normalizar_cedula(cedula_raw)})
+        invalidate_principal(email_val)
             
         audit.log_event(
             actor_email=user['email'],
@@ -101,7 +102,8 @@ def upsert_whitelist(data: UserWhitelist, user: Dict[str, Any] = Depends(get_cur
             resource_id=resource_id,
             old_values=old_values,
             new_values=new_values,
-            details=f"{action} Usuario {email_val}"
+            details=f"{action} Usuario {email_val}",
+            sincrono=True
         )
         
         return {"ok": True, "mensaje": "Usuario actualizado correctamente"}
@@ -125,6 +127,7 @@ def delete_whitelist(email: str, user: Dict[str, Any] = Depends(get_current_user
         query = text("DELETE FROM BWhitelist WHERE email = :email")
         with engine.begin() as conn:
             conn.execute(query, {"email": email_val})
+        invalidate_principal(email_val)
             
         audit.log_event(
             actor_email=user['email'],
@@ -132,7 +135,8 @@ def delete_whitelist(email: str, user: Dict[str, Any] = Depends(get_current_user
             action='DELETE',
             resource_id=email_val,
             old_values=old_values,
-            details=f"DELETE Usuario {email_val}"
+            details=f"DELETE Usuario {email_val}",
+            sincrono=True
         )
 
         return {"ok": True, "mensaje": "Usuario eliminado de whitelist"}
@@ -144,20 +148,15 @@ def delete_whitelist(email: str, user: Dict[str, Any] = Depends(get_current_user
 def lookup_user_by_cedula(cedula: str, user: Dict[str, Any] = Depends(get_current_user)):
     require_role(user, ["admin"])
     try:
-        # Clean input: keep only digits
-        cedula_digits = "".join(filter(str.isdigit, cedula))
+        # Clean input: misma normalización que BData.cedula_norm
+        cedula_digits = normalizar_cedula(cedula)
         if not cedula_digits:
             return {"found": False, "msg": "No valid digits in cedula"}
 
-        # Use a very simple query first to avoid any DB-specific function issues
-        # MySQL REPLACE is standard but nested ones can sometimes be tricky with some drivers if not handled well
-        # We also look for matches with and without zeros
         query = text("""
             SELECT correo_electronico, p_nombre, p_apellido
             FROM BData 
-            WHERE 
-                REPLACE(REPLACE(REPLACE(CAST(cedula AS CHAR), '.', ''), '-', ''), ' ', '') = :cedula
-                OR TRIM(CAST(cedula AS CHAR)) = :cedula
+            WHERE cedula_norm = :cedula
             LIMIT 1
         """)
         
@@ -2,10 +2,12 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional
 from fastapi import APIRouter, Depends, HTTPException
 from app.core.security import get_current_user, require_role
-from app.core.database import engine
+from app.core.database import conexion, engine
 from sqlalchemy import text
 from app.models.schemas import TramoFinanciacion
 from app.services.payroll_service_optimized import mensualizar_base_30_optimized as mensualizar_base_30
+from app.services.projection_cache import projection_key, get_projection, put_projection, bump_data_version
+from app.services.reference_data import get_incrementos
 from app.core.mock_data import MOCK_VACANTES, MOCK_INCREMENTOS, MOCK_FINANCIACION_VACANTES
 import uuid
 
@@ -17,14 +19,16 @@ def get_vacantes_dashboard(user: Dict[str, Any] = Depends(get_current_user)):
     Calcula el costo proyectado de las vacantes.
     Intenta leer de la DB, si falla usa Mock Data.
     """
-    require_role(user, ["admin", "talento", "nomina"])
-    try:
+    require_role(user, ["admin", "talento", "nomina"])
+    try:
+        cache_key = projection_key("vacantes-dashboard", datetime.now().year)
+        cached = get_projection(cache_key)
+        if cached is not None: return cached
+
         # 1. Intentar obtener incrementos reales
-        with engine.connect() as conn:
-            incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
-            if not incrementos:
-                incrementos = MOCK_INCREMENTOS
+        incrementos = get_incrementos()
+        if not incrementos:
+            incrementos = MOCK_INCREMENTOS
         
         # 2. Intentar obtener posiciones vacantes reales
         # Una posición es vacante si no tiene un contrato activo asociado
@@ -79,7 +83,7 @@ def get_vacantes_dashboard(user: Dict[str, Any] = Depends(get_current_user)):
         # 4. Consolidar resultados
         costo_total = sum(m["total"] for m in mensualizado)
         
-        return {
+        return put_projection(cache_key, {
             "ok": True,
             "resumen": {
                 "total_vacantes": len(tramos),
@@ -88,7 +92,7 @@ def get_vacantes_dashboard(user: Dict[str, Any] = Depends(get_current_user)):
             },
             "distribucion_mensual": [{"mes": m["anioMes"], "total": m["total"]} for m in mensualizado],
             "detalle": mensualizado
-        }
+        })
 
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -101,13 +105,12 @@ def get_individual_vacante(id_posicion: str, user: Dict[str, Any] = Depends(get_
     require_role(user, ["admin", "talento", "nomina"])
     try:
         # 1. Buscar cabecera de la posición
-        with engine.connect() as conn:
+        with conexion() as conn:
             q_pos = text("SELECT * FROM BPosicion WHERE IDPosicion = :id")
             pos_row = conn.execute(q_pos, {"id": id_posicion}).mappings().first()
             pos = dict(pos_row) if pos_row else None
             
-            incs_rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
-            incrementos = {int(r["anio"]): dict(r) for r in incs_rows}
+            incrementos = get_incrementos()
         
         # Fallback Mock if no DB or not found
         if not pos:
@@ -208,6 +211,7 @@ def save_tramo_vacante(dato: TramoFinanciacion, user: Dict[str, Any] = Depends(g
                     "cat": new_tramo["id_categoria"],
                     "resp": new_tramo["id_responsable"]
                 })
+            bump_data_version()
         except Exception:
             pass  # Si falla la inserción en DB, el tramo queda solo en memoria Mock
 
@@ -37,11 +37,74 @@ class Settings(BaseSettings):
     DB_NAME: str = "bosquebd"
     DB_PASS: str = ""
     CLOUDSQL_CONNECTION_NAME: str = ""
+    # Connection pools (app/core/database.py). pool_recycle stays below the idle timeout that
+    # Cloud SQL / the connector apply to idle sockets; DB_POOL_TIMEOUT is how long a checkout
+    # waits on a full pool before failing. The async (aiomysql) pool is sized separately.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_ASYNC_POOL_SIZE: int = 5
+    DB_ASYNC_MAX_OVERFLOW: int = 10
     
     # GCP Vertex AI
     GCP_PROJECT: str = "bosque-485105"
     GCP_LOCATION: str = "us-central1"
 
+    # Projection cache (app/services/projection_cache.py)
+    PROJECTION_CACHE_MAX_MB: int = 256
+    # Safety net for writes made outside this process (sync scripts)
+    PROJECTION_CACHE_TTL_SECONDS: int = 900
+    # Reference data cache: BIncremento and dim_* catalogs (app/services/reference_data.py)
+    REFERENCE_CACHE_TTL_SECONDS: int = 300
+    # Auth caches (app/core/security.py): verified ID tokens live until their exp
+    AUTH_TOKEN_CACHE_MAX: int = 2048
+    AUTH_PRINCIPAL_CACHE_TTL_SECONDS: int = 300
+    # Process-pool mensualización for full-table reports (0 = effective CPU quota: affinity/cgroup;
+    # with one CPU the work stays in-process)
+    PAYROLL_PROCESS_WORKERS: int = 0
+    PAYROLL_PARALLEL_MIN_TRAMOS: int = 2000
+    # Materialized monthly projection (app/services/proyeccion_mensual.py)
+    PROYECCION_MATERIALIZADA: bool = True
+    PROYECCION_FULL_REFRESH_SECONDS: int = 3600
+    PROYECCION_INSERT_BATCH: int = 2000
+    # Streaming payroll CSV upload (app/services/nomina_ingesta.py)
+    NOMINA_UPLOAD_BATCH: int = 5000
+    NOMINA_UPLOAD_CHUNK_BYTES: int = 1048576
+    # Background jobs (app/services/jobs.py); JOBS_DIR empty = <tmp>/guadua_jobs
+    JOBS_WORKERS: int = 2
+    JOBS_DIR: str = ""
+    # Each instance renews the heartbeat of its jobs; jobs whose heartbeat is older than
+    # JOBS_STALE_SECONDS belong to a dead instance and are recovered
+    JOBS_HEARTBEAT_SECONDS: int = 15
+    JOBS_STALE_SECONDS: int = 90
+    # Uploaded job files (JOBS_DIR) of failed jobs and orphans are swept by the heartbeat
+    # after this age; on Cloud Run the temp dir counts against the instance memory
+    JOBS_UPLOAD_TTL_SECONDS: int = 21600
+    # Budget snapshots (app/services/snapshots.py): full checkpoint every N versions
+    SNAPSHOT_CHECKPOINT_EVERY: int = 10
+    # Notification SSE stream (app/services/notificaciones.py): keep-alive interval and max
+    # stream lifetime (the client reconnects, re-validating its token and re-counting). Keep
+    # the lifetime below the Cloud Run request timeout (--timeout 300 in deploy_prod.sh).
+    # POLL is the per-instance check for notifications inserted on other instances
+    NOTIFICACIONES_HEARTBEAT_SECONDS: int = 25
+    NOTIFICACIONES_STREAM_MAX_SECONDS: int = 270
+    NOTIFICACIONES_POLL_SECONDS: int = 10
+    # In-memory search index (app/services/search_index.py): change-check interval and the
+    # largest match set a filter turns into an IN list (beyond it, the SQL LIKE is used)
+    SEARCH_INDEX_CHECK_SECONDS: int = 60
+    SEARCH_MAX_FILTER_IDS: int = 5000
+    # Write-behind audit log (app/services/audit_service.py): bounded queue, batch flush every
+    # AUDIT_FLUSH_MS or AUDIT_BATCH_SIZE events, local JSON-lines spill file on DB failure.
+    # AUDIT_SPILL_FILE empty = <tmp>/guadua_audit_spill.jsonl, which on Cloud Run is in-memory
+    # and lost when the instance stops; point it at a mounted volume (one file per instance)
+    # for the spill to survive a restart
+    AUDIT_QUEUE_MAX: int = 10000
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_FLUSH_MS: int = 500
+    AUDIT_SPILL_FILE: str = ""
+
     @property
     def cors_origins(self) -> List[str]:
         raw = (self.CORS_ORIGINS_RAW or self.CORS_ORIGINS).strip()
@@ -1,6 +1,16 @@
-from sqlalchemy import create_engine
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 import os
+from urllib.parse import quote_plus
 from app.core.config import settings
+from app.core.pool_metrics import MedidoAsyncPool, MedidoQueuePool, instrumentar, metricas_pool
 from sqlalchemy.orm import sessionmaker
 
 # Database credentials and config
@@ -37,29 +47,47 @@ def getconn():
         print(f"Error in getconn (Cloud SQL Connector): {e}")
         raise
 
+# Pool policy shared by both connection strategies (see DB_POOL_* in Settings)
+POOL_KWARGS = dict(
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+)
+
 # Determine connection strategy
 if os.environ.get("USE_TCP_CONNECTION") or not settings.CLOUDSQL_CONNECTION_NAME:
     # Standard TCP (Local Proxy or Direct DB)
     db_url = f"mysql+pymysql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
     print(f"DEBUG: Connecting via TCP to {db_host}:{db_port}")
-    engine = create_engine(
-        db_url,
-        pool_pre_ping=True,
-        pool_size=5,
-        max_overflow=10,
-    )
+    engine = create_engine(db_url, poolclass=MedidoQueuePool, **POOL_KWARGS)
 else:
     # Google Cloud SQL Connector (Cloud Run / Prod)
     print(f"DEBUG: Connecting via Cloud SQL Connector: {settings.CLOUDSQL_CONNECTION_NAME}")
-    engine = create_engine(
-        "mysql+pymysql://",
-        creator=getconn,
-        pool_size=5,
-        max_overflow=10,
-    )
+    engine = create_engine("mysql+pymysql://", creator=getconn, poolclass=MedidoQueuePool, **POOL_KWARGS)
+instrumentar(engine, "sync", settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine (aiomysql) for the heavy read endpoints.
+# The Cloud SQL Python Connector only supports pymysql for MySQL, so in Cloud Run the async
+# pool goes through the unix socket that --add-cloudsql-instances mounts under /cloudsql.
+if os.environ.get("USE_TCP_CONNECTION") or not settings.CLOUDSQL_CONNECTION_NAME:
+    async_db_url = f"mysql+aiomysql://{db_user}:{quote_plus(db_pass)}@{db_host}:{db_port}/{db_name}"
+else:
+    async_db_url = (
+        f"mysql+aiomysql://{db_user}:{quote_plus(db_pass)}@/{db_name}"
+        f"?unix_socket=/cloudsql/{settings.CLOUDSQL_CONNECTION_NAME}"
+    )
+async_engine = create_async_engine(
+    async_db_url,
+    poolclass=MedidoAsyncPool,
+    **{**POOL_KWARGS, "pool_size": settings.DB_ASYNC_POOL_SIZE, "max_overflow": settings.DB_ASYNC_MAX_OVERFLOW},
+)
+instrumentar(async_engine.sync_engine, "async", settings.DB_ASYNC_POOL_SIZE, settings.DB_ASYNC_MAX_OVERFLOW)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -67,8 +95,146 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Request-scoped connection reuse. The outermost conexion()/transaccion() block of a request
+# checks out one pooled connection and publishes it in a ContextVar; nested blocks (helpers
+# such as reference_data loaders or the audit log called from inside an endpoint's block)
+# reuse it instead of taking a second one, which under bursts is what exhausts the pool.
+# Starlette runs each sync endpoint/dependency in its own copy of the context, so requests
+# never see each other's connection; fanout threads do not inherit it (they run in parallel
+# on purpose).
+class _ConexionActual:
+    __slots__ = ("conn", "transaccion")
+
+    def __init__(self, conn: Connection, transaccion: bool):
+        self.conn = conn
+        self.transaccion = transaccion
+
+_conexion_actual: ContextVar[Optional[_ConexionActual]] = ContextVar("conexion_actual", default=None)
+
+@contextmanager
+def conexion() -> Iterator[Connection]:
+    """
+    engine.connect() that reuses the connection of an enclosing block in the same request.
+    Only the outermost block returns it to the pool (rolling back anything left uncommitted).
+    Code running inside a transaccion() must not call conn.commit().
+    """
+    actual = _conexion_actual.get()
+    if actual is not None:
+        yield actual.conn
+        return
+    with engine.connect() as conn:
+        token = _conexion_actual.set(_ConexionActual(conn, False))
+        try:
+            yield conn
+        finally:
+            _conexion_actual.reset(token)
+
+@contextmanager
+def transaccion() -> Iterator[Connection]:
+    """
+    engine.begin() with the same reuse. Nested in another transaccion() it becomes a
+    SAVEPOINT of the outer transaction; nested in a plain conexion() it commits whatever the
+    outer block left pending (its reads) and runs its own transaction on that connection.
+    """
+    actual = _conexion_actual.get()
+    if actual is None:
+        with engine.begin() as conn:
+            token = _conexion_actual.set(_ConexionActual(conn, True))
+            try:
+                yield conn
+            finally:
+                _conexion_actual.reset(token)
+        return
+    conn = actual.conn
+    if actual.transaccion:
+        with conn.begin_nested():
+            yield conn
+        return
+    if conn.in_transaction():
+        conn.commit()
+    actual.transaccion = True
+    try:
+        with conn.begin():
+            yield conn
+    finally:
+        actual.transaccion = False
+
+def estado_db() -> Dict[str, Any]:
+    """SELECT 1 through the sync pool plus the metrics of both pools (for /health/db; error and pools only on /health/db/detalle)."""
+    inicio = time.perf_counter()
+    error = None
+    try:
+        with conexion() as conn:
+            conn.execute(text("SELECT 1")).scalar()
+    except Exception as e:
+        error = str(e)
+    return {
+        "ok": error is None,
+        "error": error,
+        "ping_ms": round((time.perf_counter() - inicio) * 1000, 2),
+        "pools": metricas_pool({"sync": engine, "async": async_engine.sync_engine}),
+    }
+
+# Query fanout: independent statements on separate pooled connections, gathered by name.
+# Kept below pool_size + max_overflow so a fanout never starves the pool.
+FANOUT_WORKERS = max(1, min(8, settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW - 2))
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="db-fanout")
+
+FanoutQuery = Union[Tuple[Any, Dict[str, Any]], Callable[[], Any]]
+
+def _fanout_warn(name: str, e: Exception) -> None:
+    print(f"Warning: optional query '{name}' failed: {e}")
+
+def _run_statement(stmt, params) -> Any:
+    with engine.connect() as conn:
+        return conn.execute(stmt, params or {}).mappings().all()
+
+def fanout(queries: Dict[str, FanoutQuery], optional: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Runs independent queries concurrently and returns {name: result}.
+    Each value is (statement, params), answered with .mappings().all() on its own connection,
+    or a zero-argument callable (e.g. a reference-data loader). Names listed in `optional`
+    return [] on failure instead of raising. Do not call fanout from inside a fanout callable.
+    """
+    futures = {
+        name: _fanout_executor.submit(q) if callable(q) else _fanout_executor.submit(_run_statement, *q)
+        for name, q in queries.items()
+    }
+    results = {}
+    for name, fut in futures.items():
+        try:
+            results[name] = fut.result()
+        except Exception as e:
+            if name not in optional: raise
+            _fanout_warn(name, e)
+            results[name] = []
+    return results
+
+async def fanout_async(queries: Dict[str, FanoutQuery], optional: Iterable[str] = ()) -> Dict[str, Any]:
+    """Async version of fanout: statements go through async_engine, callables to the fanout executor."""
+    async def _run(name, q):
+        try:
+            if callable(q):
+                return await asyncio.get_running_loop().run_in_executor(_fanout_executor, q)
+            async with async_engine.connect() as conn:
+                return (await conn.execute(q[0], q[1] or {})).mappings().all()
+        except Exception as e:
+            if name not in optional: raise
+            _fanout_warn(name, e)
+            return []
+    results = await asyncio.gather(*(_run(name, q) for name, q in queries.items()))
+    return dict(zip(queries.keys(), results))
+
+async def disconnect_async():
+    await async_engine.dispose()
+
 def disconnect():
     global _connector
+    _fanout_executor.shutdown(wait=False)
     if _connector:
         try:
             _connector.close()
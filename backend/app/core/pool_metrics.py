@@ -0,0 +1,156 @@
+"""
+Métricas de los pools de conexiones (engine síncrono y aiomysql).
+
+Los pools se crean con las subclases medidas de este módulo: cada checkout registra su
+latencia total (espera en la cola + conexión nueva + pre-ping) y, si el pool estaba lleno
+al pedirla, la cuenta como espera. Los eventos del pool agregan conexiones nuevas, uso de
+overflow, invalidaciones y el tiempo que cada conexión estuvo prestada. /health/db expone
+el resumen (metricas_pool()).
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Latencias recientes por pool para percentiles (las más viejas se descartan)
+_MUESTRAS = 2000
+
+_lock = threading.Lock()
+_metricas: Dict[str, Dict[str, Any]] = {}
+
+
+def _nuevas() -> Dict[str, Any]:
+    return {
+        "checkouts": 0, "esperas": 0, "espera_total_s": 0.0, "espera_max_s": 0.0, "timeouts": 0,
+        "conexiones_nuevas": 0, "conexiones_overflow": 0, "pico_prestadas": 0,
+        "invalidaciones": 0, "invalidaciones_suaves": 0,
+        "prestamo_max_s": 0.0,
+        "latencias": deque(maxlen=_MUESTRAS), "prestamos": deque(maxlen=_MUESTRAS),
+    }
+
+
+def _m(nombre: str) -> Dict[str, Any]:
+    m = _metricas.get(nombre)
+    if m is None:
+        m = _metricas[nombre] = _nuevas()
+    return m
+
+
+class _PoolMedido:
+    """Mixin para QueuePool: mide cada Pool.connect() del engine."""
+    _nombre_metricas = "db"
+    _capacidad = 0
+
+    def connect(self):
+        lleno = self._capacidad > 0 and self.checkedout() >= self._capacidad
+        inicio = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with _lock:
+                _m(self._nombre_metricas)["timeouts"] += 1
+            raise
+        finally:
+            dt = time.perf_counter() - inicio
+            with _lock:
+                m = _m(self._nombre_metricas)
+                m["checkouts"] += 1
+                m["latencias"].append(dt)
+                m["pico_prestadas"] = max(m["pico_prestadas"], self.checkedout())
+                if lleno:
+                    m["esperas"] += 1
+                    m["espera_total_s"] += dt
+                    m["espera_max_s"] = max(m["espera_max_s"], dt)
+
+
+class MedidoQueuePool(_PoolMedido, QueuePool):
+    pass
+
+
+class MedidoAsyncPool(_PoolMedido, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrumentar(engine, nombre: str, pool_size: int, max_overflow: int) -> None:
+    """Registra los eventos del pool de `engine` (sync_engine para motores async) bajo `nombre`."""
+    pool = engine.pool
+    if isinstance(pool, _PoolMedido):
+        pool._nombre_metricas = nombre
+        pool._capacidad = pool_size + max(0, max_overflow)
+
+    @event.listens_for(pool, "connect")
+    def _connect(dbapi_conn, record):
+        with _lock:
+            m = _m(nombre)
+            m["conexiones_nuevas"] += 1
+            if pool.overflow() > 0:
+                m["conexiones_overflow"] += 1
+
+    @event.listens_for(pool, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        record.info["prestada_desde"] = time.perf_counter()
+
+    @event.listens_for(pool, "checkin")
+    def _checkin(dbapi_conn, record):
+        desde = record.info.pop("prestada_desde", None)
+        if desde is None:
+            return
+        dt = time.perf_counter() - desde
+        with _lock:
+            m = _m(nombre)
+            m["prestamos"].append(dt)
+            m["prestamo_max_s"] = max(m["prestamo_max_s"], dt)
+
+    @event.listens_for(pool, "invalidate")
+    def _invalidate(dbapi_conn, record, exc):
+        with _lock:
+            _m(nombre)["invalidaciones"] += 1
+
+    @event.listens_for(pool, "soft_invalidate")
+    def _soft_invalidate(dbapi_conn, record, exc):
+        with _lock:
+            _m(nombre)["invalidaciones_suaves"] += 1
+
+    with _lock:
+        _m(nombre)
+
+
+def _percentiles(valores: List[float]) -> Dict[str, float]:
+    if not valores:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    orden = sorted(valores)
+    n = len(orden)
+    return {
+        "p50_ms": round(orden[n // 2] * 1000, 2),
+        "p95_ms": round(orden[min(n - 1, int(n * 0.95))] * 1000, 2),
+        "max_ms": round(orden[-1] * 1000, 2),
+    }
+
+
+def metricas_pool(engines: Dict[str, Any]) -> Dict[str, Any]:
+    """Contadores acumulados y estado actual de cada pool ({nombre: engine})."""
+    salida = {}
+    for nombre, engine in engines.items():
+        pool = engine.pool
+        with _lock:
+            m = dict(_m(nombre))
+            latencias, prestamos = list(m.pop("latencias")), list(m.pop("prestamos"))
+        m["espera_total_s"] = round(m["espera_total_s"], 3)
+        m["espera_max_s"] = round(m["espera_max_s"], 3)
+        m["prestamo_max_s"] = round(m["prestamo_max_s"], 3)
+        salida[nombre] = {
+            **m,
+            "latencia_checkout": _percentiles(latencias),
+            "duracion_prestamo": _percentiles(prestamos),
+            "estado": {
+                "tamano": pool.size(),
+                "prestadas": pool.checkedout(),
+                "disponibles": pool.checkedin(),
+                "overflow": max(0, pool.overflow()),
+            },
+        }
+    return salida
@@ -1,10 +1,15 @@
-from typing import Any, Dict, List, Optional
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import Header, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from sqlalchemy import text
 from app.core.config import settings
-from app.core.database import engine
+from app.core.database import async_engine
 
 def get_bearer_token(authorization: Optional[str]) -> str:
     if not authorization:
@@ -14,17 +19,128 @@ def get_bearer_token(authorization: Optional[str]) -> str:
         raise HTTPException(status_code=401, detail="Formato inválido de Authorization. Use Bearer <token>.")
     return parts[1].strip()
 
+class _CertCachingRequest(google_requests.Request):
+    """
+    Transporte de google-auth que reutiliza una sola sesión HTTP y guarda en memoria las
+    respuestas GET (certificados públicos de Google) según su Cache-Control max-age.
+    """
+    def __init__(self):
+        super().__init__()
+        self._cache: Dict[str, Tuple[Any, float]] = {}
+        self._cache_lock = threading.Lock()
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=120, **kwargs):
+        if method != "GET":
+            return super().__call__(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        with self._cache_lock:
+            entry = self._cache.get(url)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+        response = super().__call__(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        max_age = _max_age(response.headers.get("cache-control", ""))
+        if response.status == 200 and max_age > 0:
+            with self._cache_lock:
+                self._cache[url] = (response, time.monotonic() + max_age)
+        return response
+
+def _max_age(cache_control: str) -> int:
+    for part in cache_control.split(","):
+        key, _, value = part.strip().partition("=")
+        if key.lower() == "max-age" and value.isdigit():
+            return int(value)
+    return 0
+
+_google_request = _CertCachingRequest()
+
+# Claims ya verificados: sha256(token) -> (claims, exp). Acotado por AUTH_TOKEN_CACHE_MAX (LRU)
+_token_lock = threading.Lock()
+_token_cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+
+def _cached_claims(token: str) -> Optional[Dict[str, Any]]:
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    with _token_lock:
+        entry = _token_cache.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                _token_cache.move_to_end(key)
+                return entry[0]
+            del _token_cache[key]
+    return None
+
 def verify_google_token(token: str) -> Dict[str, Any]:
-    req = google_requests.Request()
+    claims = _cached_claims(token)
+    if claims is not None:
+        return claims
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
     try:
         if settings.AUDIENCE:
-            claims = id_token.verify_oauth2_token(token, req, settings.AUDIENCE)
+            claims = id_token.verify_oauth2_token(token, _google_request, settings.AUDIENCE)
         else:
-            claims = id_token.verify_oauth2_token(token, req)
-        return claims
+            claims = id_token.verify_oauth2_token(token, _google_request)
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Token inválido o expirado: {str(e)}")
 
+    exp = float(claims.get("exp") or 0)
+    if exp > now:
+        with _token_lock:
+            _token_cache[key] = (claims, exp)
+            while len(_token_cache) > settings.AUTH_TOKEN_CACHE_MAX:
+                _token_cache.popitem(last=False)
+    return claims
+
+# Principal por email: email -> (role, nombre, cargado). role None = no está en BWhitelist
+_principal_lock = threading.Lock()
+_principal_cache: Dict[str, Tuple[Optional[str], str, float]] = {}
+
+async def _load_principal(email: str) -> Tuple[Optional[str], str]:
+    async with async_engine.connect() as conn:
+        q = text("SELECT role FROM BWhitelist WHERE email = :email LIMIT 1")
+        row = (await conn.execute(q, {"email": email})).fetchone()
+        
+        # Priorizar persona con contrato ACTIVO en caso de email duplicado en BData
+        q_name = text("""
+            SELECT d.p_nombre, d.p_apellido
+            FROM BData d
+            JOIN BContrato c ON d.cedula = c.cedula
+            WHERE d.correo_electronico = :email
+              AND c.estado LIKE 'Activo%'
+            ORDER BY c.fecha_ingreso DESC
+            LIMIT 1
+        """)
+        row_name = (await conn.execute(q_name, {"email": email})).fetchone()
+
+        # Fallback: si no hay contrato activo con ese email, usar cualquier registro de BData
+        if not row_name:
+            q_name_fallback = text(
+                "SELECT p_nombre, p_apellido FROM BData WHERE correo_electronico = :email LIMIT 1"
+            )
+            row_name = (await conn.execute(q_name_fallback, {"email": email})).fetchone()
+
+    nombre_completo = ""
+    if row_name:
+        nombre_completo = f"{(row_name[0] or '').strip()} {(row_name[1] or '').strip()}".strip()
+    return (row[0] if row else None), nombre_completo
+
+async def get_principal(email: str) -> Tuple[Optional[str], str]:
+    """(role, nombre) del email, cacheado AUTH_PRINCIPAL_CACHE_TTL_SECONDS."""
+    with _principal_lock:
+        entry = _principal_cache.get(email)
+        if entry is not None and (time.monotonic() - entry[2]) <= settings.AUTH_PRINCIPAL_CACHE_TTL_SECONDS:
+            return entry[0], entry[1]
+    role, nombre = await _load_principal(email)
+    with _principal_lock:
+        _principal_cache[email] = (role, nombre, time.monotonic())
+    return role, nombre
+
+def invalidate_principal(email: Optional[str] = None) -> None:
+    """Descarta el principal cacheado de un email (o todos). Llamar al modificar BWhitelist."""
+    with _principal_lock:
+        if email is None:
+            _principal_cache.clear()
+        else:
+            _principal_cache.pop(email.strip().lower(), None)
+
 async def get_current_user(
     authorization: Optional[str] = Header(default=None, alias="Authorization"),
 ) -> Dict[str, Any]:
@@ -38,7 +154,8 @@ async def get_current_user(
         }
 
     token = get_bearer_token(authorization)
-    claims = verify_google_token(token)
+    # Token ya verificado: lookup en memoria. Si no, la verificación (posible fetch HTTPS de certs) va al threadpool
+    claims = _cached_claims(token) or await run_in_threadpool(verify_google_token, token)
 
     email = (claims.get("email") or "").strip().lower()
     if not email:
@@ -47,43 +164,17 @@ async def get_current_user(
     if not email.endswith(f"@{settings.ALLOWED_DOMAIN}"):
         raise HTTPException(status_code=403, detail=f"Dominio @{settings.ALLOWED_DOMAIN} requerido.")
 
-    # Check authorization in DB
-    with engine.connect() as conn:
-        q = text("SELECT role FROM BWhitelist WHERE email = :email LIMIT 1")
-        row = conn.execute(q, {"email": email}).fetchone()
-        
-        # Priorizar persona con contrato ACTIVO en caso de email duplicado en BData
-        q_name = text("""
-            SELECT d.p_nombre, d.p_apellido
-            FROM BData d
-            JOIN BContrato c ON d.cedula = c.cedula
-            WHERE d.correo_electronico = :email
-              AND c.estado LIKE 'Activo%'
-            ORDER BY c.fecha_ingreso DESC
-            LIMIT 1
-        """)
-        row_name = conn.execute(q_name, {"email": email}).fetchone()
-
-        # Fallback: si no hay contrato activo con ese email, usar cualquier registro de BData
-        if not row_name:
-            q_name_fallback = text(
-                "SELECT p_nombre, p_apellido FROM BData WHERE correo_electronico = :email LIMIT 1"
-            )
-            row_name = conn.execute(q_name_fallback, {"email": email}).fetchone()
+    # Check authorization in DB (cached per email)
+    role, nombre_completo = await get_principal(email)
 
-    if not row:
+    if not role:
         raise HTTPException(
             status_code=403,
             detail="Usuario no autorizado. Solicita acceso para ser incluido en BWhitelist.",
         )
 
-    role = row[0]
-    if role not in ("admin", "user", "financiero", "talento", "nomina"):
-        raise HTTPException(status_code=403, detail="Rol inválido en BWhitelist.")
-    
-    nombre_completo = ""
-    if row_name:
-        nombre_completo = f"{(row_name[0] or '').strip()} {(row_name[1] or '').strip()}".strip()
+    if role not in ("admin", "user", "financiero", "talento", "nomina"):
+        raise HTTPException(status_code=403, detail="Rol inválido en BWhitelist.")
 
     return {"email": email, "role": role, "nombre": nombre_completo, "source": "db"}
 
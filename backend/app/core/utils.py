@@ -1,6 +1,6 @@
 import math
 from datetime import date, datetime
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
 
 def to_date(value: Any) -> Optional[date]:
     if value is None:
@@ -19,6 +19,37 @@ def to_date(value: Any) -> Optional[date]:
 def month_start(d: date) -> date:
     return date(d.year, d.month, 1)
 
+def rango_periodo(periodo: str) -> Tuple[date, date]:
+    """'YYYY-MM' -> rango semiabierto [primer día del mes, primer día del mes siguiente)."""
+    try:
+        anio, mes = (int(x) for x in str(periodo).strip()[:7].split('-'))
+        inicio = date(anio, mes, 1)
+    except Exception:
+        raise ValueError(f"Periodo inválido: {periodo}. Use el formato YYYY-MM.")
+    return inicio, date(anio + mes // 12, mes % 12 + 1, 1)
+
+def rango_anio(anio: int) -> Tuple[date, date]:
+    """Año -> rango semiabierto [1 de enero, 1 de enero del año siguiente)."""
+    return date(anio, 1, 1), date(anio + 1, 1, 1)
+
+def normalizar_cedula(value: Any) -> Optional[str]:
+    """Cédula como llave de cruce: sin puntos, guiones ni espacios (solo dígitos/letras)."""
+    if value is None:
+        return None
+    s = "".join(ch for ch in str(value).strip() if ch.isalnum()).upper()
+    return s or None
+
+def normalizar_proyecto(value: Any) -> Optional[str]:
+    """Código de proyecto como llave de cruce: sin espacios y, si es numérico, con ceros a 3 dígitos (13 -> 013)."""
+    if value is None:
+        return None
+    s = str(value).strip()
+    if not s:
+        return None
+    if s.isdigit():
+        return str(int(s)).zfill(3)
+    return s
+
 def round_hundred(x: float) -> float:
     """Redondea a la centena más cercana con lógica 0.5 hacia arriba (estándar)"""
     return float(math.floor(x / 100.0 + 0.5) * 100)
@@ -1,13 +1,21 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from app.core.config import settings
 from app.api.v1 import api_router
-from app.core.database import disconnect
+from app.core.database import disconnect, disconnect_async, estado_db
+from app.core.security import get_current_user, require_role
+from app.services.payroll_service_optimized import shutdown_process_pool
+from app.services.proyeccion_mensual import iniciar_materializador, detener_materializador
+from app.services.jobs import iniciar_jobs, detener_jobs
+from app.services.search_index import iniciar_busqueda, detener_busqueda
+from app.services.audit_service import iniciar_auditoria, detener_auditoria, estado_auditoria
+from app.services.notificaciones import iniciar_notificaciones, detener_notificaciones
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 import logging
 import os
+from typing import Any, Dict
 
 # Configure concise logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S")
@@ -40,9 +48,38 @@ if os.path.exists(FRONTEND_PATH):
     app.mount("/js", StaticFiles(directory=os.path.join(FRONTEND_PATH, "js")), name="js")
     app.mount("/css", StaticFiles(directory=os.path.join(FRONTEND_PATH, "css")), name="css")
 
+@app.on_event("startup")
+async def startup_event():
+    iniciar_materializador()
+    iniciar_jobs()
+    iniciar_busqueda()
+    iniciar_auditoria()
+    iniciar_notificaciones()
+
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
+    detener_materializador()
+    detener_jobs()
+    detener_busqueda()
+    detener_notificaciones()
+    # Antes de cerrar los pools: lo encolado en la bitácora se escribe (o va al archivo local)
+    detener_auditoria()
+    await disconnect_async()
     disconnect()
+    shutdown_process_pool()
+
+@app.get("/health/db")
+def health_db():
+    """ Ping a la base (público: solo ok y ping_ms; el detalle está en /health/db/detalle) """
+    estado = estado_db()
+    return JSONResponse({"ok": estado["ok"], "ping_ms": estado["ping_ms"]}, status_code=200 if estado["ok"] else 503)
+
+@app.get("/health/db/detalle")
+def health_db_detalle(user: Dict[str, Any] = Depends(get_current_user)):
+    """ Ping, error de la base, métricas de los pools (checkouts, esperas, overflow, invalidaciones) y estado de la bitácora. Solo admin. """
+    require_role(user, ["admin"])
+    estado = {**estado_db(), "auditoria": estado_auditoria()}
+    return JSONResponse(estado, status_code=200 if estado["ok"] else 503)
 
 @app.get("/")
 async def root():
@@ -72,7 +72,9 @@ BFinanciacion: Tramos de financiación (un contrato puede tener múltiples fuent
 
 BFinanciacion_Snapshot: Versiones históricas de financiación (para comparación presupuestal).
   - snapshot_id (PK), version_id (FK → Presupuesto_Versiones.id).
-  - original_id_financiacion, cedula, id_proyecto, id_contrato.
+  - Solo las versiones con Presupuesto_Versiones.es_checkpoint = 1 son copias completas; las demás
+    guardan cambios (op 'A'/'M'/'D') respecto de base_version_id. No sumes una versión delta filtrando version_id.
+  - original_id_financiacion, op, cedula, id_proyecto, id_contrato.
   - valor_mensual, salario_t, pago_proyectado (decimal).
   - fecha_inicio, fecha_fin.
 
@@ -85,7 +87,8 @@ BNomina: Registros de nómina real pagada.
   - nom_con: Nombre del concepto (ej: 'SUELDO BASICO', 'AUXILIO TRANSPORTE').
   - val_liq (decimal): Valor liquidado (puede ser negativo para deducciones).
   - nom_liq: Nombre de la liquidación.
-  - fec_liq (date): Fecha de liquidación.
+  - fec_liq (date): Fecha de liquidación (indexada: filtrar por rango, ej. fec_liq >= '2026-01-01' AND fec_liq < '2027-01-01').
+  - periodo (char 7, 'YYYY-MM', generada de fec_liq e indexada): usar periodo = '2026-01' para filtrar un mes.
   - id_proyecto, id_fuente, id_componente, id_subcomponente, id_categoria, id_responsable.
 
 BIncremento: Tabla de parámetros de incremento salarial por año.
@@ -126,14 +129,15 @@ BWhitelist: Usuarios autorizados.
   - email (PK), role ('admin','financiero','talento','nomina','user'), cedula.
 
 Presupuesto_Versiones: Versiones de presupuesto.
-  - id (PK), nombre_version, creado_por, descripcion, bloqueada (0/1).
+  - id (PK), nombre_version, creado_por, descripcion, bloqueada (0/1), base_version_id, es_checkpoint (0/1).
 
 === RELACIONES CLAVE (JOINS) ===
 - BData.cedula = BContrato.cedula
 - BContrato.posicion = BPosicion.IDPosicion
 - BContrato.id_contrato = BFinanciacion.id_contrato
 - BFinanciacion.cedula = BData.cedula
-- BNomina.cod_emp = BData.cedula
+- BNomina.cod_emp_norm = BData.cedula_norm (llaves normalizadas e indexadas; no usar TRIM/REPLACE)
+- BNomina.proyecto_norm = dim_proyectos.codigo_norm / dim_proyectos_otros.codigo_norm
 - BFinanciacion.id_proyecto → dim_proyectos.codigo / dim_proyectos_otros.codigo
 - Para obtener nombre completo: CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)
 - Para nombre de proyecto: LEFT JOIN dim_proyectos dp ON f.id_proyecto = dp.codigo LEFT JOIN dim_proyectos_otros dpo ON f.id_proyecto = dpo.codigo → COALESCE(dp.nombre, dpo.nombre) AS nombre_proyecto
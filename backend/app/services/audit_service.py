@@ -1,10 +1,203 @@
-from app.core.database import engine
+"""
+Bitácora de auditoría (BAuditoria) con escritura diferida.
+
+log_event arma la fila y la deja en una cola acotada (AUDIT_QUEUE_MAX); un hilo de fondo
+la vacía en INSERT multi-fila cada AUDIT_FLUSH_MS o cada AUDIT_BATCH_SIZE eventos, así
+la petición no paga el viaje a la base. Si la base falla (o la cola se llena) las filas van
+a un archivo (AUDIT_SPILL_FILE, JSON por línea) que se reenvía cuando la base vuelve.
+Por defecto el archivo está en el directorio temporal de la instancia: en Cloud Run es memoria,
+así que solo sobrevive mientras la instancia vive; para conservarlo tras un reinicio,
+AUDIT_SPILL_FILE debe apuntar a un volumen montado.
+Al apagar la app se vacía la cola. Los eventos críticos de escritura pueden pedir
+sincrono=True: se insertan en la transacción/conexión de la petición (app.core.database).
+"""
+from app.core.config import settings
+from app.core.database import conexion, engine, transaccion
 from sqlalchemy import text
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import json
 import datetime
+import os
+import queue
+import tempfile
+import threading
+import time
 from decimal import Decimal
 
+AUDIT_INSERT_SQL = text("""
+    INSERT INTO BAuditoria (
+        timestamp, actor_email, module, action, resource_id,
+        old_values, new_values, details, actor_ip
+    ) VALUES (
+        :ts, :email, :mod, :act, :rid,
+        :old, :new, :det, :ip
+    )
+""")
+
+# Misma hora que CONVERT_TZ(NOW(), '+00:00', '-05:00'), tomada al momento del evento
+_BOGOTA = datetime.timezone(datetime.timedelta(hours=-5))
+# Tras un reenvío fallido del archivo local, esperar antes de reintentar
+_REENVIO_ESPERA_SECONDS = 30
+
+_cola: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max(1, settings.AUDIT_QUEUE_MAX))
+_spill_lock = threading.Lock()
+_stop = False
+_thread: Optional[threading.Thread] = None
+_estado: Dict[str, Any] = {"escritos": 0, "lotes": 0, "derramados": 0, "reenviados": 0, "error": None}
+
+
+def _default_serializer(obj):
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+
+def _motivo(e: Any) -> str:
+    # Solo la primera línea: los errores de SQLAlchemy incluyen el SQL y todos los parámetros
+    return (str(e).strip().splitlines() or [""])[0][:300]
+
+
+def _insertar(conn, filas: List[Dict[str, Any]]) -> None:
+    # pymysql convierte el executemany en un INSERT multi-fila
+    conn.execute(AUDIT_INSERT_SQL, filas)
+
+
+def _ruta_derrame() -> str:
+    return settings.AUDIT_SPILL_FILE or os.path.join(tempfile.gettempdir(), "guadua_audit_spill.jsonl")
+
+
+def _ruta_reenvio() -> str:
+    # El archivo se renombra aquí para reenviarlo sin bloquear a _derramar
+    return _ruta_derrame() + ".reenvio"
+
+
+def _hay_derrame() -> bool:
+    return os.path.exists(_ruta_reenvio()) or os.path.exists(_ruta_derrame())
+
+
+def _derramar(filas: List[Dict[str, Any]], motivo: Any) -> None:
+    """Agrega las filas al archivo local (fsync) para reenviarlas cuando la base responda."""
+    try:
+        with _spill_lock, open(_ruta_derrame(), "a", encoding="utf-8") as f:
+            for fila in filas:
+                f.write(json.dumps(fila, default=_default_serializer) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            _estado["derramados"] += len(filas)
+        _estado["error"] = _motivo(motivo)
+        print(f"Warning: {len(filas)} audit events spilled to {_ruta_derrame()} ({_estado['error']})")
+    except Exception as e:
+        try:
+            with open("audit_errors.log", "a") as f:
+                f.write(f"FAILED AUDIT LOG: {str(motivo)} / {str(e)}\n{json.dumps(filas, default=_default_serializer)}\n\n")
+        except: pass
+        print(f"CRITICAL AUDIT FAILURE: {motivo} / {e}")
+
+
+def _reenviar_derrame() -> bool:
+    """
+    Inserta el archivo local en una sola transacción y lo borra. False si la base sigue fallando.
+    Bajo _spill_lock solo se renombra el archivo; la lectura y el INSERT van fuera del lock,
+    así _derramar sigue escribiendo en un archivo nuevo mientras tanto. Si el INSERT falla,
+    el archivo renombrado queda y se reintenta antes de tomar el siguiente.
+    """
+    ruta = _ruta_reenvio()
+    with _spill_lock:
+        if not os.path.exists(ruta):
+            if not os.path.exists(_ruta_derrame()):
+                return True
+            os.replace(_ruta_derrame(), ruta)
+    filas = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                continue # línea truncada por una caída a mitad de escritura
+            if fila.get("ts"):
+                fila["ts"] = datetime.datetime.fromisoformat(fila["ts"])
+            filas.append(fila)
+    try:
+        if filas:
+            with engine.begin() as conn:
+                for i in range(0, len(filas), max(1, settings.AUDIT_BATCH_SIZE)):
+                    _insertar(conn, filas[i:i + settings.AUDIT_BATCH_SIZE])
+        os.remove(ruta)
+    except Exception as e:
+        _estado["error"] = _motivo(e)
+        return False
+    _estado["reenviados"] += len(filas)
+    _estado["error"] = None
+    print(f"Audit: {len(filas)} spilled events written to BAuditoria")
+    return True
+
+
+def _escribir(lote: List[Dict[str, Any]]) -> None:
+    try:
+        with engine.begin() as conn:
+            _insertar(conn, lote)
+        _estado["escritos"] += len(lote)
+        _estado["lotes"] += 1
+    except Exception as e:
+        _derramar(lote, e)
+
+
+def _flusher() -> None:
+    espera = max(0.01, settings.AUDIT_FLUSH_MS / 1000)
+    lote_max = max(1, settings.AUDIT_BATCH_SIZE)
+    proximo_reenvio = 0.0
+    while True:
+        lote: List[Dict[str, Any]] = []
+        limite = time.monotonic() + espera
+        while len(lote) < lote_max:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(_cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        if lote:
+            _escribir(lote)
+        if time.monotonic() >= proximo_reenvio and _hay_derrame():
+            ok = _reenviar_derrame()
+            proximo_reenvio = 0.0 if ok else time.monotonic() + _REENVIO_ESPERA_SECONDS
+        if _stop and _cola.empty():
+            return
+
+
+def iniciar_auditoria() -> None:
+    """Arranca el hilo que escribe la bitácora (idempotente). Reenvía lo derramado en corridas previas."""
+    global _thread, _stop
+    if _thread and _thread.is_alive():
+        return
+    _stop = False
+    _thread = threading.Thread(target=_flusher, name="audit-flusher", daemon=True)
+    _thread.start()
+
+
+def detener_auditoria(timeout: float = 10.0) -> None:
+    """Vacía la cola en BAuditoria antes de apagar; lo que no alcance a escribirse va al archivo local."""
+    global _stop
+    _stop = True
+    if _thread and _thread.is_alive():
+        _thread.join(timeout)
+    pendientes = []
+    while True:
+        try:
+            pendientes.append(_cola.get_nowait())
+        except queue.Empty:
+            break
+    if pendientes:
+        _derramar(pendientes, "apagado")
+
+
+def estado_auditoria() -> Dict[str, Any]:
+    return {**_estado, "pendientes": _cola.qsize(), "activo": bool(_thread and _thread.is_alive())}
+
+
 class AuditService:
     def __init__(self, db: Any = None):
         # DB session is no longer required but kept for compatibility
@@ -30,56 +223,45 @@ class AuditService:
         old_values: Optional[Dict[str, Any]] = None,
         new_values: Optional[Dict[str, Any]] = None,
         details: Optional[str] = None,
-        actor_ip: Optional[str] = None
+        actor_ip: Optional[str] = None,
+        sincrono: bool = False
     ):
+        """
+        Registra el evento. Por defecto lo encola para el hilo de escritura; con sincrono=True
+        (o si el hilo no corre, p.ej. en scripts) lo inserta ya, dentro de la transacción de
+        la petición si la hay.
+        """
         try:
-            import datetime
-            
-            # Manual JSON dump with robust default handler
-            def default_serializer(obj):
-                if isinstance(obj, (datetime.date, datetime.datetime)):
-                    return obj.isoformat()
-                if isinstance(obj, Decimal):
-                    return float(obj)
-                return str(obj)
-
-            old_json = json.dumps(old_values, default=default_serializer) if old_values else None
-            new_json = json.dumps(new_values, default=default_serializer) if new_values else None
-            
-            query = text("""
-                INSERT INTO BAuditoria (
-                    timestamp, actor_email, module, action, resource_id, 
-                    old_values, new_values, details, actor_ip
-                ) VALUES (
-                    CONVERT_TZ(NOW(), '+00:00', '-05:00'), :email, :mod, :act, :rid, 
-                    :old, :new, :det, :ip
-                )
-            """)
-            
             params = {
+                "ts": datetime.datetime.now(_BOGOTA).replace(tzinfo=None),
                 "email": actor_email,
                 "mod": module,
                 "act": action,
                 "rid": resource_id,
-                "old": old_json,
-                "new": new_json,
+                "old": json.dumps(old_values, default=_default_serializer) if old_values else None,
+                "new": json.dumps(new_values, default=_default_serializer) if new_values else None,
                 "det": details,
                 "ip": actor_ip
             }
-            
-            # Direct Engine Execution independently of any session
-            with engine.begin() as conn:
-                conn.execute(query, params)
-                
-            return True
         except Exception as e:
-            try:
-                with open("audit_errors.log", "a") as f:
-                    f.write(f"FAILED AUDIT LOG: {str(e)}\n\n")
-            except: pass
             print(f"CRITICAL AUDIT FAILURE: {e}")
             return False
 
+        if not sincrono and _thread and _thread.is_alive() and not _stop:
+            try:
+                _cola.put_nowait(params)
+            except queue.Full:
+                _derramar([params], "cola llena")
+            return True
+
+        try:
+            with transaccion() as conn:
+                _insertar(conn, [params])
+            return True
+        except Exception as e:
+            _derramar([params], e)
+            return False
+
     def get_logs(
         self, 
         limit: int = 100, 
@@ -114,7 +296,7 @@ class AuditService:
             
             count_sql = text(f"SELECT COUNT(*) FROM BAuditoria {where_str}")
             
-            with engine.connect() as conn:
+            with conexion() as conn:
                 total = conn.execute(count_sql, params).scalar()
                 rows = conn.execute(sql, params).mappings().all()
                 
@@ -0,0 +1,105 @@
+"""
+Exportaciones en streaming (NDJSON / CSV) con gzip por bloques.
+
+Las filas se serializan a medida que el motor de mensualización las produce: la memoria
+queda acotada a un mes de detalle más el buffer de salida, y el primer byte sale apenas
+se calcula el primer mes. El gzip se hace aquí (Z_SYNC_FLUSH por bloque) y la respuesta
+lleva Content-Encoding para que GZipMiddleware no la vuelva a comprimir.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+# Tamaño aproximado de cada bloque enviado al cliente
+CHUNK_BYTES = 64 * 1024
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _json_default(v: Any) -> Any:
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return str(v)
+
+
+def ndjson_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    for row in rows:
+        yield (json.dumps(row, default=_json_default, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def csv_lines(rows: Iterable[Dict[str, Any]], columns: List[str]) -> Iterator[bytes]:
+    """CSV con encabezado fijo; columnas ausentes quedan vacías y las extra se ignoran."""
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+    # BOM para que Excel detecte UTF-8 (tildes y ñ)
+    buf.write("\ufeff")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({k: (v.isoformat() if isinstance(v, (date, datetime)) else v) for k, v in row.items()})
+        if buf.tell() >= 8192:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _rebuffer(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Agrupa en bloques de ~CHUNK_BYTES; el primer bloque sale de inmediato."""
+    first = True
+    pending: List[bytes] = []
+    size = 0
+    for c in chunks:
+        pending.append(c)
+        size += len(c)
+        if first or size >= CHUNK_BYTES:
+            yield b"".join(pending)
+            pending, size, first = [], 0, False
+    if pending:
+        yield b"".join(pending)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    comp = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits=31 -> formato gzip
+    for c in chunks:
+        out = comp.compress(c) + comp.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+def stream_rows(
+    request: Request,
+    rows: Iterable[Dict[str, Any]],
+    formato: str,
+    filename: str,
+    columns: Optional[List[str]] = None,
+) -> StreamingResponse:
+    """StreamingResponse NDJSON o CSV para `rows` (iterable perezoso), gzip si el cliente lo acepta."""
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}. Use ndjson o csv.")
+    if formato == "csv":
+        if not columns:
+            raise HTTPException(status_code=400, detail="Formato csv requiere columnas.")
+        body = _rebuffer(csv_lines(rows, columns))
+    else:
+        body = _rebuffer(ndjson_lines(rows))
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{formato}"'}
+    if "gzip" in request.headers.get("accept-encoding", "").lower():
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(body, media_type=FORMATOS[formato], headers=headers)
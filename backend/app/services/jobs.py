@@ -0,0 +1,452 @@
+"""
+Trabajos en segundo plano para operaciones administrativas largas (snapshots, cargas de
+nómina, sincronizaciones).
+
+Cada trabajo es una fila de BJobs (estado, progreso, resultado) y se ejecuta en un pool de
+hilos de este proceso (JOBS_WORKERS). El endpoint que lo dispara responde de inmediato con
+el id; el cliente consulta /admin/jobs/{id}. La cancelación es cooperativa: la tarea la
+revisa con ctx.verificar() entre pasos. Un trabajo en ERROR o CANCELADO se puede reintentar
+con los mismos parámetros.
+
+La API corre en varias instancias de Cloud Run: cada trabajo guarda la instancia dueña
+(INSTANCIA) y un latido que esa instancia renueva cada JOBS_HEARTBEAT_SECONDS. Solo se
+recuperan los trabajos cuyo latido venció (JOBS_STALE_SECONDS), es decir, cuya instancia
+murió: los EJECUTANDO pasan a ERROR para reintento manual y los PENDIENTE los adopta otra
+instancia. Las tareas registradas con `archivo_local` leen un archivo del disco de la
+instancia que lo recibió; esas no se adoptan (pasan a ERROR) y solo se reintentan donde
+el archivo existe. El archivo se borra al cancelar el trabajo; el de un trabajo en ERROR se
+conserva para reintentarlo hasta que el latido lo barre (JOBS_UPLOAD_TTL_SECONDS), igual que
+los que quedaron sin trabajo. En Cloud Run el directorio temporal ocupa memoria.
+"""
+import json
+import os
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine
+
+PENDIENTE = "PENDIENTE"
+EJECUTANDO = "EJECUTANDO"
+COMPLETADO = "COMPLETADO"
+ERROR = "ERROR"
+CANCELADO = "CANCELADO"
+
+# Intervalo mínimo entre escrituras de progreso en BJobs
+_PROGRESO_INTERVALO = 1.0
+
+# Identifica este proceso en BJobs.instancia
+INSTANCIA = f"{socket.gethostname()[:40]}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# tipo -> función(ctx, **parametros) -> dict (resultado)
+_tareas: Dict[str, Callable[..., Dict[str, Any]]] = {}
+# tipo -> parámetro con la ruta del archivo local que la tarea lee
+_archivo_local: Dict[str, str] = {}
+
+_cola: "queue.Queue[Optional[str]]" = queue.Queue()
+_cancelados = set()
+_lock = threading.Lock()
+_workers: List[threading.Thread] = []
+_stop_latido = threading.Event()
+_latido_thread: Optional[threading.Thread] = None
+
+
+class JobCancelado(Exception):
+    pass
+
+
+def registrar_tarea(tipo: str, archivo_local: Optional[str] = None):
+    """
+    Decorador: registra `fn(ctx, **parametros)` como el ejecutor de los trabajos `tipo`.
+    `archivo_local` nombra el parámetro con la ruta de un archivo de directorio_archivos():
+    el trabajo solo puede correr en la instancia que lo guardó.
+    """
+    def deco(fn):
+        _tareas[tipo] = fn
+        if archivo_local:
+            _archivo_local[tipo] = archivo_local
+        return fn
+    return deco
+
+
+def tipos_registrados() -> List[str]:
+    return sorted(_tareas)
+
+
+def _json_default(v: Any) -> Any:
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return str(v)
+
+
+def _dumps(v: Any) -> Optional[str]:
+    return None if v is None else json.dumps(v, default=_json_default, ensure_ascii=False)
+
+
+def directorio_archivos() -> str:
+    """Carpeta para archivos de entrada de los trabajos (p.ej. el CSV de una carga)."""
+    path = settings.JOBS_DIR or os.path.join(tempfile.gettempdir(), "guadua_jobs")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _archivo_de(job: Dict[str, Any]) -> Optional[str]:
+    param_archivo = _archivo_local.get(job["tipo"])
+    return (job.get("parametros") or {}).get(param_archivo) if param_archivo else None
+
+
+def _borrar_archivo(job: Dict[str, Any]) -> None:
+    """Borra el archivo local del trabajo, si la tarea usa uno y está en esta instancia."""
+    archivo = _archivo_de(job)
+    if archivo and os.path.exists(archivo):
+        try:
+            os.remove(archivo)
+        except OSError as e:
+            print(f"WARNING: no se pudo borrar {archivo}: {e}")
+
+
+class JobContext:
+    """Lo que ve una tarea en ejecución: reporte de progreso y chequeo de cancelación."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._ultimo = 0.0
+
+    def progreso(self, porcentaje: Optional[float] = None, mensaje: Optional[str] = None, forzar: bool = False) -> None:
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo < _PROGRESO_INTERVALO:
+            return
+        self._ultimo = ahora
+        _actualizar(self.job_id, progreso=None if porcentaje is None else round(min(max(porcentaje, 0), 100), 1),
+                    mensaje=mensaje)
+
+    def cancelado(self) -> bool:
+        with _lock:
+            return self.job_id in _cancelados
+
+    def verificar(self) -> None:
+        """Lanza JobCancelado si se pidió cancelar el trabajo."""
+        if self.cancelado():
+            raise JobCancelado("Cancelado por el usuario")
+
+
+# --- Persistencia ---
+
+def _actualizar(job_id: str, **campos) -> None:
+    campos = {k: v for k, v in campos.items() if v is not None}
+    if not campos:
+        return
+    sets = ", ".join(f"{k} = :{k}" for k in campos)
+    with engine.begin() as conn:
+        conn.execute(text(f"UPDATE BJobs SET {sets} WHERE id = :id"), {**campos, "id": job_id})
+
+
+def _fila(row) -> Dict[str, Any]:
+    d = dict(row)
+    for k in ("parametros", "resultado"):
+        if d.get(k):
+            try:
+                d[k] = json.loads(d[k])
+            except (TypeError, ValueError):
+                pass
+    return d
+
+
+def obtener_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT * FROM BJobs WHERE id = :id"), {"id": job_id}).mappings().first()
+    return _fila(row) if row else None
+
+
+def listar_jobs(tipo: Optional[str] = None, estado: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    where, params = [], {"lim": limit}
+    if tipo:
+        where.append("tipo = :tipo")
+        params["tipo"] = tipo
+    if estado:
+        where.append("estado = :estado")
+        params["estado"] = estado
+    sql = "SELECT * FROM BJobs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY fecha_creacion DESC LIMIT :lim"
+    with engine.connect() as conn:
+        return [_fila(r) for r in conn.execute(text(sql), params).mappings().all()]
+
+
+# --- API del subsistema ---
+
+def encolar(tipo: str, parametros: Optional[Dict[str, Any]] = None, creado_por: Optional[str] = None) -> str:
+    """Registra el trabajo en BJobs como PENDIENTE y lo pasa al pool. Retorna el id."""
+    if tipo not in _tareas:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    job_id = uuid.uuid4().hex
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO BJobs (id, tipo, estado, parametros, progreso, intentos, creado_por, fecha_creacion, instancia, latido)
+            VALUES (:id, :tipo, :estado, :parametros, 0, 1, :creado_por, NOW(), :inst, NOW())
+        """), {
+            "id": job_id, "tipo": tipo, "estado": PENDIENTE,
+            "parametros": _dumps(parametros or {}), "creado_por": creado_por, "inst": INSTANCIA,
+        })
+    _cola.put(job_id)
+    return job_id
+
+
+def cancelar(job_id: str) -> Dict[str, Any]:
+    """PENDIENTE pasa a CANCELADO de inmediato; EJECUTANDO se marca para que la tarea se detenga."""
+    job = obtener_job(job_id)
+    if not job:
+        raise KeyError(job_id)
+    if job["estado"] == PENDIENTE:
+        with engine.begin() as conn:
+            res = conn.execute(text("""
+                UPDATE BJobs SET estado = :c, mensaje = 'Cancelado antes de iniciar', fecha_fin = NOW()
+                WHERE id = :id AND estado = :p
+            """), {"c": CANCELADO, "p": PENDIENTE, "id": job_id})
+        if res.rowcount:
+            # Si el archivo está en otra instancia, lo barre el latido de esa instancia
+            _borrar_archivo(job)
+    elif job["estado"] == EJECUTANDO:
+        with _lock:
+            _cancelados.add(job_id)
+        # Si corre en otra instancia, esa lo ve en su próximo latido
+        _actualizar(job_id, mensaje="Cancelación solicitada", cancelar=1)
+    else:
+        raise ValueError(f"El trabajo ya terminó ({job['estado']})")
+    return obtener_job(job_id)
+
+
+def reintentar(job_id: str) -> Dict[str, Any]:
+    """
+    Vuelve a encolar un trabajo en ERROR o CANCELADO con los mismos parámetros, en esta
+    instancia. Las tareas con archivo local solo se reintentan donde el archivo existe (no
+    en las canceladas ni en las barridas por JOBS_UPLOAD_TTL_SECONDS).
+    """
+    job = obtener_job(job_id)
+    if not job:
+        raise KeyError(job_id)
+    if job["tipo"] in _archivo_local:
+        archivo = _archivo_de(job)
+        if not archivo or not os.path.exists(archivo):
+            raise ValueError("El archivo del trabajo ya no está en esta instancia; vuelva a cargarlo.")
+    with engine.begin() as conn:
+        res = conn.execute(text("""
+            UPDATE BJobs
+            SET estado = :p, progreso = 0, mensaje = NULL, error = NULL, resultado = NULL,
+                intentos = intentos + 1, fecha_inicio = NULL, fecha_fin = NULL,
+                instancia = :inst, latido = NOW(), cancelar = 0
+            WHERE id = :id AND estado IN (:e, :c)
+        """), {"p": PENDIENTE, "e": ERROR, "c": CANCELADO, "id": job_id, "inst": INSTANCIA})
+    if res.rowcount == 0:
+        job = obtener_job(job_id)
+        raise ValueError(f"Solo se reintentan trabajos en ERROR o CANCELADO (estado: {job['estado']})")
+    _cola.put(job_id)
+    return obtener_job(job_id)
+
+
+# --- Ejecución ---
+
+def _ejecutar(job_id: str) -> None:
+    # Tomar el trabajo (solo si sigue PENDIENTE: pudo cancelarse en la cola)
+    with engine.begin() as conn:
+        res = conn.execute(text("""
+            UPDATE BJobs SET estado = :e, fecha_inicio = NOW(), instancia = :inst, latido = NOW()
+            WHERE id = :id AND estado = :p
+        """), {"e": EJECUTANDO, "p": PENDIENTE, "id": job_id, "inst": INSTANCIA})
+    if res.rowcount == 0:
+        return
+    job = obtener_job(job_id)
+    ctx = JobContext(job_id)
+    try:
+        fn = _tareas.get(job["tipo"])
+        if fn is None:
+            raise ValueError(f"Tipo de trabajo desconocido: {job['tipo']}")
+        resultado = fn(ctx, **(job.get("parametros") or {}))
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE BJobs SET estado = :e, progreso = 100, resultado = :r, mensaje = :m, fecha_fin = NOW()
+                WHERE id = :id
+            """), {
+                "e": COMPLETADO, "id": job_id, "r": _dumps(resultado),
+                "m": (resultado or {}).get("mensaje") or (resultado or {}).get("message"),
+            })
+    except JobCancelado as e:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE BJobs SET estado = :e, mensaje = :m, fecha_fin = NOW() WHERE id = :id
+            """), {"e": CANCELADO, "m": str(e), "id": job_id})
+        _borrar_archivo(job)
+    except Exception as e:
+        print(f"Job {job_id} ({job['tipo']}) falló: {e}")
+        traceback.print_exc()
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE BJobs SET estado = :e, mensaje = :m, error = :err, fecha_fin = NOW() WHERE id = :id
+            """), {"e": ERROR, "m": str(e)[:500], "err": traceback.format_exc(), "id": job_id})
+    finally:
+        with _lock:
+            _cancelados.discard(job_id)
+
+
+def _worker() -> None:
+    while True:
+        job_id = _cola.get()
+        if job_id is None:
+            break
+        try:
+            _ejecutar(job_id)
+        except Exception as e:
+            # Error de BD al tomar o cerrar el trabajo: el pool sigue vivo
+            print(f"Error en worker de jobs ({job_id}): {e}")
+
+
+# Latido vencido: la instancia dueña dejó de renovarlo (murió o fue apagada)
+_VENCIDO = "(latido IS NULL OR latido < NOW() - INTERVAL :vence SECOND)"
+
+
+def _latir() -> None:
+    """
+    Renueva el latido de los trabajos de esta instancia (en cola o en ejecución) y recoge
+    las cancelaciones pedidas desde otras instancias.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE BJobs SET latido = NOW() WHERE instancia = :inst AND estado IN (:p, :x)
+        """), {"inst": INSTANCIA, "p": PENDIENTE, "x": EJECUTANDO})
+        cancelar = conn.execute(text("""
+            SELECT id FROM BJobs WHERE instancia = :inst AND estado = :x AND cancelar = 1
+        """), {"inst": INSTANCIA, "x": EJECUTANDO}).scalars().all()
+    if cancelar:
+        with _lock:
+            _cancelados.update(cancelar)
+
+
+def _recuperar() -> None:
+    """
+    Trabajos de instancias muertas: los EJECUTANDO pasan a ERROR; los PENDIENTE se adoptan y
+    se encolan aquí, salvo los que dependen de un archivo local de la otra instancia (ERROR).
+    """
+    vence = max(settings.JOBS_STALE_SECONDS, 2 * settings.JOBS_HEARTBEAT_SECONDS)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            UPDATE BJobs SET estado = :e, mensaje = 'Interrumpido: la instancia que lo ejecutaba se detuvo', fecha_fin = NOW()
+            WHERE estado = :x AND {_VENCIDO}
+        """), {"e": ERROR, "x": EJECUTANDO, "vence": vence})
+        huerfanos = conn.execute(text(f"""
+            SELECT id, tipo, parametros FROM BJobs WHERE estado = :p AND {_VENCIDO} ORDER BY fecha_creacion
+        """), {"p": PENDIENTE, "vence": vence}).mappings().all()
+    for job in map(_fila, huerfanos):
+        param_archivo = _archivo_local.get(job["tipo"])
+        local = bool(param_archivo) and not os.path.exists((job.get("parametros") or {}).get(param_archivo) or "")
+        with engine.begin() as conn:
+            if local:
+                conn.execute(text(f"""
+                    UPDATE BJobs SET estado = :e, fecha_fin = NOW(),
+                        mensaje = 'El archivo quedó en una instancia que se detuvo; vuelva a cargarlo'
+                    WHERE id = :id AND estado = :p AND {_VENCIDO}
+                """), {"e": ERROR, "p": PENDIENTE, "id": job["id"], "vence": vence})
+                continue
+            # Solo una instancia gana la adopción
+            res = conn.execute(text(f"""
+                UPDATE BJobs SET instancia = :inst, latido = NOW()
+                WHERE id = :id AND estado = :p AND {_VENCIDO}
+            """), {"inst": INSTANCIA, "p": PENDIENTE, "id": job["id"], "vence": vence})
+        if res.rowcount:
+            _cola.put(job["id"])
+
+
+def _barrer_archivos() -> None:
+    """
+    Borra de directorio_archivos() los archivos con más de JOBS_UPLOAD_TTL_SECONDS que ningún
+    trabajo PENDIENTE o EJECUTANDO usa: los de trabajos en ERROR que no se reintentaron y
+    los que quedaron sin trabajo (p.ej. si falló el encolado).
+    """
+    ttl = settings.JOBS_UPLOAD_TTL_SECONDS
+    if ttl <= 0:
+        return
+    limite = time.time() - ttl
+    viejos = []
+    with os.scandir(directorio_archivos()) as it:
+        for entrada in it:
+            try:
+                if entrada.is_file() and entrada.stat().st_mtime < limite:
+                    viejos.append(entrada.path)
+            except OSError:
+                continue
+    if not viejos:
+        return
+    with engine.connect() as conn:
+        activos = conn.execute(text("""
+            SELECT tipo, parametros FROM BJobs WHERE estado IN (:p, :x)
+        """), {"p": PENDIENTE, "x": EJECUTANDO}).mappings().all()
+    en_uso = {_archivo_de(_fila(r)) for r in activos}
+    for ruta in viejos:
+        if ruta not in en_uso:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+
+def _latido() -> None:
+    intervalo = max(5, settings.JOBS_HEARTBEAT_SECONDS)
+    while True:
+        try:
+            _latir()
+            _recuperar()
+        except Exception as e:
+            print(f"WARNING: latido/recuperación de BJobs falló: {e}")
+        try:
+            _barrer_archivos()
+        except Exception as e:
+            print(f"WARNING: barrido de archivos de trabajos falló: {e}")
+        if _stop_latido.wait(intervalo):
+            return
+
+
+def iniciar_jobs() -> None:
+    """Arranca el pool de workers (idempotente). Se llama desde el startup de la app."""
+    global _latido_thread
+    if any(t.is_alive() for t in _workers):
+        return
+    _workers.clear()
+    for i in range(max(1, settings.JOBS_WORKERS)):
+        t = threading.Thread(target=_worker, name=f"jobs-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
+    # El primer latido recupera lo que dejaron instancias muertas
+    _stop_latido.clear()
+    _latido_thread = threading.Thread(target=_latido, name="jobs-latido", daemon=True)
+    _latido_thread.start()
+
+
+def detener_jobs() -> None:
+    """
+    Detiene los workers al terminar el trabajo en curso. Lo pendiente queda en BJobs y, al
+    vencer su latido, lo adopta otra instancia.
+    """
+    _stop_latido.set()
+    for _ in _workers:
+        _cola.put(None)
+
+
+def guardar_archivo(origen, nombre: str) -> str:
+    """Copia un archivo subido (objeto binario) a directorio_archivos() para que el trabajo lo lea."""
+    destino = os.path.join(directorio_archivos(), f"{uuid.uuid4().hex}_{os.path.basename(nombre or 'archivo')}")
+    with open(destino, "wb") as out:
+        shutil.copyfileobj(origen, out, length=1024 * 1024)
+    return destino
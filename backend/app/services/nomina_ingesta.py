@@ -0,0 +1,183 @@
+"""
+Carga de nómina (CSV de Novasoft) en streaming.
+
+El archivo se lee por bloques de NOMINA_UPLOAD_CHUNK_BYTES, se decodifica de forma
+incremental y se parsea fila a fila; las filas se insertan en lotes de NOMINA_UPLOAD_BATCH
+(pymysql convierte el executemany de cada lote en un INSERT multi-fila). La memoria queda
+acotada a un bloque más un lote, sin importar el tamaño del archivo. Todo ocurre en una
+sola transacción: la limpieza del mes detectado y los lotes se confirman juntos.
+
+La carga corre como trabajo "nomina_upload" (app/services/jobs.py): el endpoint guarda el
+archivo y responde con el id; el avance (registros, % del archivo) queda en BJobs.
+"""
+import codecs
+import csv
+import datetime
+import os
+import time
+from itertools import chain
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.utils import normalizar_cedula, normalizar_proyecto
+from app.services.jobs import JobContext, registrar_tarea
+
+# Normalize headers: lowercase + map alternative names
+HEADER_MAP = {
+    'idproyecto': 'id_proyecto',
+    'idfuente': 'id_fuente',
+    'idcomponente': 'id_componente',
+    'idsubcomponente': 'id_subcomponente',
+    'idcategoria': 'id_categoria',
+    'idresponsable': 'id_responsable',
+}
+
+INSERT_SQL = """
+    INSERT INTO BNomina (cod_emp, cod_emp_norm, id_proyecto, proyecto_norm, id_fuente, id_componente, id_subcomponente, id_categoria, id_responsable, val_liq, fec_liq, nom_liq, fdec, rubro, fecha_carga)
+    VALUES (:cod_emp, :cod_emp_norm, :id_proyecto, :proyecto_norm, :id_fuente, :id_componente, :id_subcomponente, :id_categoria, :id_responsable, :val_liq, :fec_liq, :nom_liq, :fdec, :rubro, :fecha_carga)
+"""
+
+
+def normalize_row(raw_row: Dict[Optional[str], Any]) -> Dict[str, Any]:
+    """Normalize a CSV row: lowercase keys & map alternative header names."""
+    normalized = {}
+    for k, v in raw_row.items():
+        if k is None:
+            continue
+        key_lower = k.strip().lower()
+        mapped = HEADER_MAP.get(key_lower, key_lower)
+        normalized[mapped] = v.strip() if isinstance(v, str) else v
+    return normalized
+
+
+def _lineas(fh: BinaryIO, chunk_bytes: int, leidos: List[int]) -> Iterator[str]:
+    """Líneas del archivo (con su salto) decodificadas por bloques; `leidos[0]` acumula bytes."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    resto = ''
+    while True:
+        chunk = fh.read(chunk_bytes)
+        leidos[0] += len(chunk)
+        texto = resto + decoder.decode(chunk, final=not chunk)
+        partes = texto.split('\n')
+        resto = partes.pop()
+        for linea in partes:
+            yield linea + '\n'
+        if not chunk:
+            break
+    if resto:
+        yield resto
+
+
+def _detectar_delimitador(muestra: str) -> str:
+    """Auto-detect delimiter (comma, semicolon or tab)."""
+    try:
+        return csv.Sniffer().sniff(muestra, delimiters=',;\t').delimiter
+    except csv.Error:
+        # Fallback: count occurrences in first line
+        first_line = muestra.split('\n')[0]
+        return ';' if first_line.count(';') > first_line.count(',') else ','
+
+
+def _registro(row: Dict[str, Any], now: datetime.datetime) -> Dict[str, Any]:
+    try:
+        raw_val = row.get('val_liq', '0') or '0'
+        val = float(str(raw_val).replace(',', '.'))
+    except (TypeError, ValueError):
+        val = 0
+    return {
+        "cod_emp": row.get('cod_emp'),
+        "cod_emp_norm": normalizar_cedula(row.get('cod_emp')),
+        "id_proyecto": row.get('id_proyecto'),
+        "proyecto_norm": normalizar_proyecto(row.get('id_proyecto')),
+        "id_fuente": row.get('id_fuente'),
+        "id_componente": row.get('id_componente'),
+        "id_subcomponente": row.get('id_subcomponente'),
+        "id_categoria": row.get('id_categoria'),
+        "id_responsable": row.get('id_responsable'),
+        "val_liq": val,
+        "fec_liq": row.get('fec_liq'),
+        "nom_liq": row.get('nom_liq') or row.get('nom_con') or row.get('nom_emp'),
+        "fdec": row.get('fdec'),
+        "rubro": row.get('rubro'),
+        "fecha_carga": now,
+    }
+
+
+def ingerir_csv(fh: BinaryIO, bytes_total: Optional[int] = None, ctx: Optional[JobContext] = None) -> Dict[str, Any]:
+    """
+    Carga el CSV `fh` (binario) en BNomina. El periodo del primer registro se limpia antes de
+    insertar. Bloqueante. Con `ctx` reporta avance y atiende la cancelación entre lotes
+    (la transacción se revierte). Retorna {"ok", "message", "registros", "periodo", "segundos"}.
+    """
+    batch_size = max(1, settings.NOMINA_UPLOAD_BATCH)
+    leidos = [0]
+    inicio = time.monotonic()
+    lineas = _lineas(fh, max(4096, settings.NOMINA_UPLOAD_CHUNK_BYTES), leidos)
+
+    # Muestra para detectar el delimitador (~2000 caracteres), luego se re-encadena
+    muestra: List[str] = []
+    size = 0
+    for linea in lineas:
+        muestra.append(linea)
+        size += len(linea)
+        if size >= 2000:
+            break
+    reader = csv.DictReader(chain(muestra, lineas), delimiter=_detectar_delimitador(''.join(muestra)))
+
+    now = datetime.datetime.now()
+    filas = (normalize_row(r) for r in reader)
+    first = next(filas, None)
+    if first is None:
+        return {"ok": False, "message": "No hay datos para insertar", "registros": 0, "periodo": None}
+
+    # Detectar periodo del primer registro para limpieza automática
+    target_period = None
+    fec = first.get('fec_liq')
+    if fec:
+        target_period = datetime.datetime.strptime(fec, '%Y-%m-%d').strftime('%Y-%m')
+
+    total = 0
+    query = text(INSERT_SQL)
+    with engine.begin() as conn:
+        # LIMPIEZA AUTOMÁTICA
+        if target_period:
+            conn.execute(text("DELETE FROM BNomina WHERE periodo = :p"), {"p": target_period})
+
+        lote = []
+        for row in chain((first,), filas):
+            lote.append(_registro(row, now))
+            if len(lote) >= batch_size:
+                conn.execute(query, lote)
+                total += len(lote)
+                lote = []
+                if ctx:
+                    ctx.verificar()
+                    pct = leidos[0] / bytes_total * 100 if bytes_total else None
+                    ctx.progreso(pct, f"{total} registros ({target_period})")
+        if lote:
+            conn.execute(query, lote)
+            total += len(lote)
+
+    return {
+        "ok": True,
+        "message": f"Se cargaron {total} registros. (Limpieza previa de {target_period} realizada)",
+        "registros": total,
+        "periodo": target_period,
+        "segundos": round(time.monotonic() - inicio, 2),
+    }
+
+
+@registrar_tarea("nomina_upload", archivo_local="archivo")
+def tarea_upload_nomina(ctx: JobContext, archivo: str, nombre: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Trabajo de carga: lee el archivo guardado por el endpoint y lo borra si la carga termina bien.
+    Si se cancela, app.services.jobs lo borra; si falla, queda para reintentar hasta el barrido
+    de JOBS_UPLOAD_TTL_SECONDS.
+    """
+    with open(archivo, "rb") as fh:
+        res = ingerir_csv(fh, os.path.getsize(archivo), ctx)
+    os.remove(archivo)
+    return {**res, "archivo": nombre}
@@ -0,0 +1,180 @@
+"""
+Notificaciones en vivo (SSE) con pub/sub en proceso.
+
+Cada pestaña abierta mantiene un stream /employees/me/notifications/stream y queda suscrita
+por email con una cola acotada. Los endpoints que insertan en BNotificaciones publican el
+evento DESPUÉS del commit con publicar(); un stream abierto solo cuenta las no leídas al
+conectarse (y al reconectarse, cada NOTIFICACIONES_STREAM_MAX_SECONDS).
+
+El pub/sub es del proceso: en Cloud Run con varias instancias, un evento publicado en una
+instancia no llega a los streams abiertos en otra. Para cubrirlo, un único hilo por instancia
+lee cada NOTIFICACIONES_POLL_SECONDS las filas de BNotificaciones con id mayor al último visto
+(rango sobre la PK) y publica a sus suscriptores locales las que no publicó esta instancia. Sin
+streams abiertos no consulta. "Marcar todo como leído" en otra instancia se refleja al reconectar.
+"""
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import conexion
+
+# Eventos pendientes por suscriptor; si un cliente no consume, los más nuevos se descartan
+_COLA_MAX = 100
+
+_lock = threading.Lock()
+# email -> {(loop, cola)}
+_suscriptores: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, "asyncio.Queue[Dict[str, Any]]"]]] = {}
+# ids publicados por esta instancia (el sondeo no los repite); los más viejos se descartan
+_PUBLICADAS_MAX = 1000
+_publicadas: "OrderedDict[int, None]" = OrderedDict()
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _clave(email: Optional[str]) -> str:
+    return (email or "").strip().lower()
+
+
+def suscribir(email: str) -> "asyncio.Queue[Dict[str, Any]]":
+    """Registra una cola para el email. Llamar desde el event loop que la va a consumir."""
+    cola: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=_COLA_MAX)
+    with _lock:
+        _suscriptores.setdefault(_clave(email), set()).add((asyncio.get_running_loop(), cola))
+    return cola
+
+
+def desuscribir(email: str, cola: "asyncio.Queue[Dict[str, Any]]") -> None:
+    with _lock:
+        subs = _suscriptores.get(_clave(email))
+        if not subs:
+            return
+        for item in [s for s in subs if s[1] is cola]:
+            subs.discard(item)
+        if not subs:
+            _suscriptores.pop(_clave(email), None)
+
+
+def _entregar(cola: "asyncio.Queue[Dict[str, Any]]", evento: Dict[str, Any]) -> None:
+    try:
+        cola.put_nowait(evento)
+    except asyncio.QueueFull:
+        pass
+
+
+def publicar(email: str, evento: Dict[str, Any]) -> int:
+    """
+    Envía `evento` ({"tipo": ..., "data": {...}}) a todos los streams del email. Seguro desde
+    hilos (endpoints síncronos, trabajos). Retorna cuántos streams lo recibieron.
+    """
+    with _lock:
+        subs = list(_suscriptores.get(_clave(email), ()))
+        id_notif = evento.get("data", {}).get("id") if evento.get("tipo") == "notificacion" else None
+        if id_notif is not None:
+            _publicadas[id_notif] = None
+            while len(_publicadas) > _PUBLICADAS_MAX:
+                _publicadas.popitem(last=False)
+    entregados = 0
+    for loop, cola in subs:
+        try:
+            loop.call_soon_threadsafe(_entregar, cola, evento)
+            entregados += 1
+        except RuntimeError:
+            # Loop cerrado: el stream ya no existe
+            desuscribir(email, cola)
+    return entregados
+
+
+def suscriptores_activos() -> int:
+    with _lock:
+        return sum(len(s) for s in _suscriptores.values())
+
+
+# --- BNotificaciones ---
+
+def insertar_notificacion(conn, email: str, mensaje: str, solicitud_id: Optional[int], tipo: str) -> Dict[str, Any]:
+    """
+    Inserta la notificación en la transacción de `conn` y retorna el evento para publicar()
+    una vez confirmada.
+    """
+    res = conn.execute(text("""
+        INSERT INTO BNotificaciones (usuario_email, mensaje, solicitud_id, tipo)
+        VALUES (:email, :msg, :rid, :tipo)
+    """), {"email": email, "msg": mensaje, "rid": solicitud_id, "tipo": tipo})
+    return {
+        "tipo": "notificacion",
+        "data": {
+            "id": res.lastrowid, "mensaje": mensaje, "leido": 0, "tipo": tipo,
+            "solicitud_id": solicitud_id, "fecha_creacion": datetime.now().isoformat(),
+        },
+    }
+
+
+def contar_no_leidas(email: str) -> int:
+    with conexion() as conn:
+        return conn.execute(text(
+            "SELECT COUNT(*) FROM BNotificaciones WHERE usuario_email = :email AND leido = 0"
+        ), {"email": email}).scalar() or 0
+
+
+def _sondear(ultimo: Optional[int]) -> Optional[int]:
+    """Publica las notificaciones nuevas (id > ultimo) que esta instancia no publicó. Retorna el nuevo último id."""
+    with conexion() as conn:
+        if ultimo is None:
+            return conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM BNotificaciones")).scalar()
+        filas = conn.execute(text("""
+            SELECT id, usuario_email, mensaje, leido, tipo, solicitud_id, fecha_creacion
+            FROM BNotificaciones WHERE id > :ultimo ORDER BY id LIMIT 500
+        """), {"ultimo": ultimo}).mappings().all()
+    for f in filas:
+        ultimo = f["id"]
+        with _lock:
+            propia = f["id"] in _publicadas
+            suscrito = _clave(f["usuario_email"]) in _suscriptores
+        if propia or not suscrito:
+            continue
+        data = dict(f)
+        data.pop("usuario_email")
+        publicar(f["usuario_email"], {"tipo": "notificacion", "data": data})
+    return ultimo
+
+
+def _worker() -> None:
+    ultimo = None
+    while not _stop.wait(max(1, settings.NOTIFICACIONES_POLL_SECONDS)):
+        if not suscriptores_activos():
+            # Sin streams abiertos no hay a quién avisar; al volver se parte del máximo actual
+            ultimo = None
+            continue
+        try:
+            ultimo = _sondear(ultimo)
+        except Exception as e:
+            print(f"Warning: notification poll failed ({e})")
+
+
+def iniciar_notificaciones() -> None:
+    """Arranca el hilo de sondeo de la instancia (idempotente)."""
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_worker, name="notificaciones", daemon=True)
+    _thread.start()
+
+
+def detener_notificaciones() -> None:
+    _stop.set()
+
+
+def formato_sse(evento: Dict[str, Any]) -> str:
+    """Serializa un evento como mensaje SSE (event/data)."""
+    def _default(v):
+        return v.isoformat() if isinstance(v, (date, datetime)) else str(v)
+    data = json.dumps(evento.get("data", {}), default=_default, ensure_ascii=False)
+    return f"event: {evento['tipo']}\ndata: {data}\n\n"
@@ -0,0 +1,149 @@
+"""
+Reglas de nómina: una sola definición de cada concepto del mes (Base 30, mes completo).
+
+Cada regla es una expresión sobre arreglos NumPy y se evalúa en orden, de modo que una
+regla puede usar las anteriores. El mismo conjunto sirve vectorizado para lotes
+(mensualización, tramos de una cédula) y con arreglos de un elemento para un solo tramo
+(guardar_tramo, KPI de cabecera). El redondeo replica el cálculo histórico fila a fila:
+int(x) == np.trunc, techo a 1000 con +0.9999 y redondeo a 100 con +0.5.
+"""
+from types import SimpleNamespace
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+# Orden de los conceptos en la matriz columnar y en el dict "conceptos" de salida
+CONCEPTOS = (
+    "salario_mes", "aux_transporte", "dotacion", "primas", "prima_vacaciones",
+    "sueldo_vacaciones", "cesantias", "i_cesantias", "salud", "pension",
+    "arl", "ccf", "sena", "icbf",
+)
+
+# Posiciones sin aporte a pensión
+POSICIONES_SIN_PENSION = ("IHPO_119", "IHPO_6ac")
+
+_t = np.trunc
+
+def _r100(x):
+    return _t(x / 100.0 + 0.5) * 100.0
+
+def _salario_mes(c):
+    s = np.where(c.porc > 0, c.salario * c.porc / 100.0, c.salario)
+    return np.where(s > 0, _t(s / 1000.0 + 0.9999) * 1000.0, s)
+
+# (nombre, regla). Los nombres que no están en CONCEPTOS son bases intermedias.
+# Entradas: salario, porc, smlv, transporte, dotacion_anual, atep y las banderas
+# lectiva, b01 (salario integral), aprendiz y pension_exenta.
+REGLAS = (
+    # Salario con el incremento del año, techo a 1000
+    ("salario_mes", _salario_mes),
+    # Auxilio de transporte y dotación hasta 2 SMLV (no aplica a Lectiva)
+    ("tope_2smlv", lambda c: ~c.lectiva & (c.salario_mes <= 2 * c.smlv)),
+    ("aux_transporte", lambda c: np.where(c.tope_2smlv, c.transporte, 0.0)),
+    ("dotacion", lambda c: np.where(c.tope_2smlv, _t(c.dotacion_anual / 12.0 + 0.9999), 0.0)),
+    # Prestaciones (Lectiva y salario integral no causan primas ni cesantías)
+    ("sin_prestaciones", lambda c: c.lectiva | c.b01),
+    ("primas", lambda c: np.where(c.sin_prestaciones, 0.0, _t((c.salario_mes + c.aux_transporte) * 0.0834))),
+    ("prima_vacaciones", lambda c: np.where(c.lectiva, 0.0, _t(c.salario_mes * 0.0417))),
+    ("sueldo_vacaciones", lambda c: c.prima_vacaciones),
+    ("cesantias", lambda c: np.where(c.sin_prestaciones, 0.0, _t((c.salario_mes + c.aux_transporte) * 0.0834))),
+    ("i_cesantias", lambda c: np.where(c.sin_prestaciones, 0.0, _t((c.salario_mes + c.aux_transporte) * 0.01))),
+    # Seguridad social (B01: base integral del 70%); se descuenta el aporte del trabajador
+    ("base_integral", lambda c: np.where(c.b01, c.salario_mes * 0.7, c.salario_mes)),
+    ("salud", lambda c: np.where(
+        c.lectiva,
+        _r100(c.smlv * 0.125),
+        _r100(c.base_integral * 0.125) - _t(c.base_integral * 0.04),
+    )),
+    ("pension", lambda c: np.where(
+        c.lectiva | c.pension_exenta,
+        0.0,
+        _r100(c.base_integral * 0.16) - _t(c.base_integral * 0.04),
+    )),
+    # ARL y parafiscales (Lectiva y Aprendiz: exentos, ARL sobre el SMLV)
+    ("exento", lambda c: c.lectiva | c.aprendiz),
+    ("arl", lambda c: _r100(np.where(c.exento, c.smlv, c.base_integral) * c.atep)),
+    ("ccf", lambda c: np.where(c.exento, 0.0, _r100(c.base_integral * 0.04))),
+    ("sena", lambda c: np.where(c.exento, 0.0, _r100(c.base_integral * 0.02))),
+    ("icbf", lambda c: np.where(c.exento, 0.0, _r100(c.base_integral * 0.03))),
+)
+
+
+def parametros_incremento(inc: Optional[Mapping[str, Any]]) -> Tuple[float, float, float, float]:
+    """(porcentaje_aumento, smlv, transporte, dotacion) de una fila de BIncremento."""
+    if not inc:
+        return (0.0, 0.0, 0.0, 0.0)
+    return (
+        float(inc.get("porcentaje_aumento") or 0),
+        float(inc.get("smlv") or 0),
+        float(inc.get("transporte") or 0),
+        float(inc.get("dotacion") or 0),
+    )
+
+
+def banderas(row: Mapping[str, Any]) -> Tuple[bool, bool, bool, bool]:
+    """(lectiva, b01, aprendiz, pension_exenta) a partir de cargo, banda, familia y posicion_c."""
+    return (
+        row.get("cargo") == "Lectiva",
+        row.get("banda") == "B01",
+        row.get("familia") == "Aprendiz",
+        row.get("posicion_c") in POSICIONES_SIN_PENSION,
+    )
+
+
+def evaluar(salario, porc, smlv, transporte, dotacion_anual, atep,
+            lectiva, b01, aprendiz, pension_exenta) -> Dict[str, np.ndarray]:
+    """
+    Evalúa REGLAS sobre arreglos alineados (un elemento por tramo o por tramo x mes).
+    Retorna un arreglo por concepto más "total" (suma redondeada del mes completo).
+    """
+    c = SimpleNamespace(
+        salario=np.asarray(salario, dtype=np.float64),
+        porc=np.asarray(porc, dtype=np.float64),
+        smlv=np.asarray(smlv, dtype=np.float64),
+        transporte=np.asarray(transporte, dtype=np.float64),
+        dotacion_anual=np.asarray(dotacion_anual, dtype=np.float64),
+        atep=np.asarray(atep, dtype=np.float64),
+        lectiva=np.asarray(lectiva, dtype=bool),
+        b01=np.asarray(b01, dtype=bool),
+        aprendiz=np.asarray(aprendiz, dtype=bool),
+        pension_exenta=np.asarray(pension_exenta, dtype=bool),
+    )
+    for nombre, regla in REGLAS:
+        setattr(c, nombre, regla(c))
+
+    out = {k: getattr(c, k) for k in CONCEPTOS}
+    total = out[CONCEPTOS[0]]
+    for k in CONCEPTOS[1:]:
+        total = total + out[k]
+    out["total"] = np.rint(total)
+    return out
+
+
+def calcular_mes(salario_base: float, inc: Optional[Mapping[str, Any]], row: Mapping[str, Any]) -> Dict[str, float]:
+    """
+    Conceptos de un mes completo para un solo tramo o contrato.
+    `row` aporta cargo, banda, familia, posicion_c y atep; `inc` es la fila de BIncremento.
+    """
+    res = evaluar(
+        [float(salario_base or 0)], *([v] for v in parametros_incremento(inc)),
+        [float(row.get("atep") or 0)], *([b] for b in banderas(row)),
+    )
+    return {k: float(v[0]) for k, v in res.items()}
+
+
+def conceptos_tramos(tramos, incrementos: Mapping[int, Any]) -> Dict[str, np.ndarray]:
+    """
+    Conceptos del mes completo para cada tramo (vectorizado), con el incremento del año
+    de fecha_inicio. Un arreglo por concepto, alineado con `tramos`, más "total".
+    """
+    n = len(tramos)
+    params = np.array(
+        [parametros_incremento(incrementos.get(t["fecha_inicio"].year) if t.get("fecha_inicio") else None) for t in tramos],
+        dtype=np.float64,
+    ).reshape(n, 4)
+    flags = np.array([banderas(t) for t in tramos], dtype=bool).reshape(n, 4)
+    return evaluar(
+        [float(t.get("salario_base") or 0) for t in tramos], *params.T,
+        [float(t.get("atep") or 0) for t in tramos], *flags.T,
+    )
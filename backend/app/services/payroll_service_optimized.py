@@ -1,339 +1,440 @@
 import pandas as pd
 import numpy as np
 import calendar
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import date
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional
+from app.core.config import settings
 from app.core.utils import to_date, month_start, round_hundred
+from app.services.payroll_rules import CONCEPTOS, banderas, evaluar, parametros_incremento
 
-def mensualizar_base_30_optimized(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any]) -> List[Dict[str, Any]]:
-    if not tramos:
-        return []
-
-    # 1. Convert to DataFrame
+def _preparar_registros(tramos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Normaliza fechas y columnas numéricas de los tramos (una sola pasada de Pandas)."""
     df = pd.DataFrame(tramos)
-    
-    # 2. Preprocess dates
     df['fecha_inicio'] = pd.to_datetime(df['fecha_inicio']).dt.date
     df['fecha_fin'] = pd.to_datetime(df['fecha_fin']).dt.date
     df = df.dropna(subset=['fecha_inicio', 'fecha_fin'])
-    
+
     # Sanitize entire DataFrame to avoid NaN in metadata fields
     # This ensures JSON compliance for all attributes copied from row
     df = df.replace({np.nan: None})
-    
-    # 3. Expand rows per month (Using SQL-like Cross Join logic or simple iteration which is faster than logic iteration)
-    # Since Pandas expansion can be memory intensive, let's do a smart iterative expansion
-    
-    # Identify min/max year for increments
-    min_year = df['fecha_inicio'].apply(lambda x: x.year).min()
-    max_year = df['fecha_fin'].apply(lambda x: x.year).max()
-    
-    # Optimization: Filter increments relevant to data range
-    valid_years = range(min_year, max_year + 1)
-    
-    # Structure for results
-    results = []
-    
-    # To optimize this without excessive memory use for cross join:
-    # Iterate by Year-Month for the covered range?
-    # No, iterate rows and yield months is efficient in Python if logic is simple,
-    # BUT the "Base 30" logic is complex.
-    
-    # Let's vectorize the Base 30 Day Calculation.
-    # Function to calculate days in month with Base 30 rules
-    def get_base30_days(start_date, end_date, month_start_date):
-        month_end_date = (month_start_date + pd.DateOffset(months=1) - pd.DateOffset(days=1)).date()
-        
-        # Intersection
-        current_start = max(start_date, month_start_date)
-        current_end = min(end_date, month_end_date)
-        
-        if current_start > current_end:
-            return 0
-        
-        d_ini = 1
-        if (current_start.year == start_date.year and current_start.month == start_date.month):
-            d_ini = min(start_date.day, 30)
-            
-        d_fin = 30
-        if (current_end.year == end_date.year and current_end.month == end_date.month):
-            # Check natural last day
-            last_day_natural = month_end_date.day
-            if current_end.day == last_day_natural or current_end.day >= 30:
-                d_fin = 30
-            else:
-                d_fin = current_end.day
-                
-        days = d_fin - d_ini + 1
-        return max(0, days)
-
-    # However vectorizing 'get_base30_days' is tricky.
-    
-    # Let's use the pure Python loop but OPTIMIZE it by pre-calculating parameters per year 
-    # and removing repeated type conversions/dict lookups which are slow.
-    
-    # Prepare Increment Table as Lookup of Tuples
-    inc_lookup = {}
-    for y, inc in incrementos.items():
-        inc_lookup[y] = (
-            float(inc.get("porcentaje_aumento") or 0),
-            float(inc.get("smlv") or 0),
-            float(inc.get("transporte") or 0),
-            float(inc.get("dotacion") or 0)
-        )
-
-    # Accumulator
-    # Use a dictionary of lists for speed
-    acc_totals = {} # key: year-month, val: total
-    acc_details = {} # key: year-month, val: list
-    
-    # --- OPTIMIZATION START: Pre-sanitize Data ---
-    # Convert numeric columns to float32/64 once to avoid repeated casting
-    numeric_cols = ['salario_base', 'atep']
-    for col in numeric_cols:
+
+    for col in ['salario_base', 'atep']:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
-    
-    # Pre-fetch common params to local vars
-    # Use simple list of dicts for faster iteration than itertuples for massive loops if accessing many fields
-    records = df.to_dict('records')
-
-    # Prepare Increment Lookup (already done above)
-    min_inc_year = min(incrementos.keys()) if incrementos else 0
-    max_inc_year = max(incrementos.keys()) if incrementos else 0
-    
-    # Helper for rounding (inline to avoid function call overhead)
-    # Using simple rounding logic: int(x + 0.5) is faster than math.floor(x + 0.5)
-    
-    for row in records:
+
+    return df.to_dict('records')
+
+def _calcular_columnar(records: List[Dict[str, Any]], incrementos: Dict[int, Any]) -> Dict[str, Any]:
+    """
+    Motor vectorizado de mensualización Base 30.
+    Expande los tramos a un arreglo (tramo x mes), evalúa las reglas de payroll_rules
+    sobre todo el arreglo y prorratea cada concepto por los días Base 30 del mes.
+    """
+    inc_lookup = {y: parametros_incremento(inc) for y, inc in incrementos.items()}
+
+    # 1. Parámetros por tramo (una iteración por fila, no por mes)
+    rows, salario, atep = [], [], []
+    start_mi, end_mi, d_ini_first, d_fin_last = [], [], [], []
+    flags = []
+    for i, row in enumerate(records):
         try:
             ini: date = row['fecha_inicio']
             fin: date = row['fecha_fin']
-            
-            # Basic validation
             if ini > fin: continue
-            
-            # Extract basic fields
+
+            # Ensure base salary is available (Snapshots might use valor_mensual)
             salario_base = row.get('salario_base', 0.0)
-            atep_val = row.get('atep', 0.0)
-            
-            # String fields (defaults to empty if None)
-            cargo = row.get('cargo')
-            banda = row.get('banda')
-            familia = row.get('familia')
-            posicion = row.get('posicion_c')
-            
-            # Pre-calc flags
-            is_lectiva = (cargo == "Lectiva")
-            is_b01 = (banda == "B01")
-            is_aprendiz = (familia == "Aprendiz")
-            is_ihpo_pension_exempt = (posicion in ("IHPO_119", "IHPO_6ac"))
-            
-            # Loop control
-            curr_y = ini.year
-            curr_m = ini.month
-            
-            # Optimization: integer comparison is faster than date object comparison in tight loops
-            end_y = fin.year
-            end_m = fin.month
-            
-            while (curr_y < end_y) or (curr_y == end_y and curr_m <= end_m):
-                # Lookup increments
-                # Fast path: check range first
-                inc_vals = inc_lookup.get(curr_y, (0.0, 0.0, 0.0, 0.0))
-                porc, smlv, trans, dot_val = inc_vals
-                
-                # --- CALCULATION CORE ---
-                # Ensure base salary is available (Snapshots might use valor_mensual)
-                if not salario_base and row.get('valor_mensual'):
-                    salario_base = float(row.get('valor_mensual'))
-
-                # 1. Salario Calc
-                sal_calc = float(salario_base or 0.0)
-                if porc > 0:
-                    sal_calc = sal_calc * porc / 100.0
-                
-                # Ceiling 1000 logic
-                if sal_calc > 0:
-                    sal_calc = int(sal_calc / 1000.0 + 0.9999) * 1000.0
-                    
-                # 2. Aux Transporte
-                aux_t = trans if (sal_calc <= (2 * smlv) and not is_lectiva) else 0.0
-                    
-                # 3. Dotacion
-                dot = 0.0
-                if not is_lectiva and sal_calc <= (smlv * 2):
-                     dot = int(dot_val / 12.0 + 0.9999) # ceil
-                
-                # 4. Prestaciones (Original Formulas)
-                base_prest = sal_calc + aux_t
-                primas = int(base_prest * 0.0834) if not (is_lectiva or is_b01) else 0.0
-                cesan  = int(base_prest * 0.0834) if not (is_lectiva or is_b01) else 0.0
-                i_cesan = int(base_prest * 0.01) if not (is_lectiva or is_b01) else 0.0
-                
-                # Vacaciones (15 days each)
-                s_vac = int(sal_calc * 0.0417) if not is_lectiva else 0.0
-                p_vac = int(sal_calc * 0.0417) if not is_lectiva else 0.0
-                sueldo_vac = s_vac
-                
-                # Salud
-                salud = 0.0
-                if is_lectiva:
-                    salud = int(smlv * 0.125 / 100.0 + 0.5) * 100.0
-                elif is_b01:
-                    base_int = sal_calc * 0.7
-                    total_s = int(base_int * 0.125 / 100.0 + 0.5) * 100.0
-                    emp_s = int(base_int * 0.04)
-                    salud = total_s - emp_s
-                else:
-                    total_s = int(sal_calc * 0.125 / 100.0 + 0.5) * 100.0
-                    emp_s = int(sal_calc * 0.04)
-                    salud = total_s - emp_s
-
-                # Pension
-                pension = 0.0
-                if not (is_lectiva or is_ihpo_pension_exempt):
-                    base_p = sal_calc * 0.7 if is_b01 else sal_calc
-                    total_p = int(base_p * 0.16 / 100.0 + 0.5) * 100.0
-                    emp_p = int(base_p * 0.04)
-                    pension = total_p - emp_p
-                    
-                # Parafiscales
-                base_para = sal_calc * 0.7 if is_b01 else sal_calc
-                ccf  = 0.0 if (is_lectiva or is_aprendiz) else int(base_para * 0.04 / 100.0 + 0.5) * 100.0
-                sena = 0.0 if (is_lectiva or is_aprendiz) else int(base_para * 0.02 / 100.0 + 0.5) * 100.0
-                icbf = 0.0 if (is_lectiva or is_aprendiz) else int(base_para * 0.03 / 100.0 + 0.5) * 100.0
-                
-                # ARL
-                base_arl = smlv if (is_aprendiz or is_lectiva) else (sal_calc * 0.7 if is_b01 else sal_calc)
-                arl = int(base_arl * atep_val / 100.0 + 0.5) * 100.0
-                
-                total_mensual = int(round(sal_calc + aux_t + dot + primas + s_vac + p_vac + cesan + i_cesan + salud + pension + arl + ccf + sena + icbf))
-                
-                # --- Base 30 Logic (Unified for February) ---
-                d_ini = 1
-                if curr_y == ini.year and curr_m == ini.month:
-                    d_ini = min(ini.day, 30)
-                
-                d_fin = 30
-                if curr_y == end_y and curr_m == end_m:
-                    # If day >= 30, it is 30. If it is Feb 28/29 (last day), it is 30.
-                    fin_d = fin.day
-                    if fin_d >= 30:
-                        d_fin = 30
-                    else:
-                        _, last_day_nat = calendar.monthrange(curr_y, curr_m)
-                        if fin_d == last_day_nat:
-                            d_fin = 30
-                        else:
-                            d_fin = fin_d
-                elif curr_m == 2:
-                    # Not the end month, but it is February. Covers whole month.
-                    d_fin = 30
-
-                dias = max(0, d_fin - d_ini + 1)
-                
-                # If 0 days -> 0 value, otherwise calc ratio
-                if dias > 0:
-                    ratio = dias / 30.0
-                    valor_mes = round(total_mensual * ratio)
-                    
-                    # Store
-                    # key = f"{curr_y}-{curr_m:02d}-01"
-                    # Fast string formatting
-                    key = "%04d-%02d-01" % (curr_y, curr_m)
-                    
-                    if key not in acc_totals:
-                        acc_totals[key] = 0.0
-                        acc_details[key] = []
-                    
-                    acc_totals[key] += valor_mes
-                    
-                    # Detail Item
-                    det_item = {
-                        "id": row.get('id_financiacion'),
-                        "cedula": row.get('cedula'),
-                        "nombre": row.get('nombre') or row.get('nombre_completo'),
-                        # Critical Fix: Return start/end dates for frontend validation (e.g. financed today check)
-                        "fecha_inicio": ini.isoformat(), 
-                        "fecha_fin": fin.isoformat(),
-                        
-                        "id_proyecto": row.get('id_proyecto'),
-                        "proyecto": row.get('proyecto') or row.get('id_proyecto'),
-                        "rubro": row.get('rubro'),
-                        "fuente": row.get('id_fuente'),
-                        "componente": row.get('id_componente'),
-                        "subcomponente": row.get('id_subcomponente'),
-                        "categoria": row.get('id_categoria'),
-                        "responsable": row.get('id_responsable'),
-                        "fecha_ingreso": row.get('fecha_ingreso'),
-                        
-                        # Add missing 'contrato' field for downstream reports
-                        # Add missing 'contrato' field for downstream reports
-                        "contrato": row.get('id_contrato'),
-                        "Planta": row.get('Planta'),
-                        "Base_Fuente": row.get('Base_Fuente'),
-                        "Tipo_planta": row.get('Tipo_planta'),
-                        "Direccion": row.get('Direccion'),
-                        "Estado": row.get('estado'),
-                        
-                        "valor": valor_mes,
-                        "dias": dias,
-                        "conceptos": {
-                            "salario_mes": int(sal_calc * ratio + 0.5),
-                            "aux_transporte": int(aux_t * ratio + 0.5),
-                            "dotacion": int(dot * ratio + 0.5),
-                            "primas": int(primas * ratio + 0.5),
-                            "prima_vacaciones": int(p_vac * ratio + 0.5),
-                            "sueldo_vacaciones": int(sueldo_vac * ratio + 0.5),
-                            "cesantias": int(cesan * ratio + 0.5),
-                            "i_cesantias": int(i_cesan * ratio + 0.5),
-                            "salud": int(salud * ratio + 0.5),
-                            "pension": int(pension * ratio + 0.5),
-                            "arl": int(arl * ratio + 0.5), # Already rounded 100 in base? No, ratio can break it. Keeping simple round.
-                            "ccf": int(ccf * ratio + 0.5),
-                            "sena": int(sena * ratio + 0.5),
-                            "icbf": int(icbf * ratio + 0.5)
-                        }
-                    }
-                    
-                    # Optional fields
-                    if 'Direccion' in row: det_item['Direccion'] = row['Direccion']
-                    if 'gerencia' in row: det_item['gerencia'] = row['gerencia']
-                    if 'fecha_terminacion' in row: det_item['fecha_terminacion'] = row['fecha_terminacion']
-                    if 'cargo' in row: det_item['cargo'] = row['cargo']
-                    if 'posicion_c' in row: det_item['posicion_c'] = row['posicion_c']
-
-                    acc_details[key].append(det_item)
-
-                # Advance month
-                curr_m += 1
-                if curr_m > 12:
-                    curr_m = 1
-                    curr_y += 1
-
-        except Exception as e:
+            if not salario_base and row.get('valor_mensual'):
+                salario_base = float(row.get('valor_mensual'))
+            sal = float(salario_base or 0.0)
+            atep_val = float(row.get('atep', 0.0))
+
+            # Base 30: el último día natural del mes (ej. 28/29 de febrero) cuenta como día 30
+            fin_d = fin.day
+            if fin_d < 30 and fin_d != calendar.monthrange(fin.year, fin.month)[1]:
+                dfin = fin_d
+            else:
+                dfin = 30
+        except Exception:
             # Skip malformed rows without crashing entire calc
             continue
-    # Format Output
-    output = []
-    for key in sorted(acc_totals.keys()):
-        output.append({
-            "anioMes": key,
-            "total": acc_totals[key],
-            "detalle": acc_details[key]
-        })
-        
-    return output
-
-def calculate_yearly_projections(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any], year: int):
+
+        rows.append(i)
+        salario.append(sal)
+        atep.append(atep_val)
+        start_mi.append(ini.year * 12 + ini.month - 1)
+        end_mi.append(fin.year * 12 + fin.month - 1)
+        d_ini_first.append(min(ini.day, 30))
+        d_fin_last.append(dfin)
+        flags.append(banderas(row))
+
+    rows = np.asarray(rows, dtype=np.int64)
+    start_mi = np.asarray(start_mi, dtype=np.int64)
+    end_mi = np.asarray(end_mi, dtype=np.int64)
+
+    # 2. Expansión (tramo x mes)
+    counts = end_mi - start_mi + 1
+    total = int(counts.sum()) if len(counts) else 0
+    idx = np.repeat(np.arange(len(rows)), counts)
+    first_pos = np.repeat(np.cumsum(counts) - counts, counts)
+    mi = start_mi[idx] + (np.arange(total) - first_pos)
+
+    # Incrementos por año (lookup sobre los años únicos presentes)
+    years, year_inv = np.unique(mi // 12, return_inverse=True)
+    inc_table = np.array([inc_lookup.get(int(y), (0.0, 0.0, 0.0, 0.0)) for y in years], dtype=np.float64).reshape(-1, 4)
+    porc, smlv, trans, dot_val = (inc_table[year_inv, k] for k in range(4))
+
+    flags = np.asarray(flags, dtype=bool).reshape(-1, 4)[idx]
+    res = evaluar(
+        np.asarray(salario, dtype=np.float64)[idx], porc, smlv, trans, dot_val,
+        np.asarray(atep, dtype=np.float64)[idx], *flags.T
+    )
+    trunc = np.trunc
+
+    # --- Base 30 Logic (Unified for February) ---
+    d_ini = np.where(mi == start_mi[idx], np.asarray(d_ini_first, dtype=np.int64)[idx], 1)
+    d_fin = np.where(mi == end_mi[idx], np.asarray(d_fin_last, dtype=np.int64)[idx], 30)
+    dias = np.maximum(0, d_fin - d_ini + 1)
+
+    keep = dias > 0
+    ratio = dias[keep] / 30.0
+    conceptos = np.stack([
+        trunc(c[keep] * ratio + 0.5)
+        for c in (res[k] for k in CONCEPTOS)
+    ]).astype(np.int64)
+
+    # Orden de salida: por mes y, dentro del mes, en el orden original de los tramos
+    mi = mi[keep]
+    order = np.argsort(mi, kind="stable")
+    return {
+        "records": records,
+        "row": rows[idx[keep]][order],
+        "mi": mi[order],
+        "dias": dias[keep][order],
+        "valor": np.rint(res["total"][keep] * ratio).astype(np.int64)[order],
+        "conceptos": conceptos[:, order],
+    }
+
+def _mes_key(mi: int) -> str:
+    return "%04d-%02d-01" % (mi // 12, mi % 12 + 1)
+
+def _materializar(cols: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Construye la salida [{anioMes, total, detalle}] a partir del resultado columnar."""
+    return list(_iter_materializar(cols))
+
+def _iter_materializar(cols: Dict[str, Any], mi_desde: Optional[int] = None, mi_hasta: Optional[int] = None) -> Iterator[Dict[str, Any]]:
     """
-    Single Source of Truth for Yearly Financial Aggregation.
-    Calculates total investment, headcount, and project breakdown for a specific year.
+    Versión generadora de _materializar: construye un mes a la vez, opcionalmente
+    solo los meses mi_desde..mi_hasta (índices año*12 + mes-1, inclusivos).
+    """
+    records = cols["records"]
+    mi = cols["mi"]
+    if mi_desde is not None or mi_hasta is not None:
+        lo = np.searchsorted(mi, mi_desde, side="left") if mi_desde is not None else 0
+        hi = np.searchsorted(mi, mi_hasta, side="right") if mi_hasta is not None else len(mi)
+        cols = {k: (v[..., lo:hi] if isinstance(v, np.ndarray) else v) for k, v in cols.items()}
+        mi = cols["mi"]
+    if not len(mi):
+        return
+
+    # Metadata por tramo (se construye una sola vez y se copia por mes)
+    heads, tails = {}, {}
+    for r in np.unique(cols["row"]).tolist():
+        row = records[r]
+        heads[r] = {
+            "id": row.get('id_financiacion'),
+            "cedula": row.get('cedula'),
+            "nombre": row.get('nombre') or row.get('nombre_completo'),
+            # Critical Fix: Return start/end dates for frontend validation (e.g. financed today check)
+            "fecha_inicio": row['fecha_inicio'].isoformat(),
+            "fecha_fin": row['fecha_fin'].isoformat(),
+
+            "id_proyecto": row.get('id_proyecto'),
+            "proyecto": row.get('proyecto') or row.get('id_proyecto'),
+            "rubro": row.get('rubro'),
+            "fuente": row.get('id_fuente'),
+            "componente": row.get('id_componente'),
+            "subcomponente": row.get('id_subcomponente'),
+            "categoria": row.get('id_categoria'),
+            "responsable": row.get('id_responsable'),
+            "fecha_ingreso": row.get('fecha_ingreso'),
+
+            # Add missing 'contrato' field for downstream reports
+            "contrato": row.get('id_contrato'),
+            "Planta": row.get('Planta'),
+            "Base_Fuente": row.get('Base_Fuente'),
+            "Tipo_planta": row.get('Tipo_planta'),
+            "Direccion": row.get('Direccion'),
+            "Estado": row.get('estado'),
+        }
+        # Optional fields
+        tails[r] = {k: row[k] for k in ('Direccion', 'gerencia', 'fecha_terminacion', 'cargo', 'posicion_c') if k in row}
+
+    row_l = cols["row"].tolist()
+    valor_l = cols["valor"].tolist()
+    dias_l = cols["dias"].tolist()
+    conc_l = cols["conceptos"].T.tolist()
+
+    bounds = np.flatnonzero(np.diff(mi)) + 1
+    starts = [0] + bounds.tolist()
+    ends = bounds.tolist() + [len(mi)]
+    for a, b in zip(starts, ends):
+        detalle = []
+        for j in range(a, b):
+            r = row_l[j]
+            det_item = dict(heads[r])
+            det_item["valor"] = valor_l[j]
+            det_item["dias"] = dias_l[j]
+            det_item["conceptos"] = dict(zip(CONCEPTOS, conc_l[j]))
+            det_item.update(tails[r])
+            detalle.append(det_item)
+        yield {
+            "anioMes": _mes_key(int(mi[a])),
+            "total": float(sum(valor_l[a:b])),
+            "detalle": detalle
+        }
+
+def mensualizar_base_30_optimized(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any]) -> List[Dict[str, Any]]:
+    if not tramos:
+        return []
+    records = _preparar_registros(tramos)
+    return _materializar(_calcular_columnar(records, incrementos))
+
+def iter_mensualizado(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any], desde: Optional[date] = None, hasta: Optional[date] = None) -> Iterator[Dict[str, Any]]:
     """
-    prefix = f"{year}-"
-    
-    # Pre-process tramos for common rules
+    Igual que mensualizar_base_30_optimized pero entrega un mes a la vez ({anioMes, total, detalle}),
+    limitado a los meses entre desde y hasta (inclusive). Solo un mes de detalle vive en memoria;
+    lo usan las exportaciones en streaming.
+    """
+    if not tramos:
+        return iter(())
+    cols = _calcular_columnar(_preparar_registros(tramos), incrementos)
+    mi_desde = desde.year * 12 + desde.month - 1 if desde else None
+    mi_hasta = hasta.year * 12 + hasta.month - 1 if hasta else None
+    return _iter_materializar(cols, mi_desde, mi_hasta)
+
+# --- Modo multiproceso (reportes de tabla completa) ---
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+def _cpus_efectivas() -> int:
+    """
+    CPUs que el proceso puede usar de verdad: afinidad del proceso acotada por la cuota
+    de cgroup (cpu.max en v2, cfs_quota_us/cfs_period_us en v1). os.cpu_count() reporta
+    los núcleos del host, no los del contenedor (Cloud Run con --cpu 1).
+    """
+    try:
+        n = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        n = os.cpu_count() or 1
+    for archivos in (("/sys/fs/cgroup/cpu.max",), ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")):
+        try:
+            valores = []
+            for ruta in archivos:
+                with open(ruta) as fh:
+                    valores.extend(fh.read().split())
+            cuota, periodo = valores[0], valores[1]
+            if cuota not in ("max", "-1"):
+                n = min(n, max(1, int(cuota) // int(periodo)))
+            break
+        except (OSError, ValueError, IndexError):
+            continue
+    return n
+
+def _process_workers() -> int:
+    return settings.PAYROLL_PROCESS_WORKERS or _cpus_efectivas()
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: los workers no heredan hilos, locks ni conexiones del proceso del API
+            _process_pool = ProcessPoolExecutor(max_workers=_process_workers(), mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+def _mensualizar_shard(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any]) -> Dict[str, np.ndarray]:
+    """
+    Ejecutado en un worker: mensualiza un shard y retorna solo los arreglos columnares.
+    El índice de fila local se reemplaza por la posición original del tramo ("pos"); el
+    detalle se materializa una sola vez en el proceso padre.
+    """
+    records = _preparar_registros(tramos)
+    cols = _calcular_columnar(records, incrementos)
+    pos = np.asarray([r["_pos"] for r in records], dtype=np.int64)
+    return {
+        "pos": pos[cols["row"]],
+        "mi": cols["mi"],
+        "dias": cols["dias"],
+        "valor": cols["valor"],
+        "conceptos": cols["conceptos"],
+    }
+
+def mensualizar_base_30_parallel(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Igual que mensualizar_base_30_optimized, repartiendo los tramos por cédula entre procesos.
+    Los workers devuelven arreglos columnares; el padre los une ordenando por (mes, posición
+    original del tramo) y materializa el detalle una sola vez. Entradas pequeñas
+    (< PAYROLL_PARALLEL_MIN_TRAMOS) o un solo worker se calculan en el mismo proceso.
+    """
+    n = workers or _process_workers()
+    if n <= 1 or len(tramos) < settings.PAYROLL_PARALLEL_MIN_TRAMOS:
+        return mensualizar_base_30_optimized(tramos, incrementos)
+
+    marcados = [{**t, "_pos": pos} for pos, t in enumerate(tramos)]
+    shards: List[List[Dict[str, Any]]] = [[] for _ in range(n)]
+    for t in marcados:
+        shard = zlib.crc32(str(t.get("cedula") or "").strip().encode("utf-8")) % n
+        shards[shard].append(t)
+    # MappingProxyType (caché de referencia) no es serializable
+    inc_plain = {y: dict(inc) for y, inc in incrementos.items()}
+
+    try:
+        pool = _get_process_pool()
+        futures = [pool.submit(_mensualizar_shard, s, inc_plain) for s in shards if s]
+        partes = [fut.result() for fut in futures]
+    except BrokenProcessPool as e:
+        print(f"Warning: payroll process pool failed ({e}); computing in-process")
+        shutdown_process_pool()
+        return mensualizar_base_30_optimized(tramos, incrementos)
+
+    # Metadata de los tramos (misma normalización que en los workers) y posición -> fila
+    records = _preparar_registros(marcados)
+    fila = np.full(len(tramos), -1, dtype=np.int64)
+    fila[[r["_pos"] for r in records]] = np.arange(len(records), dtype=np.int64)
+
+    pos = np.concatenate([p["pos"] for p in partes])
+    mi = np.concatenate([p["mi"] for p in partes])
+    order = np.lexsort((pos, mi))
+    return _materializar({
+        "records": records,
+        "row": fila[pos][order],
+        "mi": mi[order],
+        "dias": np.concatenate([p["dias"] for p in partes])[order],
+        "valor": np.concatenate([p["valor"] for p in partes])[order],
+        "conceptos": np.concatenate([p["conceptos"] for p in partes], axis=1)[:, order],
+    })
+
+def _agregar_anio(cols: Dict[str, Any], year: int) -> Dict[str, Any]:
+    """
+    Agrega el resultado columnar de un año sin construir el detalle mensual.
+    Los montos se suman con np.bincount (enteros exactos en float64) y los conjuntos
+    de cédulas se arman por tramo, no por tramo-mes.
+    """
+    records = cols["records"]
+    sel = (cols["mi"] // 12) == year
+    row = cols["row"][sel]
+    m_idx = cols["mi"][sel] % 12
+    valor = cols["valor"][sel].astype(np.float64)
+
+    # Tramos en orden de primera aparición (mes, orden original) para conservar el orden de las llaves
+    urows, first = np.unique(row, return_index=True)
+    urows = urows[np.argsort(first, kind="stable")].tolist()
+
+    proj_data = {} # pid -> {label, total, months:[12]}
+    proj_heads = {} # pid -> set(cedulas)
+    all_heads = set()
+    dir_heads = {} # direccion -> set(cedulas)
+    planta_heads = {} # planta -> set(cedulas)
+    proj_pos, dir_pos = {}, {}
+    row_proj = np.zeros(len(records), dtype=np.int64)
+    row_dir = np.zeros(len(records), dtype=np.int64)
+    sin_finan_rows = set()
+
+    for r in urows:
+        rec = records[r]
+        pid = rec.get('id_proyecto') or "SIN_PROYECTO"
+        ced = rec.get('cedula')
+
+        # 1. Project Matrix (Project ID only to avoid duplicate rows/data loss)
+        if pid not in proj_data:
+            nombre = rec.get('proyecto') or rec.get('id_proyecto') or pid
+            proj_data[pid] = {
+                "id_proyecto": pid,
+                "codigo": pid,
+                "proyecto": nombre,
+                "label": f"{pid} - {nombre}",
+                "total": 0.0,
+                "months": [0.0]*12,
+            }
+            proj_heads[pid] = set()
+            proj_pos[pid] = len(proj_pos)
+        row_proj[r] = proj_pos[pid]
+        proj_heads[pid].add(ced)
+
+        # 2. Global KPIs
+        all_heads.add(ced)
+
+        # 3. Direction Cost
+        d_name = rec.get("Direccion") or "Sin definir"
+        if d_name not in dir_heads:
+            dir_heads[d_name] = set()
+            dir_pos[d_name] = len(dir_pos)
+        row_dir[r] = dir_pos[d_name]
+        dir_heads[d_name].add(ced)
+
+        # 4. Planta Coverage (Financed Today - Simplified as Any Financing in Year)
+        p_name = rec.get("Base_Fuente") or "Proyectos" # SWAPPED for Base_Fuente
+        if p_name not in planta_heads: planta_heads[p_name] = set()
+        planta_heads[p_name].add(ced)
+
+        if rec.get('id_proyecto') in ("A01", "A02"):
+            sin_finan_rows.add(r)
+
+    # Montos por proyecto x mes y por dirección en una sola pasada vectorizada
+    n_proj = len(proj_data)
+    months = np.bincount(row_proj[row] * 12 + m_idx, weights=valor, minlength=n_proj * 12).reshape(n_proj, 12)
+    for i, info in enumerate(proj_data.values()):
+        info["months"] = months[i].tolist()
+        info["total"] = float(months[i].sum())
+        info["headcount"] = len(proj_heads[info["codigo"]])
+    costo_dir = np.bincount(row_dir[row], weights=valor, minlength=len(dir_heads)).tolist()
+
+    # 5. Trabajadores Sin Financiación (A01/A02) por Planta y mes
+    sin_finan_matrix = {} # planta -> [12 months heads: set()]
+    sin_finan_cost_matrix = {} # planta -> [12 months cost: float]
+    if sin_finan_rows:
+        row_l, m_l, val_l = row.tolist(), m_idx.tolist(), valor.tolist()
+        for j, r in enumerate(row_l):
+            if r not in sin_finan_rows: continue
+            planta = records[r].get("Planta") or "Sin Definir"
+            if planta not in sin_finan_matrix:
+                sin_finan_matrix[planta] = [set() for _ in range(12)]
+                sin_finan_cost_matrix[planta] = [0.0 for _ in range(12)]
+            sin_finan_matrix[planta][m_l[j]].add(records[r].get('cedula'))
+            sin_finan_cost_matrix[planta][m_l[j]] += val_l[j]
+
+    return {
+        "total": float(valor.sum()),
+        "headcount": len(all_heads),
+        "dist_dir_costo": dict(zip(dir_heads, costo_dir)),
+        "dist_planta_fin": {k: len(v) for k, v in planta_heads.items()},
+        "dist_direccion_fin": {k: len(v) for k, v in dir_heads.items()},
+        "matrix_proyectos": list(proj_data.values()),
+        "matrix_sin_finan": [
+            {"label": p, "months": [len(s) for s in sets], "total": len(set().union(*sets))}
+            for p, sets in sin_finan_matrix.items()
+        ],
+        "matrix_costo_sin_finan": [
+            {"label": p, "months": costs, "total": sum(costs)}
+            for p, costs in sin_finan_cost_matrix.items()
+        ],
+    }
+
+def _preprocesar_tramos(tramos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reglas comunes previas a la proyección anual (salario_base y fecha de retiro)."""
     processed_tramos = []
     for r in tramos:
         d = dict(r)
@@ -349,80 +450,56 @@ def calculate_yearly_projections(tramos: List[Dict[str, Any]], incrementos: Dict
             if fin_orig and fin_orig > term_real:
                 d["fecha_fin"] = term_real
         processed_tramos.append(d)
+    return processed_tramos
 
-    mensualizado = mensualizar_base_30_optimized(processed_tramos, incrementos)
-    
-    proj_data = {} # pid -> {label, total, heads: set()}
-    total_year = 0.0
-    all_heads = set()
-    
-    proj_data = {} # (pid, comp) -> {label, total, months:[12], heads: set()}
-    total_year = 0.0
-    all_heads = set()
-    all_heads = set()
-    dist_dir_costo = {}
-    dist_planta_fin = {} # planta -> set(cedulas)
-    dist_direccion_fin = {} # direccion -> set(cedulas)
-    
-    prefix = f"{year}-"
-    
-    for m_group in mensualizado:
-        if not m_group["anioMes"].startswith(prefix): continue
-        m_idx = int(m_group["anioMes"].split("-")[1]) - 1
-        
-        for d in m_group["detalle"]:
-            pid = d["id_proyecto"] or "SIN_PROYECTO"
-            val = d["valor"]
-            ced = d["cedula"]
-            
-            # 1. Project Matrix (Project ID only to avoid duplicate rows/data loss)
-            key = pid
-            if key not in proj_data:
-                proj_data[key] = {
-                    "id_proyecto": pid,
-                    "codigo": pid,
-                    "proyecto": d.get("proyecto") or pid,
-                    "label": f"{pid} - {d.get('proyecto') or pid}",
-                    "total": 0.0,
-                    "months": [0.0]*12,
-                    "heads": set()
-                }
-            proj_data[key]["total"] += val
-            proj_data[key]["months"][m_idx] += val
-            proj_data[key]["heads"].add(ced)
-            
-            # 2. Global KPIs
-            total_year += val
-            all_heads.add(ced)
-            
-            # 3. Direction Cost
-            d_name = d.get("Direccion") or "Sin definir"
-            dist_dir_costo[d_name] = dist_dir_costo.get(d_name, 0.0) + val
-            if d_name not in dist_direccion_fin: dist_direccion_fin[d_name] = set()
-            dist_direccion_fin[d_name].add(ced)
-            
-            # 4. Planta Coverage (Financed Today - Simplified as Any Financing in Year)
-            p_name = d.get("Base_Fuente") or "Proyectos" # SWAPPED for Base_Fuente
-            if p_name not in dist_planta_fin: dist_planta_fin[p_name] = set()
-            dist_planta_fin[p_name].add(ced)
-            
-    # Format Project Matrix for frontend
-    matrix_proyectos = []
-    for info in proj_data.values():
-        info["headcount"] = len(info["heads"])
-        del info["heads"] # remove set for JSON serialization
-        matrix_proyectos.append(info)
-        
-    return {
+def contribuciones_anuales(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any], year: int) -> List[Dict[str, Any]]:
+    """
+    Aporte de cada tramo a los 12 meses del año, con las mismas reglas de calculate_yearly_projections.
+    Retorna solo los tramos con días en el año: {"registro", "months": [12 valores], "activos": [meses con días]}.
+    """
+    processed_tramos = _preprocesar_tramos(tramos)
+    records = _preparar_registros(processed_tramos) if processed_tramos else []
+    cols = _calcular_columnar(records, incrementos)
+    sel = (cols["mi"] // 12) == year
+    row = cols["row"][sel]
+    m_idx = cols["mi"][sel] % 12
+
+    months = np.zeros((len(records), 12), dtype=np.float64)
+    activos = np.zeros((len(records), 12), dtype=bool)
+    np.add.at(months, (row, m_idx), cols["valor"][sel])
+    activos[row, m_idx] = True
+
+    urows, first = np.unique(row, return_index=True)
+    return [
+        {"registro": records[r], "months": months[r].tolist(), "activos": np.flatnonzero(activos[r]).tolist()}
+        for r in urows[np.argsort(first, kind="stable")].tolist()
+    ]
+
+def calculate_yearly_projections(tramos: List[Dict[str, Any]], incrementos: Dict[int, Any], year: int, include_raw: bool = False):
+    """
+    Single Source of Truth for Yearly Financial Aggregation.
+    Calculates total investment, headcount, and project breakdown for a specific year.
+    The monthly detail ("mensualizado_raw") is only materialized when include_raw=True.
+    """
+    processed_tramos = _preprocesar_tramos(tramos)
+    records = _preparar_registros(processed_tramos) if processed_tramos else []
+    cols = _calcular_columnar(records, incrementos)
+    agg = _agregar_anio(cols, year)
+
+    result = {
         "anio": year,
-        "total": total_year,
-        "headcount": len(all_heads),
-        "costo_total": total_year, # Alias for clarity
-        "dist_dir_costo": dist_dir_costo,
-        "dist_planta_fin": {k: len(v) for k, v in dist_planta_fin.items()},
-        "dist_direccion_fin": {k: len(v) for k, v in dist_direccion_fin.items()},
-        "matrix_proyectos": matrix_proyectos,
-        "mensualizado_raw": mensualizado
+        "total": agg["total"],
+        "headcount": agg["headcount"],
+        "costo_total": agg["total"], # Alias for clarity
+        "dist_dir_costo": agg["dist_dir_costo"],
+        "dist_planta_fin": agg["dist_planta_fin"],
+        "dist_direccion_fin": agg["dist_direccion_fin"],
+        "matrix_proyectos": agg["matrix_proyectos"],
+        "matrix_sin_finan": agg["matrix_sin_finan"],
+        "matrix_costo_sin_finan": agg["matrix_costo_sin_finan"],
     }
+    if include_raw:
+        result["mensualizado_raw"] = _materializar(cols)
+    return result
 
 import math
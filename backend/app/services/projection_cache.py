@@ -0,0 +1,119 @@
+"""
+Caché de proyecciones a nivel de proceso.
+
+Las entradas se indexan por (tipo, año, filtros, versión de datos). Toda escritura que
+afecte BFinanciacion, BContrato, BPosicion o BIncremento debe llamar a bump_data_version()
+para que las proyecciones calculadas con los datos anteriores dejen de usarse.
+Los valores guardados se comparten entre requests: no deben mutarse después de cachearlos.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from app.core.config import settings
+
+_lock = threading.Lock()
+_data_version = 0
+_entries: "OrderedDict[Tuple, Tuple[Any, int, float]]" = OrderedDict()  # key -> (valor, bytes, creado)
+_total_bytes = 0
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+# Número de elementos de una lista/dict que se miden antes de extrapolar el tamaño
+_SIZE_SAMPLE = 32
+
+
+def _approx_size(obj: Any, depth: int = 0) -> int:
+    """Estimación barata del tamaño en memoria (muestrea colecciones grandes)."""
+    size = sys.getsizeof(obj)
+    if depth > 6:
+        return size
+    if isinstance(obj, dict):
+        items = list(obj.items())
+        sample = items[:_SIZE_SAMPLE]
+        if sample:
+            sub = sum(_approx_size(k, depth + 1) + _approx_size(v, depth + 1) for k, v in sample)
+            size += sub * len(items) // len(sample)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = obj if isinstance(obj, (list, tuple)) else list(obj)
+        sample = items[:_SIZE_SAMPLE]
+        if sample:
+            sub = sum(_approx_size(v, depth + 1) for v in sample)
+            size += sub * len(items) // len(sample)
+    return size
+
+
+def get_data_version() -> int:
+    return _data_version
+
+
+def bump_data_version() -> int:
+    """Invalida todas las proyecciones cacheadas. Llamar después de hacer commit de una escritura."""
+    global _data_version, _total_bytes
+    with _lock:
+        _data_version += 1
+        _stats["invalidations"] += 1
+        _entries.clear()
+        _total_bytes = 0
+        return _data_version
+
+
+def projection_key(kind: str, year: Optional[int], filters: Optional[Dict[str, Any]] = None) -> Tuple:
+    """
+    Construye la llave de caché con la versión de datos vigente.
+    Debe crearse ANTES de consultar la base para que un cálculo concurrente a una
+    escritura quede guardado con la versión vieja y nunca se sirva.
+    """
+    filt: Tuple[Tuple[str, Hashable], ...] = tuple(sorted((k, v) for k, v in (filters or {}).items() if v is not None))
+    return (kind, year, filt, _data_version)
+
+
+def get_projection(key: Tuple) -> Optional[Any]:
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and (time.monotonic() - entry[2]) <= settings.PROJECTION_CACHE_TTL_SECONDS:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return entry[0]
+        if entry is not None:
+            _evict(key)
+        _stats["misses"] += 1
+        return None
+
+
+def put_projection(key: Tuple, value: Any) -> Any:
+    """Guarda el valor (si la versión sigue vigente) con desalojo LRU por memoria. Retorna el valor."""
+    global _total_bytes
+    max_bytes = settings.PROJECTION_CACHE_MAX_MB * 1024 * 1024
+    size = _approx_size(value)
+    with _lock:
+        if key[-1] != _data_version or size > max_bytes:
+            return value
+        if key in _entries:
+            _evict(key)
+        _entries[key] = (value, size, time.monotonic())
+        _total_bytes += size
+        while _total_bytes > max_bytes and _entries:
+            _evict(next(iter(_entries)))
+            _stats["evictions"] += 1
+    return value
+
+
+def _evict(key: Tuple) -> None:
+    global _total_bytes
+    _, size, _ = _entries.pop(key)
+    _total_bytes -= size
+
+
+def cache_stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(_entries),
+            "approx_mb": round(_total_bytes / (1024 * 1024), 2),
+            "max_mb": settings.PROJECTION_CACHE_MAX_MB,
+            "data_version": _data_version,
+        }
@@ -0,0 +1,438 @@
+"""
+Estado incremental del dashboard global.
+
+Por año se guarda el aporte mensual de cada tramo (id_financiacion) y los agregados por
+proyecto, dirección y planta con conteos de referencia por cédula, junto con lo que el
+dashboard deriva de los tramos: alertas de inconsistencia, fin de financiación por cédula y
+traslapes. Aparte se lleva el índice de años con financiación. Cuando un tramo cambia solo
+se relee ese tramo, se resta su aporte anterior y se suma el nuevo.
+
+Cada tramo se relee y aplica bajo su propio candado, así que dos cambios al mismo id se
+aplican en orden; los ids que cambian mientras se construye un estado se re-aplican antes
+de publicarlo. Los cambios a BIncremento reconstruyen el estado (la firma de incrementos no
+coincide) y las escrituras hechas fuera del proceso se cubren con PROJECTION_CACHE_TTL_SECONDS.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import conexion
+from app.core.utils import to_date
+from app.services.payroll_service_optimized import contribuciones_anuales
+from app.services.projection_cache import bump_data_version
+from app.services.proyeccion_mensual import solicitar_refresco
+
+# Tramos del año para el dashboard global
+TRAMOS_DASHBOARD_SQL = """
+    SELECT f.id_financiacion, f.cedula, f.id_proyecto, f.salario_base, f.fecha_inicio, f.fecha_fin, f.id_contrato,
+           p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, p.Direccion, p.Planta, p.Base_Fuente, c.atep, c.gerencia,
+           c.estado, c.fecha_terminacion_real,
+           CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido) AS nombre_completo
+    FROM BFinanciacion f
+    JOIN BContrato c ON f.id_contrato = c.id_contrato
+    LEFT JOIN BData d ON c.cedula = d.cedula
+    LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
+    WHERE f.fecha_inicio <= :year_end
+      AND f.fecha_fin >= :year_start
+"""
+
+# Años en que empieza o termina cada tramo (selector de años del dashboard)
+ANIOS_SQL = """
+    SELECT id_financiacion, YEAR(fecha_inicio) AS anio_inicio, YEAR(fecha_fin) AS anio_fin
+    FROM BFinanciacion
+"""
+_ANIOS = "anios" # clave del índice de años en _states
+
+_lock = threading.Lock()
+_states: Dict[Any, Any] = {} # año -> YearlyProjectionState, _ANIOS -> IndiceAnios
+_en_construccion: Dict[Any, Optional[set]] = {} # clave -> ids cambiados mientras se construye (None: descartar)
+_build_locks: Dict[Any, threading.Lock] = {} # una construcción a la vez por clave
+_tramo_locks = [threading.Lock() for _ in range(64)] # releer + aplicar un id, en orden
+
+
+def normalize_ced(v):
+    if v is None: return ""
+    s = str(v).strip()
+    if s.endswith('.0'): s = s[:-2]
+    return s
+
+
+def firma_incrementos(incrementos: Dict[int, Any]) -> tuple:
+    return tuple(sorted(
+        (y, str(inc.get("porcentaje_aumento")), str(inc.get("smlv")), str(inc.get("transporte")), str(inc.get("dotacion")))
+        for y, inc in incrementos.items()
+    ))
+
+
+class YearlyProjectionState:
+    def __init__(self, year: int, incrementos: Dict[int, Any], proy_names: Dict[str, str]):
+        self.year = year
+        self.incrementos = incrementos
+        self.firma = firma_incrementos(incrementos)
+        self.proy_names = proy_names
+        self.created = time.monotonic()
+
+        self.aportes: Dict[Any, List[Dict[str, Any]]] = {} # id_financiacion -> aportes del tramo
+        self.proyectos: Dict[str, Dict[str, Any]] = {} # pid -> {label, months, heads: Counter}
+        self.heads = Counter()
+        self.dir_costo: Dict[str, float] = {}
+        self.dir_heads: Dict[str, Counter] = {}
+        self.planta_heads: Dict[str, Counter] = {}
+        self.sin_finan: Dict[str, List[Counter]] = {} # planta -> [12 Counter(cedula)]
+        self.sin_finan_costo: Dict[str, List[float]] = {}
+
+        # Alertas del dashboard, por tramo y por cédula
+        self.tramos: Dict[Any, Dict[str, Any]] = {} # id_financiacion -> {cedula, fecha_inicio, fecha_fin recortada}
+        self.alertas: Dict[Any, Dict[str, Any]] = {} # id_financiacion -> alerta de inconsistencia
+        self.por_cedula: Dict[Any, set] = {} # cédula -> ids
+        self.por_cedula_norm: Dict[str, set] = {} # cédula normalizada -> ids
+        self.fin_financiacion: Dict[str, date] = {} # cédula normalizada -> fin de financiación más tardío
+        self.traslapes: Dict[Any, None] = {} # cédulas con tramos traslapados (orden de llegada)
+
+    def expired(self) -> bool:
+        return (time.monotonic() - self.created) > settings.PROJECTION_CACHE_TTL_SECONDS
+
+    def vigente(self, incrementos: Dict[int, Any]) -> bool:
+        return not self.expired() and self.firma == firma_incrementos(incrementos)
+
+    def add(self, rows: List[Any]) -> None:
+        """Suma tramos leídos con TRAMOS_DASHBOARD_SQL."""
+        tramos = [preparar_tramo(r, self.proy_names) for r in rows]
+        for tr in tramos:
+            self._registrar(tr)
+        for ap in contribuciones_anuales(tramos, self.incrementos, self.year):
+            rec = ap["registro"]
+            self.aportes.setdefault(rec.get("id_financiacion"), []).append(ap)
+            self._aplicar(ap, 1)
+
+    def remove(self, id_financiacion: Any) -> None:
+        for ap in self.aportes.pop(id_financiacion, []):
+            self._aplicar(ap, -1)
+        tr = self.tramos.pop(id_financiacion, None)
+        if tr is not None:
+            self.alertas.pop(id_financiacion, None)
+            for indice, ced in ((self.por_cedula, tr["cedula"]), (self.por_cedula_norm, normalize_ced(tr["cedula"]))):
+                indice[ced].discard(id_financiacion)
+                if not indice[ced]:
+                    del indice[ced]
+            self._revisar_cedula(tr["cedula"])
+
+    def _registrar(self, tr: Dict[str, Any]) -> None:
+        """Alertas de inconsistencia del tramo (recorta fecha_fin al retiro) e índices por cédula."""
+        id_fin = tr.get("id_financiacion")
+        est = (tr.get("estado") or "").upper()
+        term_real = to_date(tr.get("fecha_terminacion_real"))
+        fin = to_date(tr.get("fecha_fin"))
+        if not est.startswith("ACTIVO"):
+            if term_real:
+                if fin and fin > term_real:
+                    tr["fecha_fin"] = term_real
+                    self.alertas[id_fin] = {
+                        "cedula": tr["cedula"],
+                        "nombre": tr.get("nombre_completo"),
+                        "id_fin": id_fin,
+                        "tipo": "Tramo Excede Retiro",
+                        "msg": f"Terminó {term_real}, tramo iba hasta {fin}"
+                    }
+                    fin = term_real
+            else:
+                # Inactive without term date - likely should not be counted at all or flagged
+                self.alertas[id_fin] = {
+                    "cedula": tr["cedula"],
+                    "nombre": tr.get("nombre_completo"),
+                    "id_fin": id_fin,
+                    "tipo": "Inactivo sin Fecha",
+                    "msg": "El contrato está inactivo pero no tiene fecha de terminación real."
+                }
+        self.tramos[id_fin] = {"cedula": tr["cedula"], "fecha_inicio": to_date(tr.get("fecha_inicio")), "fecha_fin": fin}
+        self.por_cedula.setdefault(tr["cedula"], set()).add(id_fin)
+        self.por_cedula_norm.setdefault(normalize_ced(tr["cedula"]), set()).add(id_fin)
+        self._revisar_cedula(tr["cedula"])
+
+    def _revisar_cedula(self, ced: Any) -> None:
+        """Recalcula fin de financiación y traslapes de una cédula con sus pocos tramos."""
+        norm = normalize_ced(ced)
+        fines = [self.tramos[i]["fecha_fin"] for i in self.por_cedula_norm.get(norm, ()) if self.tramos[i]["fecha_fin"]]
+        if fines:
+            self.fin_financiacion[norm] = max(fines)
+        else:
+            self.fin_financiacion.pop(norm, None)
+
+        tramos = [self.tramos[i] for i in self.por_cedula.get(ced, ())]
+        ordenados = sorted(tramos, key=lambda t: t["fecha_inicio"] or date.min)
+        traslape = any(
+            a["fecha_fin"] and b["fecha_inicio"] and a["fecha_fin"] >= b["fecha_inicio"]
+            for a, b in zip(ordenados, ordenados[1:])
+        )
+        if traslape:
+            self.traslapes.setdefault(ced, None)
+        else:
+            self.traslapes.pop(ced, None)
+
+    def _aplicar(self, ap: Dict[str, Any], signo: int) -> None:
+        """Suma (signo=1) o resta (signo=-1) el aporte de un tramo a los agregados."""
+        rec = ap["registro"]
+        months = ap["months"]
+        total = sum(months)
+        ced = rec.get("cedula")
+        pid = rec.get("id_proyecto") or "SIN_PROYECTO"
+
+        # 1. Project Matrix
+        if pid not in self.proyectos:
+            nombre = rec.get("proyecto") or rec.get("id_proyecto") or pid
+            self.proyectos[pid] = {
+                "id_proyecto": pid,
+                "codigo": pid,
+                "proyecto": nombre,
+                "label": f"{pid} - {nombre}",
+                "months": [0.0] * 12,
+                "heads": Counter(),
+            }
+        proj = self.proyectos[pid]
+        proj["months"] = [a + signo * b for a, b in zip(proj["months"], months)]
+        _contar(proj["heads"], ced, signo)
+        if not proj["heads"]:
+            del self.proyectos[pid]
+
+        # 2. Global KPIs
+        _contar(self.heads, ced, signo)
+
+        # 3. Direction Cost
+        d_name = rec.get("Direccion") or "Sin definir"
+        self.dir_costo[d_name] = self.dir_costo.get(d_name, 0.0) + signo * total
+        _contar(self.dir_heads.setdefault(d_name, Counter()), ced, signo)
+        if not self.dir_heads[d_name]:
+            del self.dir_heads[d_name]
+            del self.dir_costo[d_name]
+
+        # 4. Planta Coverage
+        p_name = rec.get("Base_Fuente") or "Proyectos"
+        _contar(self.planta_heads.setdefault(p_name, Counter()), ced, signo)
+        if not self.planta_heads[p_name]:
+            del self.planta_heads[p_name]
+
+        # 5. Trabajadores Sin Financiación (A01/A02)
+        if rec.get("id_proyecto") in ("A01", "A02"):
+            planta = rec.get("Planta") or "Sin Definir"
+            if planta not in self.sin_finan:
+                self.sin_finan[planta] = [Counter() for _ in range(12)]
+                self.sin_finan_costo[planta] = [0.0] * 12
+            for m in ap["activos"]:
+                _contar(self.sin_finan[planta][m], ced, signo)
+                self.sin_finan_costo[planta][m] += signo * months[m]
+            if not any(self.sin_finan[planta]):
+                del self.sin_finan[planta]
+                del self.sin_finan_costo[planta]
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Misma forma que calculate_yearly_projections (sin mensualizado_raw), más las alertas del
+        dashboard: inconsistency_alerts, fin_financiacion (cédula normalizada -> fecha) y traslapes.
+        """
+        matrix_proyectos = []
+        for info in self.proyectos.values():
+            matrix_proyectos.append({
+                "id_proyecto": info["id_proyecto"],
+                "codigo": info["codigo"],
+                "proyecto": info["proyecto"],
+                "label": info["label"],
+                "total": float(sum(info["months"])),
+                "months": list(info["months"]),
+                "headcount": len(info["heads"]),
+            })
+        total = float(sum(m["total"] for m in matrix_proyectos))
+        return {
+            "anio": self.year,
+            "total": total,
+            "headcount": len(self.heads),
+            "costo_total": total,
+            "dist_dir_costo": dict(self.dir_costo),
+            "dist_planta_fin": {k: len(v) for k, v in self.planta_heads.items()},
+            "dist_direccion_fin": {k: len(v) for k, v in self.dir_heads.items()},
+            "matrix_proyectos": matrix_proyectos,
+            "matrix_sin_finan": [
+                {"label": p, "months": [len(c) for c in counters], "total": len(set().union(*counters))}
+                for p, counters in self.sin_finan.items()
+            ],
+            "matrix_costo_sin_finan": [
+                {"label": p, "months": list(costs), "total": sum(costs)}
+                for p, costs in self.sin_finan_costo.items()
+            ],
+            "inconsistency_alerts": list(self.alertas.values()),
+            "fin_financiacion": dict(self.fin_financiacion),
+            "traslapes": list(self.traslapes),
+        }
+
+
+class IndiceAnios:
+    """Años en que empieza o termina algún tramo, con conteo por año para restar al cambiar uno."""
+    def __init__(self):
+        self.created = time.monotonic()
+        self.por_tramo: Dict[Any, set] = {}
+        self.conteo = Counter()
+
+    def vigente(self) -> bool:
+        return (time.monotonic() - self.created) <= settings.PROJECTION_CACHE_TTL_SECONDS
+
+    def add(self, rows: List[Any]) -> None:
+        for r in rows:
+            anios = {y for y in (r["anio_inicio"], r["anio_fin"]) if y}
+            self.por_tramo[r["id_financiacion"]] = anios
+            self.conteo.update(anios)
+
+    def remove(self, id_financiacion: Any) -> None:
+        for y in self.por_tramo.pop(id_financiacion, ()):
+            _contar(self.conteo, y, -1)
+
+
+def _contar(counter: Counter, key: Any, signo: int) -> None:
+    counter[key] += signo
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def preparar_tramo(row: Any, proy_names: Dict[str, str]) -> Dict[str, Any]:
+    """Convierte una fila de TRAMOS_DASHBOARD_SQL al formato que espera el motor de proyección."""
+    tr = dict(row)
+    for k, v in tr.items():
+        if hasattr(v, '__float__') and v is not None: tr[k] = float(v)
+    pid = tr.get("id_proyecto")
+    tr["proyecto"] = proy_names.get(pid, pid)
+    return tr
+
+
+def _tramo_lock(id_financiacion: Any) -> threading.Lock:
+    return _tramo_locks[hash(str(id_financiacion)) % len(_tramo_locks)]
+
+
+def _leer_tramo(conn, clave: Any, id_financiacion: Any) -> List[Any]:
+    """Filas actuales de un tramo para el estado `clave` (un año o el índice de años)."""
+    if clave == _ANIOS:
+        return conn.execute(text(ANIOS_SQL + " WHERE id_financiacion = :id"), {"id": id_financiacion}).mappings().all()
+    return conn.execute(
+        text(TRAMOS_DASHBOARD_SQL + " AND f.id_financiacion = :id"),
+        {"year_start": f"{clave}-01-01", "year_end": f"{clave}-12-31", "id": id_financiacion}
+    ).mappings().all()
+
+
+def _aplicar_tramo(id_financiacion: Any, destinos: Dict[Any, Any]) -> None:
+    """
+    Relee el tramo y lo reemplaza en cada estado de `destinos`. Bajo el candado del id, la
+    última lectura empieza después del último commit notificado, así que gana la fila vigente.
+    """
+    with _tramo_lock(id_financiacion):
+        with conexion() as conn:
+            filas = {clave: _leer_tramo(conn, clave, id_financiacion) for clave in destinos}
+        with _lock:
+            for clave, state in destinos.items():
+                state.remove(id_financiacion)
+                state.add(filas[clave])
+
+
+def _obtener(clave: Any, vigente: Callable[[Any], bool], construir: Callable[[], Any]) -> Any:
+    """
+    Estado vigente de `clave` o uno nuevo construido fuera de _lock. Los ids que cambian
+    durante la construcción (registrados por tramo_changed) se re-aplican antes de publicarlo;
+    si invalidar_estado() la marcó, se usa solo para esta llamada y no se publica.
+    """
+    with _lock:
+        state = _states.get(clave)
+        if state is not None and vigente(state):
+            return state
+        build_lock = _build_locks.setdefault(clave, threading.Lock())
+    with build_lock:
+        with _lock:
+            state = _states.get(clave)
+            if state is not None and vigente(state):
+                return state
+            _en_construccion[clave] = set()
+        try:
+            state = construir()
+            while True:
+                with _lock:
+                    pendientes = _en_construccion[clave]
+                    if pendientes is None:
+                        return state
+                    if not pendientes:
+                        _states[clave] = state
+                        return state
+                    _en_construccion[clave] = set()
+                for id_financiacion in pendientes:
+                    _aplicar_tramo(id_financiacion, {clave: state})
+        finally:
+            with _lock:
+                _en_construccion.pop(clave, None)
+
+
+def yearly_projection(year: int, incrementos: Dict[int, Any], proy_names: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Proyección anual y alertas del dashboard global servidas desde el estado incremental.
+    Si no hay estado vigente para el año (o cambiaron los incrementos) se construye leyendo sus tramos.
+    """
+    def construir():
+        state = YearlyProjectionState(year, incrementos, proy_names)
+        with conexion() as conn:
+            rows = conn.execute(text(TRAMOS_DASHBOARD_SQL), {"year_start": f"{year}-01-01", "year_end": f"{year}-12-31"}).mappings().all()
+        state.add(rows)
+        return state
+
+    state = _obtener(year, lambda s: s.vigente(incrementos), construir)
+    with _lock:
+        return state.result()
+
+
+def anios_financiacion() -> List[int]:
+    """Años en que empieza o termina algún tramo de BFinanciacion."""
+    def construir():
+        indice = IndiceAnios()
+        with conexion() as conn:
+            indice.add(conn.execute(text(ANIOS_SQL)).mappings().all())
+        return indice
+
+    indice = _obtener(_ANIOS, lambda s: s.vigente(), construir)
+    with _lock:
+        return sorted(indice.conteo)
+
+
+def invalidar_estado() -> None:
+    """
+    Descarta el estado de todos los años e invalida la caché. Para cambios que no son de un
+    tramo pero alteran sus atributos (BPosicion: Dirección, Planta, cargo).
+    """
+    with _lock:
+        _states.clear()
+        # Las construcciones en curso pudieron leer los atributos anteriores: no se publican
+        for clave in _en_construccion:
+            _en_construccion[clave] = None
+    bump_data_version()
+
+
+def tramo_changed(id_financiacion: Optional[str]) -> None:
+    """
+    Aplica el cambio de un tramo (creación, edición o eliminación ya confirmada en BD)
+    a cada estado: resta el aporte anterior y suma el nuevo leído de la base. Si hay
+    estados en construcción el id queda registrado para re-aplicarlo antes de publicarlos.
+    También invalida las respuestas cacheadas en projection_cache y encola el tramo
+    para BProyeccion_Mensual.
+    """
+    solicitar_refresco([id_financiacion])
+    try:
+        with _lock:
+            for pendientes in _en_construccion.values():
+                if pendientes is not None:
+                    pendientes.add(id_financiacion)
+            destinos = dict(_states)
+        if destinos:
+            _aplicar_tramo(id_financiacion, destinos)
+    except Exception as e:
+        # Ante cualquier error se descarta el estado: el próximo dashboard lo reconstruye completo
+        print(f"Warning: incremental projection update failed ({e}); resetting state")
+        with _lock:
+            _states.clear()
+    finally:
+        bump_data_version()
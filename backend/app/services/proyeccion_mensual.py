@@ -0,0 +1,309 @@
+"""
+Proyección mensual materializada (BProyeccion_Mensual).
+
+Un hilo de fondo escribe la salida del motor de mensualización (tramo x mes: días, valor
+y un valor por concepto) en una tabla de hechos. tramo_changed() encola los tramos
+modificados para un refresco incremental; los cambios de BIncremento o BPosicion y el
+intervalo PROYECCION_FULL_REFRESH_SECONDS (cubre escrituras hechas fuera del proceso,
+p. ej. sync_novasoft) disparan una reconstrucción completa. La reconstrucción se escribe en
+una tabla de staging y se publica con RENAME TABLE; un GET_LOCK de MySQL garantiza que solo
+una instancia la haga a la vez. Mientras la tabla no esté disponible los endpoints siguen
+calculando en Python.
+"""
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, text
+
+from app.core.config import settings
+from app.core.database import engine
+from app.services.payroll_rules import CONCEPTOS
+from app.services.payroll_service_optimized import _calcular_columnar, _preparar_registros, _preprocesar_tramos
+from app.services.projection_cache import bump_data_version
+from app.services.reference_data import get_incrementos
+
+TABLA = "BProyeccion_Mensual"
+_NUEVA = f"{TABLA}_nueva"
+_VIEJA = f"{TABLA}_vieja"
+_LOCK_FULL = f"{TABLA}.full" # GET_LOCK compartido por todas las instancias
+# Tramos refrescados incrementalmente (por cualquier instancia); la reconstrucción los re-aplica
+CAMBIOS = "BProyeccion_Cambios"
+
+# Tramos con contrato (mismas reglas de proyección que el dashboard global)
+TRAMOS_SQL = """
+    SELECT f.id_financiacion, f.cedula, f.id_contrato, f.id_proyecto, f.salario_base, f.fecha_inicio, f.fecha_fin,
+           p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c, c.atep, c.estado, c.fecha_terminacion_real
+    FROM BFinanciacion f
+    JOIN BContrato c ON f.id_contrato = c.id_contrato
+    LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
+"""
+
+_COLUMNAS = ("id_financiacion", "anio_mes", "cedula", "id_contrato", "id_proyecto", "dias", "valor") + CONCEPTOS
+
+
+def _insert_sql(tabla: str):
+    return text(
+        f"INSERT INTO {tabla} ({', '.join(_COLUMNAS)}, actualizado) "
+        f"VALUES ({', '.join(':' + c for c in _COLUMNAS)}, NOW())"
+    )
+
+_refresh_lock = threading.Lock() # una escritura a la vez sobre la tabla
+_cond = threading.Condition()
+_pendientes: set = set()
+_full_pendiente = False
+_stop = False
+_thread: Optional[threading.Thread] = None
+_estado: Dict[str, Any] = {
+    "disponible": False,
+    "ultima_full": None,
+    "ultima_incremental": None,
+    "filas_full": 0,
+    "error": None,
+}
+
+
+def _filas(rows: Iterable[Any], incrementos: Dict[int, Any]) -> List[Dict[str, Any]]:
+    """Mensualiza los tramos y devuelve las filas a insertar (una por tramo x mes con días)."""
+    tramos = []
+    for r in rows:
+        d = dict(r)
+        for k, v in d.items():
+            if hasattr(v, '__float__') and v is not None: d[k] = float(v)
+        tramos.append(d)
+    tramos = _preprocesar_tramos(tramos)
+    if not tramos:
+        return []
+    records = _preparar_registros(tramos)
+    cols = _calcular_columnar(records, incrementos)
+
+    mi = cols["mi"].tolist()
+    conc = cols["conceptos"].T.tolist()
+    out = []
+    for j, (r, dias, valor) in enumerate(zip(cols["row"].tolist(), cols["dias"].tolist(), cols["valor"].tolist())):
+        rec = records[r]
+        fila = {
+            "id_financiacion": rec.get("id_financiacion"),
+            "anio_mes": date(mi[j] // 12, mi[j] % 12 + 1, 1),
+            "cedula": rec.get("cedula"),
+            "id_contrato": rec.get("id_contrato"),
+            "id_proyecto": rec.get("id_proyecto"),
+            "dias": dias,
+            "valor": valor,
+        }
+        fila.update(zip(CONCEPTOS, conc[j]))
+        out.append(fila)
+    return out
+
+
+def _insertar(conn, filas: List[Dict[str, Any]], tabla: str = TABLA) -> None:
+    batch = max(1, settings.PROYECCION_INSERT_BATCH)
+    query = _insert_sql(tabla)
+    for i in range(0, len(filas), batch):
+        conn.execute(query, filas[i:i + batch])
+
+
+def _recalcular(ids: List[str], tabla: str, anotar: bool = False) -> int:
+    """
+    Reemplaza en `tabla` las filas de los tramos indicados (solo esas claves quedan bloqueadas).
+    Con `anotar`, los ids quedan en BProyeccion_Cambios en la misma transacción.
+    """
+    with engine.connect() as conn:
+        q = text(TRAMOS_SQL + " WHERE f.id_financiacion IN :ids").bindparams(bindparam("ids", expanding=True))
+        rows = conn.execute(q, {"ids": ids}).mappings().all()
+    filas = _filas(rows, get_incrementos())
+    with engine.begin() as conn:
+        q = text(f"DELETE FROM {tabla} WHERE id_financiacion IN :ids").bindparams(bindparam("ids", expanding=True))
+        conn.execute(q, {"ids": ids})
+        _insertar(conn, filas, tabla)
+        if anotar:
+            conn.execute(text(f"INSERT INTO {CAMBIOS} (id_financiacion) VALUES (:id)"), [{"id": i} for i in ids])
+    return len(filas)
+
+
+def refrescar_completo(espera: int = 0) -> Optional[int]:
+    """
+    Reconstruye la tabla en BProyeccion_Mensual_nueva y la publica con un RENAME TABLE
+    atómico: los lectores siguen sobre la versión anterior sin esperar un DELETE masivo.
+    Devuelve None (sin hacer nada) si otra instancia mantiene el GET_LOCK de la
+    reconstrucción más de `espera` segundos.
+    """
+    with _refresh_lock, engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT GET_LOCK(:n, :espera)"), {"n": _LOCK_FULL, "espera": espera}).scalar():
+            return None
+        try:
+            # Cursor con un margen: un id menor puede confirmarse después de uno mayor
+            visto = lock_conn.execute(text(
+                f"SELECT COALESCE(MAX(id), 0) FROM {CAMBIOS} WHERE creado < NOW() - INTERVAL 60 SECOND"
+            )).scalar()
+            lock_conn.commit()
+            rows = lock_conn.execute(text(TRAMOS_SQL)).mappings().all()
+            filas = _filas(rows, get_incrementos())
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {_NUEVA}, {_VIEJA}"))
+                conn.execute(text(f"CREATE TABLE {_NUEVA} LIKE {TABLA}"))
+            with engine.begin() as conn:
+                _insertar(conn, filas, _NUEVA)
+            # Refrescos incrementales de otras instancias durante la reconstrucción (también los
+            # borrados): se rehacen sobre la nueva hasta que no quede ninguno. Los de esta
+            # instancia esperan en _pendientes a que se libere _refresh_lock.
+            while True:
+                with engine.connect() as conn:
+                    cambios = conn.execute(
+                        text(f"SELECT id, id_financiacion FROM {CAMBIOS} WHERE id > :visto ORDER BY id"), {"visto": visto}
+                    ).all()
+                if not cambios:
+                    break
+                visto = cambios[-1][0]
+                _recalcular(list({c[1] for c in cambios}), _NUEVA)
+            with engine.begin() as conn:
+                conn.execute(text(f"RENAME TABLE {TABLA} TO {_VIEJA}, {_NUEVA} TO {TABLA}"))
+                conn.execute(text(f"DROP TABLE {_VIEJA}"))
+            with engine.begin() as conn:
+                conn.execute(text(f"DELETE FROM {CAMBIOS} WHERE id <= :visto"), {"visto": visto})
+        finally:
+            lock_conn.execute(text("SELECT RELEASE_LOCK(:n)"), {"n": _LOCK_FULL})
+        _estado.update(disponible=True, ultima_full=datetime.now(), filas_full=len(filas), error=None)
+    bump_data_version()
+    return len(filas)
+
+
+def refrescar_tramos(ids: Iterable[str]) -> int:
+    """Recalcula solo los tramos indicados (creados, editados o eliminados)."""
+    ids = [i for i in ids if i]
+    if not ids:
+        return 0
+    with _refresh_lock:
+        n = _recalcular(ids, TABLA, anotar=True)
+        _estado.update(ultima_incremental=datetime.now())
+    bump_data_version()
+    return n
+
+
+def solicitar_refresco(ids: Optional[Iterable[str]] = None) -> None:
+    """Encola un refresco: de los tramos indicados o, sin ids, de toda la tabla. No bloquea."""
+    global _full_pendiente
+    if not settings.PROYECCION_MATERIALIZADA:
+        return
+    with _cond:
+        if ids is None:
+            _full_pendiente = True
+        else:
+            _pendientes.update(i for i in ids if i)
+        _cond.notify()
+
+
+def proyeccion_disponible() -> bool:
+    return settings.PROYECCION_MATERIALIZADA and _estado["disponible"]
+
+
+def estado_materializador() -> Dict[str, Any]:
+    with _cond:
+        pendientes = len(_pendientes)
+    return {**_estado, "pendientes": pendientes, "full_pendiente": _full_pendiente}
+
+
+def _edad_tabla() -> Optional[float]:
+    """Segundos desde el último refresco completo (None si la tabla está vacía)."""
+    with engine.connect() as conn:
+        ultima = conn.execute(text(f"SELECT MIN(actualizado) FROM {TABLA}")).scalar()
+        ahora = conn.execute(text("SELECT NOW()")).scalar()
+    return (ahora - ultima).total_seconds() if ultima else None
+
+
+def _worker() -> None:
+    global _full_pendiente
+    intervalo = max(60, settings.PROYECCION_FULL_REFRESH_SECONDS)
+    proxima_full = time.monotonic()
+    try:
+        # Otra instancia (o un arranque previo) pudo dejar la tabla al día
+        edad = _edad_tabla()
+        if edad is not None and edad < intervalo:
+            _estado["disponible"] = True
+            proxima_full += intervalo - edad
+    except Exception as e:
+        _estado["error"] = str(e)
+
+    while True:
+        with _cond:
+            while not (_stop or _full_pendiente or _pendientes or time.monotonic() >= proxima_full):
+                _cond.wait(timeout=max(0.0, proxima_full - time.monotonic()))
+            if _stop:
+                return
+            forzada = _full_pendiente
+            full = forzada or time.monotonic() >= proxima_full
+            ids = set() if full else set(_pendientes)
+            _pendientes.clear()
+            _full_pendiente = False
+        try:
+            if full:
+                # El refresco periódico se omite si otra instancia reconstruyó hace poco
+                edad = None if forzada else _edad_tabla()
+                if edad is not None and edad < intervalo:
+                    _estado["disponible"] = True
+                    proxima_full = time.monotonic() + intervalo - edad
+                    continue
+                # Una reconstrucción forzada (BIncremento/BPosicion) espera a la que esté en curso,
+                # que pudo leer los datos anteriores al cambio
+                n = refrescar_completo(espera=300 if forzada else 0)
+                proxima_full = time.monotonic() + intervalo
+                if n is None:
+                    # Otra instancia está reconstruyendo; la tabla publicada sigue siendo válida
+                    _estado["disponible"] = _edad_tabla() is not None
+                    print("BProyeccion_Mensual: reconstrucción en curso en otra instancia")
+                else:
+                    print(f"BProyeccion_Mensual: refresco completo ({n} filas)")
+            else:
+                refrescar_tramos(ids)
+        except Exception as e:
+            # Si falla el incremental la tabla queda desactualizada: se reconstruye completa
+            print(f"Warning: BProyeccion_Mensual refresh failed ({e})")
+            _estado.update(error=str(e))
+            if not full:
+                _estado["disponible"] = False
+                solicitar_refresco()
+            else:
+                proxima_full = time.monotonic() + min(intervalo, 300)
+
+
+def iniciar_materializador() -> None:
+    """Arranca el hilo de fondo (idempotente). Se llama desde el startup de la app."""
+    global _thread, _stop
+    if not settings.PROYECCION_MATERIALIZADA or (_thread and _thread.is_alive()):
+        return
+    _stop = False
+    _thread = threading.Thread(target=_worker, name="proyeccion-mensual", daemon=True)
+    _thread.start()
+
+
+def detener_materializador() -> None:
+    global _stop
+    with _cond:
+        _stop = True
+        _cond.notify()
+
+
+# --- Lecturas ---
+
+# Proyectado de un mes para la conciliación: tramos cuyo propio contrato (f.id_contrato) está
+# activo, igual que el cálculo en vivo de nomina.py. Así ATEP y posición son las del contrato
+# del tramo y el recorte por fecha_terminacion_real (solo contratos inactivos) no aplica.
+# Filas con la forma del "detalle" de la mensualización.
+CONCILIACION_SQL = f"""
+    SELECT TRIM(m.cedula) AS cedula,
+           COALESCE(NULLIF(TRIM(CONCAT_WS(' ', d.p_nombre, d.s_nombre, d.p_apellido, d.s_apellido)), ''), m.cedula) AS nombre,
+           TRIM(f.id_proyecto) AS id_proyecto,
+           TRIM(f.id_fuente) AS id_fuente,
+           TRIM(f.id_componente) AS id_componente,
+           TRIM(f.id_subcomponente) AS id_subcomponente,
+           TRIM(f.id_categoria) AS id_categoria,
+           TRIM(f.id_responsable) AS id_responsable,
+           SUM(m.valor) AS valor
+    FROM {TABLA} m
+    JOIN BFinanciacion f ON f.id_financiacion = m.id_financiacion
+    LEFT JOIN BData d ON d.cedula = m.cedula
+    WHERE m.anio_mes = :mes
+      AND EXISTS (SELECT 1 FROM BContrato c WHERE c.id_contrato = m.id_contrato AND c.estado LIKE 'Activo%')
+    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+"""
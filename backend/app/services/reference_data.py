@@ -0,0 +1,71 @@
+"""
+Caché en proceso de datos de referencia: BIncremento y catálogos dim_*.
+
+Cada tabla se carga una vez y se reutiliza hasta REFERENCE_CACHE_TTL_SECONDS o hasta una
+invalidación explícita (endpoints de incrementos, sync_novasoft.run_sync). Los mapas que se
+retornan son de solo lectura (MappingProxyType) porque se comparten entre requests.
+"""
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import conexion
+
+CATALOGOS_SQL = {
+    "proyectos": "SELECT codigo, nombre FROM dim_proyectos UNION SELECT codigo, nombre FROM dim_proyectos_otros",
+    "fuentes": "SELECT codigo, nombre FROM dim_fuentes",
+    "componentes": "SELECT codigo, nombre FROM dim_componentes",
+    "subcomponentes": "SELECT codigo, nombre FROM dim_subcomponentes",
+    "categorias": "SELECT codigo, nombre FROM dim_categorias",
+    "responsables": "SELECT codigo, nombre FROM dim_responsables",
+}
+
+_lock = threading.Lock()
+_cache: Dict[str, Any] = {} # nombre -> (valor, cargado)
+
+
+def _get(nombre: str, loader) -> Any:
+    with _lock:
+        entry = _cache.get(nombre)
+        if entry is not None and (time.monotonic() - entry[1]) <= settings.REFERENCE_CACHE_TTL_SECONDS:
+            return entry[0]
+    # La carga se hace fuera del lock; dos cargas concurrentes solo duplican una consulta barata
+    valor = loader()
+    with _lock:
+        _cache[nombre] = (valor, time.monotonic())
+    return valor
+
+
+def _load_incrementos() -> Mapping[int, Mapping[str, Any]]:
+    with conexion() as conn:
+        rows = conn.execute(text("SELECT * FROM BIncremento")).mappings().all()
+    return MappingProxyType({int(r["anio"]): MappingProxyType(dict(r)) for r in rows})
+
+
+def get_incrementos() -> Mapping[int, Mapping[str, Any]]:
+    """{anio: fila de BIncremento} de solo lectura."""
+    return _get("incrementos", _load_incrementos)
+
+
+def get_catalogo(nombre: str) -> Mapping[str, Any]:
+    """{codigo: nombre} del catálogo dim_* indicado (ver CATALOGOS_SQL)."""
+    def _load():
+        with conexion() as conn:
+            rows = conn.execute(text(CATALOGOS_SQL[nombre])).fetchall()
+        return MappingProxyType({r[0]: r[1] for r in rows})
+    return _get(f"dim:{nombre}", _load)
+
+
+def invalidate_reference_data(nombre: Optional[str] = None) -> None:
+    """Descarta la caché completa o solo 'incrementos' / un catálogo ('proyectos', 'fuentes', ...)."""
+    with _lock:
+        if nombre is None:
+            _cache.clear()
+        elif nombre == "incrementos":
+            _cache.pop("incrementos", None)
+        else:
+            _cache.pop(f"dim:{nombre}", None)
@@ -0,0 +1,299 @@
+"""
+Índice de búsqueda en memoria para personas (BData) y proyectos (dim_proyectos*).
+
+Cada documento guarda su texto normalizado (minúsculas, sin tildes, solo alfanumérico) y
+cada palabra su posting list. Los términos de 3+ caracteres se resuelven con trigramas del
+vocabulario (palabras que contienen el término, verificadas como subcadena); los de 1-2
+caracteres por prefijo (bisect) sobre el vocabulario ordenado. Varias palabras se combinan
+con AND. El ranking usa solo operaciones de conjuntos, sin recorrer cada coincidencia.
+
+Un hilo de fondo construye el índice al arrancar y revisa cada SEARCH_INDEX_CHECK_SECONDS
+una firma barata de las tablas (conteos y MAX(modificacion)); si cambió lo reconstruye y
+reemplaza el índice completo de una vez (las lecturas nunca ven uno a medio construir).
+solicitar_reconstruccion() fuerza la reconstrucción (p. ej. después de sync_novasoft).
+Mientras no hay índice, buscar() retorna None y los filtros usan su LIKE de siempre.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.utils import normalizar_cedula
+
+PERSONA = "persona"
+PROYECTO = "proyecto"
+TIPOS = (PERSONA, PROYECTO)
+
+PERSONAS_SQL = "SELECT cedula, p_nombre, s_nombre, p_apellido, s_apellido FROM BData"
+# dim_proyectos tiene prioridad sobre dim_proyectos_otros para el mismo código
+PROYECTOS_SQL = """
+    SELECT codigo, nombre, 1 AS prioridad FROM dim_proyectos
+    UNION ALL
+    SELECT codigo, nombre, 2 AS prioridad FROM dim_proyectos_otros
+"""
+FIRMA_SQL = """
+    SELECT (SELECT COUNT(*) FROM BData) AS personas,
+           (SELECT MAX(modificacion) FROM BData) AS personas_mod,
+           (SELECT COUNT(*) FROM dim_proyectos) AS proyectos,
+           (SELECT COUNT(*) FROM dim_proyectos_otros) AS proyectos_otros
+"""
+
+_NO_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalizar_texto(v: Any) -> str:
+    """Minúsculas, sin tildes, separadores -> un espacio."""
+    if v is None:
+        return ""
+    s = unicodedata.normalize("NFKD", str(v))
+    s = "".join(c for c in s if not unicodedata.combining(c)).lower()
+    return _NO_ALNUM.sub(" ", s).strip()
+
+
+def _trigramas(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def _rango_prefijo(vocab: List[str], prefijo: str) -> List[str]:
+    # El vocabulario solo tiene [a-z0-9]: "{" ordena después de cualquier continuación
+    return vocab[bisect_left(vocab, prefijo):bisect_left(vocab, prefijo + "{")]
+
+
+def _union(postings: Dict[str, FrozenSet[int]], tokens: Iterable[str]) -> Set[int]:
+    return set().union(*(postings[t] for t in tokens))
+
+
+class _Indice:
+    """
+    Índice inmutable una vez construido. Posting lists por palabra (y por primera palabra
+    del documento, para el ranking) y trigramas sobre el vocabulario, no sobre documentos:
+    un término se resuelve a las palabras que lo contienen y luego a sus documentos.
+    """
+
+    def __init__(self, docs: List[Tuple[str, str, str, str]]):
+        # docs: (tipo, id, nombre, texto normalizado)
+        self.docs = docs
+        self.largo = [len(d[2]) for d in docs]
+        por_tipo: Dict[str, Set[int]] = {}
+        por_id: Dict[str, Set[int]] = {}
+        postings: Dict[str, Set[int]] = {}
+        primeras: Dict[str, Set[int]] = {}
+        for i, (tipo, id_, _, texto) in enumerate(docs):
+            por_tipo.setdefault(tipo, set()).add(i)
+            por_id.setdefault(normalizar_texto(id_).replace(" ", ""), set()).add(i)
+            tokens = texto.split()
+            for token in tokens:
+                postings.setdefault(token, set()).add(i)
+            if tokens:
+                primeras.setdefault(tokens[0], set()).add(i)
+        self.por_tipo = {k: frozenset(v) for k, v in por_tipo.items()}
+        self.por_id = {k: frozenset(v) for k, v in por_id.items()}
+        self.postings = {k: frozenset(v) for k, v in postings.items()}
+        self.primeras = {k: frozenset(v) for k, v in primeras.items()}
+        self.vocab = sorted(self.postings)
+        self.vocab_primeras = sorted(self.primeras)
+        trigramas: Dict[str, Set[int]] = {}
+        for j, token in enumerate(self.vocab):
+            for t in _trigramas(token):
+                trigramas.setdefault(t, set()).add(j)
+        self.trigramas = {k: frozenset(v) for k, v in trigramas.items()}
+
+    def _palabras(self, termino: str) -> List[str]:
+        """Palabras del vocabulario que contienen el término (prefijo si tiene 1-2 caracteres)."""
+        if len(termino) < 3:
+            return _rango_prefijo(self.vocab, termino)
+        listas = sorted((self.trigramas.get(t, frozenset()) for t in _trigramas(termino)), key=len)
+        if not listas[0]:
+            return []
+        candidatas = listas[0].intersection(*listas[1:])
+        # Los trigramas no garantizan contigüidad: se verifica la subcadena
+        return [self.vocab[j] for j in candidatas if termino in self.vocab[j]]
+
+    def coincidencias(self, q: str, tipo: Optional[str] = None) -> Tuple[List[str], Set[int]]:
+        terminos = normalizar_texto(q).split()
+        if not terminos:
+            return terminos, set()
+        # Primero los términos más selectivos (más largos)
+        terminos.sort(key=len, reverse=True)
+        res = _union(self.postings, self._palabras(terminos[0]))
+        for t in terminos[1:]:
+            if not res:
+                break
+            res &= _union(self.postings, self._palabras(t))
+        if tipo:
+            res &= self.por_tipo.get(tipo, frozenset())
+        return terminos, res
+
+    def ranking(self, terminos: List[str], res: Set[int], limit: int) -> List[Tuple[int, float]]:
+        """
+        Los `limit` mejores como (doc, score), por niveles calculados con operaciones de
+        conjuntos: id exacto (+100); todos los términos como prefijo de palabra y alguno de la
+        primera (30); todos como prefijo (20); solo subcadena (10). Dentro del nivel, el
+        nombre más corto primero.
+        """
+        prefijo = set(res)
+        for t in terminos:
+            prefijo &= _union(self.postings, _rango_prefijo(self.vocab, t))
+        primera = set()
+        for t in terminos:
+            primera |= _union(self.primeras, _rango_prefijo(self.vocab_primeras, t))
+        exactos = self.por_id.get("".join(terminos) if len(terminos) == 1 else "", frozenset()) & res
+        nivel1 = prefijo & primera
+        niveles = ((nivel1, 30), (prefijo - nivel1, 20), (res - prefijo, 10))
+
+        def _score(i: int) -> float:
+            base = next(v for n, v in niveles if i in n)
+            return base + (100 if i in exactos else 0) - self.largo[i] / 1000.0
+
+        elegidos = heapq.nsmallest(limit, exactos, key=self.largo.__getitem__)
+        for nivel, _ in niveles:
+            if len(elegidos) >= limit:
+                break
+            elegidos += heapq.nsmallest(limit - len(elegidos), nivel - exactos, key=self.largo.__getitem__)
+        return sorted(((i, _score(i)) for i in elegidos), key=lambda x: (-x[1], self.docs[x[0]][1]))
+
+
+_lock = threading.Lock()
+_cond = threading.Condition(_lock)
+_indice: Optional[_Indice] = None
+_estado: Dict[str, Any] = {"documentos": 0, "construido": None, "segundos": None, "error": None}
+_forzar = False
+_stop = False
+_thread: Optional[threading.Thread] = None
+
+
+def construir() -> _Indice:
+    """Lee BData y los catálogos de proyectos y arma un índice nuevo (no lo publica)."""
+    with engine.connect() as conn:
+        personas = conn.execute(text(PERSONAS_SQL)).mappings().all()
+        proyectos = conn.execute(text(PROYECTOS_SQL)).mappings().all()
+    docs: List[Tuple[str, str, str, str]] = []
+    for r in personas:
+        cedula = str(r["cedula"] or "").strip()
+        if not cedula:
+            continue
+        nombre = " ".join(str(r[k]).strip() for k in ("p_nombre", "s_nombre", "p_apellido", "s_apellido") if r[k])
+        docs.append((PERSONA, cedula, nombre, normalizar_texto(f"{nombre} {cedula} {normalizar_cedula(cedula) or ''}")))
+    vistos = set()
+    for r in sorted(proyectos, key=lambda r: r["prioridad"]):
+        codigo = str(r["codigo"] or "").strip()
+        if not codigo or codigo in vistos:
+            continue
+        vistos.add(codigo)
+        nombre = str(r["nombre"] or codigo).strip()
+        docs.append((PROYECTO, codigo, nombre, normalizar_texto(f"{codigo} {nombre}")))
+    return _Indice(docs)
+
+
+def reconstruir() -> int:
+    """Construye y publica el índice. Retorna el número de documentos."""
+    global _indice
+    inicio = time.monotonic()
+    nuevo = construir()
+    with _lock:
+        _indice = nuevo
+    _estado.update(documentos=len(nuevo.docs), construido=time.time(),
+                   segundos=round(time.monotonic() - inicio, 3), error=None)
+    return len(nuevo.docs)
+
+
+def _firma() -> Tuple:
+    with engine.connect() as conn:
+        return tuple(conn.execute(text(FIRMA_SQL)).first())
+
+
+def _worker() -> None:
+    global _forzar
+    firma = None
+    while True:
+        with _cond:
+            if _indice is not None and not _forzar:
+                _cond.wait(timeout=max(5, settings.SEARCH_INDEX_CHECK_SECONDS))
+            if _stop:
+                return
+            forzar, _forzar = _forzar, False
+        try:
+            actual = _firma()
+            if forzar or _indice is None or actual != firma:
+                n = reconstruir()
+                firma = actual
+                print(f"Índice de búsqueda: {n} documentos ({_estado['segundos']}s)")
+        except Exception as e:
+            _estado["error"] = str(e)
+            print(f"Warning: índice de búsqueda no construido ({e})")
+            with _cond:
+                # Reintento sin saturar la BD
+                _cond.wait(timeout=60)
+                if _stop:
+                    return
+
+
+def iniciar_busqueda() -> None:
+    """Arranca el hilo que construye y mantiene el índice (idempotente)."""
+    global _thread, _stop
+    if _thread and _thread.is_alive():
+        return
+    _stop = False
+    _thread = threading.Thread(target=_worker, name="search-index", daemon=True)
+    _thread.start()
+
+
+def detener_busqueda() -> None:
+    global _stop
+    with _cond:
+        _stop = True
+        _cond.notify()
+
+
+def solicitar_reconstruccion() -> None:
+    global _forzar
+    with _cond:
+        _forzar = True
+        _cond.notify()
+
+
+def estado_busqueda() -> Dict[str, Any]:
+    return {**_estado, "disponible": _indice is not None}
+
+
+# --- Consultas ---
+
+def buscar(q: str, tipo: Optional[str] = None, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+    """Resultados ordenados por relevancia: [{tipo, id, nombre, score}]. None si no hay índice."""
+    idx = _indice
+    if idx is None:
+        return None
+    terminos, encontrados = idx.coincidencias(q, tipo)
+    return [
+        {"tipo": idx.docs[i][0], "id": idx.docs[i][1], "nombre": idx.docs[i][2], "score": round(score, 2)}
+        for i, score in idx.ranking(terminos, encontrados, limit)
+    ]
+
+
+def ids_coincidentes(q: str, tipo: str) -> Optional[List[str]]:
+    """
+    Todos los ids (cédulas o códigos) del tipo que coinciden con `q`. None si no hay índice o
+    si hay más de SEARCH_MAX_FILTER_IDS (el llamador usa entonces su filtro SQL).
+    """
+    idx = _indice
+    if idx is None:
+        return None
+    _, encontrados = idx.coincidencias(q, tipo)
+    if len(encontrados) > settings.SEARCH_MAX_FILTER_IDS:
+        return None
+    return sorted(idx.docs[i][1] for i in encontrados)
+
+
+def condicion_in(columna: str, valores: Iterable[Any], prefijo: str) -> Tuple[str, Dict[str, Any]]:
+    """'columna IN (:p0, :p1, ...)' con sus parámetros; sin valores, una condición falsa."""
+    params = {f"{prefijo}{i}": v for i, v in enumerate(valores)}
+    if not params:
+        return "1 = 0", {}
+    return f"{columna} IN ({', '.join(':' + k for k in params)})", params
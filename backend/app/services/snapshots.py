@@ -0,0 +1,314 @@
+"""
+Snapshots de presupuesto codificados como deltas (copy-on-write).
+
+Una versión es un checkpoint (copia completa de BFinanciacion) o un delta contra su
+base_version_id: solo guarda las filas agregadas o modificadas (op 'A'/'M', fila completa)
+y lápidas de las eliminadas (op 'D'), todas por original_id_financiacion. El estado de una
+versión se reconstruye al leer: se toma la cadena checkpoint -> ... -> versión y, por cada
+llave, la fila de la versión más reciente de la cadena; las lápidas la ocultan.
+
+Cada SNAPSHOT_CHECKPOINT_EVERY versiones se escribe un checkpoint para acotar la cadena.
+Los ids de versión son AUTO_INCREMENT y la base siempre es anterior, así que dentro de una
+cadena "más reciente" es MAX(version_id).
+
+Como una versión no cambia, su proyección anual (totales y headcount por proyecto, vector
+mensual) se calcula una vez por año y se guarda en Presupuesto_Version_Proyeccion; solo se
+recalcula si cambian los incrementos (firma distinta).
+"""
+import hashlib
+import json
+from datetime import date
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.utils import to_date
+from app.services.payroll_service_optimized import calculate_yearly_projections
+from app.services.projection_state import firma_incrementos
+
+TABLA = "BFinanciacion_Snapshot"
+PROYECCION_TABLA = "Presupuesto_Version_Proyeccion"
+
+# Columna del snapshot -> expresión sobre BFinanciacion BF
+COLUMNAS = {
+    "cedula": "BF.cedula",
+    "id_proyecto": "BF.id_proyecto",
+    "id_contrato": "BF.id_contrato",
+    "cod_proyecto": "BF.id_proyecto", # Usamos ID como Codigo por ahora
+    "cod_fuente": "BF.id_fuente",
+    "cod_componente": "BF.id_componente",
+    "cod_subcomponente": "BF.id_subcomponente",
+    "cod_rubro": "BF.rubro",
+    "cod_categoria": "BF.id_categoria",
+    "cod_responsable": "BF.id_responsable",
+    "posicion": "BF.posicion",
+    "valor_mensual": "BF.salario_base",
+    "salario_t": "BF.salario_t",
+    "pago_proyectado": "BF.pago_proyectado",
+    "fecha_inicio": "BF.fecha_inicio",
+    "fecha_fin": "BF.fecha_fin",
+}
+
+_COLS = ", ".join(COLUMNAS)
+_EXPRS = ", ".join(COLUMNAS.values())
+# Fila igual a la base (comparación NULL-safe columna a columna)
+_IGUAL = " AND ".join(f"b.{c} <=> {e}" for c, e in COLUMNAS.items())
+
+VERSIONES_SQL = "SELECT id, base_version_id, es_checkpoint FROM Presupuesto_Versiones"
+
+
+def resolver_cadena(versiones: Iterable[Any], version_id: int) -> List[int]:
+    """
+    Ids de la cadena [checkpoint, ..., version_id] a partir de las filas de Presupuesto_Versiones
+    (id, base_version_id, es_checkpoint). Lista vacía si la versión no existe.
+    """
+    por_id = {int(r["id"]): r for r in versiones}
+    cadena: List[int] = []
+    vid: Optional[int] = int(version_id)
+    while vid is not None and vid in por_id and vid not in cadena:
+        cadena.append(vid)
+        r = por_id[vid]
+        if r["es_checkpoint"] or r["base_version_id"] is None:
+            break
+        vid = int(r["base_version_id"])
+    return cadena[::-1]
+
+
+def cadena_version(conn, version_id: int) -> List[int]:
+    """Cadena de una versión con una conexión/sesión síncrona."""
+    return resolver_cadena(conn.execute(text(VERSIONES_SQL)).mappings().all(), version_id)
+
+
+async def cadena_version_async(db, version_id: int) -> List[int]:
+    """Cadena de una versión con una AsyncSession."""
+    return resolver_cadena((await db.execute(text(VERSIONES_SQL))).mappings().all(), version_id)
+
+
+def estado_sql(cadena: List[int]) -> str:
+    """
+    Subconsulta (para usar como tabla derivada) con el estado reconstruido de la versión
+    cuya cadena es `cadena`: mismas columnas que BFinanciacion_Snapshot, una fila por tramo.
+    """
+    # Los ids vienen de la BD (enteros): se incrustan para poder usar la subconsulta en
+    # cualquier consulta sin parámetros expandibles. Cadena vacía -> estado vacío.
+    ids = ", ".join(str(int(v)) for v in cadena) or "NULL"
+    return f"""(
+        SELECT s.* FROM {TABLA} s
+        JOIN (
+            SELECT original_id_financiacion AS k, MAX(version_id) AS v
+            FROM {TABLA}
+            WHERE version_id IN ({ids})
+            GROUP BY original_id_financiacion
+        ) ult ON ult.k = s.original_id_financiacion AND ult.v = s.version_id
+        WHERE s.op <> 'D'
+    )"""
+
+
+def crear_version(conn, nombre_version: str, descripcion: Optional[str], creado_por: Optional[str]) -> Dict[str, Any]:
+    """
+    Crea la versión y su contenido dentro de la transacción de `conn`: checkpoint si no hay
+    versión previa o la cadena de la previa alcanzó SNAPSHOT_CHECKPOINT_EVERY; si no, delta
+    contra la versión más reciente.
+    """
+    versiones = conn.execute(text(VERSIONES_SQL)).mappings().all()
+    previa = max((int(r["id"]) for r in versiones), default=None)
+    cadena_previa = resolver_cadena(versiones, previa) if previa is not None else []
+    checkpoint = not cadena_previa or len(cadena_previa) >= max(1, settings.SNAPSHOT_CHECKPOINT_EVERY)
+
+    result = conn.execute(text("""
+        INSERT INTO Presupuesto_Versiones (nombre_version, descripcion, creado_por, fecha_creacion, bloqueada, base_version_id, es_checkpoint)
+        VALUES (:nom, :desc, :user, NOW(), 1, :base, :chk)
+    """), {
+        "nom": nombre_version, "desc": descripcion, "user": creado_por or "admin",
+        "base": None if checkpoint else previa, "chk": 1 if checkpoint else 0,
+    })
+    version_id = result.lastrowid
+
+    if checkpoint:
+        copiados = conn.execute(text(f"""
+            INSERT INTO {TABLA} (version_id, original_id_financiacion, op, {_COLS})
+            SELECT :ver_id, BF.id_financiacion, 'A', {_EXPRS}
+            FROM BFinanciacion BF
+        """), {"ver_id": version_id}).rowcount
+        return {"version_id": version_id, "es_checkpoint": True, "base_version_id": None,
+                "tramos_copiados": copiados, "agregados": copiados, "modificados": 0, "eliminados": 0}
+
+    base = estado_sql(cadena_previa)
+    # Agregados y modificados: fila completa
+    cambios = conn.execute(text(f"""
+        INSERT INTO {TABLA} (version_id, original_id_financiacion, op, {_COLS})
+        SELECT :ver_id, BF.id_financiacion, IF(b.original_id_financiacion IS NULL, 'A', 'M'), {_EXPRS}
+        FROM BFinanciacion BF
+        LEFT JOIN {base} b ON b.original_id_financiacion = BF.id_financiacion
+        WHERE b.original_id_financiacion IS NULL OR NOT ({_IGUAL})
+    """), {"ver_id": version_id}).rowcount
+    agregados = conn.execute(text(f"SELECT COUNT(*) FROM {TABLA} WHERE version_id = :v AND op = 'A'"),
+                             {"v": version_id}).scalar() or 0
+    # Eliminados: lápidas
+    eliminados = conn.execute(text(f"""
+        INSERT INTO {TABLA} (version_id, original_id_financiacion, op)
+        SELECT :ver_id, b.original_id_financiacion, 'D'
+        FROM {base} b
+        LEFT JOIN BFinanciacion BF ON BF.id_financiacion = b.original_id_financiacion
+        WHERE BF.id_financiacion IS NULL
+    """), {"ver_id": version_id}).rowcount
+    total = conn.execute(text("SELECT COUNT(*) FROM BFinanciacion")).scalar() or 0
+    return {"version_id": version_id, "es_checkpoint": False, "base_version_id": previa,
+            "tramos_copiados": total, "agregados": agregados, "modificados": cambios - agregados,
+            "eliminados": eliminados}
+
+
+def eliminar_version(conn, version_id: int) -> int:
+    """
+    Borra una versión sin romper las que dependen de ella: su delta se funde en cada hija
+    (las filas que la hija no sobrescribe pasan a la hija). Si era checkpoint, la hija queda
+    como checkpoint. Retorna filas borradas de Presupuesto_Versiones.
+    """
+    v = conn.execute(text("SELECT id, base_version_id, es_checkpoint FROM Presupuesto_Versiones WHERE id = :vid"),
+                     {"vid": version_id}).mappings().first()
+    if not v:
+        return 0
+    hijas = conn.execute(text("SELECT id FROM Presupuesto_Versiones WHERE base_version_id = :vid"),
+                         {"vid": version_id}).scalars().all()
+    for hija in hijas:
+        conn.execute(text(f"""
+            INSERT INTO {TABLA} (version_id, original_id_financiacion, op, {_COLS})
+            SELECT :hija, s.original_id_financiacion, s.op, {", ".join("s." + c for c in COLUMNAS)}
+            FROM {TABLA} s
+            WHERE s.version_id = :vid
+              AND NOT EXISTS (
+                  SELECT 1 FROM {TABLA} h
+                  WHERE h.version_id = :hija AND h.original_id_financiacion = s.original_id_financiacion
+              )
+        """), {"hija": hija, "vid": version_id})
+        if v["es_checkpoint"] or v["base_version_id"] is None:
+            # La hija ya contiene el estado completo: las lápidas no tienen contra qué aplicar
+            conn.execute(text(f"DELETE FROM {TABLA} WHERE version_id = :hija AND op = 'D'"), {"hija": hija})
+            conn.execute(text("UPDATE Presupuesto_Versiones SET es_checkpoint = 1, base_version_id = NULL WHERE id = :hija"),
+                         {"hija": hija})
+        else:
+            conn.execute(text("UPDATE Presupuesto_Versiones SET base_version_id = :base WHERE id = :hija"),
+                         {"base": v["base_version_id"], "hija": hija})
+
+    conn.execute(text(f"DELETE FROM {PROYECCION_TABLA} WHERE version_id = :vid"), {"vid": version_id})
+    conn.execute(text(f"DELETE FROM {TABLA} WHERE version_id = :vid"), {"vid": version_id})
+    return conn.execute(text("DELETE FROM Presupuesto_Versiones WHERE id = :vid"), {"vid": version_id}).rowcount
+
+
+# --- Diferencias versión vs actual ---
+
+def en_rango(r: Any, y_start: date, y_end: date) -> bool:
+    """El tramo (fecha_inicio..fecha_fin) toca el rango."""
+    ini, fin = to_date(r.get("fecha_inicio")), to_date(r.get("fecha_fin"))
+    return bool(ini and fin and ini <= y_end and fin >= y_start)
+
+
+def diferencias(snap_rows: List[Any], live_rows: List[Any], live_ids: Iterable[Any], y_start: date, y_end: date,
+                proy_names: Mapping[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Tramos nuevos, eliminados y modificados (salario_t difiere en más de 1) en una sola
+    pasada de hash join. `snap_rows` son los tramos de la versión (todas las vigencias),
+    `live_rows` los tramos actuales del año y `live_ids` todos los ids actuales.
+    Nuevos y modificados se limitan a tramos actuales del año; eliminados, a tramos de la
+    versión del año. Mismo formato que las antiguas consultas NOT IN.
+    """
+    snap_por_id = {r["original_id_financiacion"]: r for r in snap_rows}
+    live_ids = set(live_ids)
+    nuevos, modificados = [], []
+
+    def _proyecto(r):
+        pid = r.get("id_proyecto")
+        return proy_names.get(pid) or pid
+
+    for b in live_rows:
+        fid = b["id_financiacion"]
+        if not en_rango(b, y_start, y_end):
+            continue
+        s = snap_por_id.get(fid)
+        if s is None:
+            nuevos.append({
+                "id_financiacion": fid, "cedula": b.get("cedula"), "id_proyecto": _proyecto(b),
+                "salario_t": b.get("salario_t"), "nombre": b.get("nombre"),
+            })
+        elif b.get("salario_t") is not None and s.get("salario_t") is not None \
+                and abs(float(b["salario_t"]) - float(s["salario_t"])) > 1:
+            modificados.append({
+                "id_financiacion": fid, "cedula": b.get("cedula"), "id_proyecto": _proyecto(b),
+                "valor_actual": b["salario_t"], "valor_base": s["salario_t"],
+                "diff": float(b["salario_t"]) - float(s["salario_t"]), "nombre": b.get("nombre"),
+            })
+
+    eliminados = [
+        {
+            "id_financiacion": fid, "cedula": s.get("cedula"), "id_proyecto": _proyecto(s),
+            "salario_t": s.get("salario_t"), "nombre": s.get("nombre"),
+        }
+        for fid, s in snap_por_id.items()
+        if fid not in live_ids and en_rango(s, y_start, y_end)
+    ]
+    return {"nuevos": nuevos, "eliminados": eliminados, "modificados": modificados}
+
+
+# --- Proyección guardada por versión y año ---
+
+# Filas de la versión que tocan el año, con los atributos de contrato/posición que usa el motor
+# de proyección. Son los datos de contrato vigentes al calcular: el snapshot no los guarda.
+FILAS_PROYECCION_SQL = """
+    SELECT s.*, c.atep, c.gerencia, c.estado, c.fecha_terminacion_real,
+           p.cargo, p.banda, p.familia, p.IDPosicion AS posicion_c,
+           p.Direccion, p.Planta,
+           CONCAT_WS(' ', d.p_nombre, d.p_apellido) as nombre_completo,
+           1 AS is_snapshot
+    FROM {snap} s
+    LEFT JOIN BContrato c ON s.id_contrato = c.id_contrato
+    LEFT JOIN BPosicion p ON c.posicion = p.IDPosicion
+    LEFT JOIN BData d ON s.cedula = d.cedula
+    WHERE s.fecha_inicio <= :y_end AND s.fecha_fin >= :y_start
+"""
+
+
+def _firma(incrementos: Mapping[int, Any]) -> str:
+    return hashlib.sha1(repr(firma_incrementos(incrementos)).encode()).hexdigest()
+
+
+def calcular_proyeccion(conn, cadena: List[int], anio: int, incrementos: Mapping[int, Any]) -> Dict[str, Any]:
+    """Proyección anual (calculate_yearly_projections) del estado reconstruido de la cadena."""
+    rows = conn.execute(text(FILAS_PROYECCION_SQL.format(snap=estado_sql(cadena))), {
+        "y_start": f"{anio}-01-01", "y_end": f"{anio}-12-31",
+    }).mappings().all()
+    return calculate_yearly_projections(rows, incrementos, anio)
+
+
+def proyeccion_version(version_id: int, anio: int, incrementos: Mapping[int, Any],
+                       versiones: Optional[Iterable[Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Proyección anual guardada de la versión; si no existe (o cambió la firma de incrementos)
+    se calcula y se guarda. None si la versión no existe. `versiones` (filas de VERSIONES_SQL)
+    evita releer Presupuesto_Versiones al evaluar varias versiones. Bloqueante.
+    """
+    firma = _firma(incrementos)
+    with engine.connect() as conn:
+        guardada = conn.execute(text(f"""
+            SELECT resultado FROM {PROYECCION_TABLA}
+            WHERE version_id = :v AND anio = :y AND firma_incrementos = :f
+        """), {"v": version_id, "y": anio, "f": firma}).scalar()
+        if guardada:
+            return json.loads(guardada)
+        cadena = resolver_cadena(versiones, version_id) if versiones is not None else cadena_version(conn, version_id)
+        if not cadena:
+            return None
+        proy = calcular_proyeccion(conn, cadena, anio, incrementos)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {PROYECCION_TABLA} (version_id, anio, firma_incrementos, total, headcount, resultado, fecha_calculo)
+            VALUES (:v, :y, :f, :total, :head, :res, NOW())
+            ON DUPLICATE KEY UPDATE firma_incrementos = VALUES(firma_incrementos), total = VALUES(total),
+                headcount = VALUES(headcount), resultado = VALUES(resultado), fecha_calculo = VALUES(fecha_calculo)
+        """), {
+            "v": version_id, "y": anio, "f": firma, "total": proy["total"], "head": proy["headcount"],
+            "res": json.dumps(proy, default=str, ensure_ascii=False),
+        })
+    return proy
@@ -0,0 +1,30 @@
+-- Proyección mensual materializada (app/services/proyeccion_mensual.py).
+-- La llena el materializador al arrancar la API; no requiere carga manual.
+CREATE TABLE IF NOT EXISTS `BProyeccion_Mensual` (
+  `id_financiacion` varchar(50) NOT NULL,
+  `anio_mes` date NOT NULL,
+  `cedula` varchar(20) DEFAULT NULL,
+  `id_contrato` varchar(50) DEFAULT NULL,
+  `id_proyecto` varchar(50) DEFAULT NULL,
+  `dias` tinyint NOT NULL,
+  `valor` bigint NOT NULL,
+  `salario_mes` bigint NOT NULL DEFAULT '0',
+  `aux_transporte` bigint NOT NULL DEFAULT '0',
+  `dotacion` bigint NOT NULL DEFAULT '0',
+  `primas` bigint NOT NULL DEFAULT '0',
+  `prima_vacaciones` bigint NOT NULL DEFAULT '0',
+  `sueldo_vacaciones` bigint NOT NULL DEFAULT '0',
+  `cesantias` bigint NOT NULL DEFAULT '0',
+  `i_cesantias` bigint NOT NULL DEFAULT '0',
+  `salud` bigint NOT NULL DEFAULT '0',
+  `pension` bigint NOT NULL DEFAULT '0',
+  `arl` bigint NOT NULL DEFAULT '0',
+  `ccf` bigint NOT NULL DEFAULT '0',
+  `sena` bigint NOT NULL DEFAULT '0',
+  `icbf` bigint NOT NULL DEFAULT '0',
+  `actualizado` datetime NOT NULL,
+  PRIMARY KEY (`id_financiacion`,`anio_mes`),
+  KEY `idx_proyeccion_mes_proyecto` (`anio_mes`,`id_proyecto`),
+  KEY `idx_proyeccion_cedula_mes` (`cedula`,`anio_mes`),
+  KEY `idx_proyeccion_contrato` (`id_contrato`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
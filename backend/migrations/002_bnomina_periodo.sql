@@ -0,0 +1,7 @@
+-- Filtros sargables sobre BNomina (app/api/v1/endpoints/nomina.py).
+-- Los filtros por mes usan la columna generada `periodo` ('YYYY-MM') y los filtros por año
+-- un rango semiabierto sobre fec_liq; ambos con índice propio.
+ALTER TABLE `BNomina`
+  ADD COLUMN `periodo` char(7) GENERATED ALWAYS AS (date_format(`fec_liq`,'%Y-%m')) STORED,
+  ADD KEY `idx_periodo` (`periodo`),
+  ADD KEY `idx_fec_liq` (`fec_liq`);
@@ -0,0 +1,66 @@
+-- Llaves de cruce normalizadas e indexadas (cédula y código de proyecto).
+-- Reemplazan los JOIN sobre TRIM(...) / REPLACE(...) en nomina.py y users.py, que impedían
+-- usar índices. La normalización es la de app/core/utils.py:
+--   normalizar_cedula:   sin puntos, guiones ni espacios ('1.020.304-5 ' -> '10203045')
+--   normalizar_proyecto: sin espacios; numéricos con ceros a 3 dígitos ('13' -> '013')
+--
+-- BNomina, BWhitelist y dim_proyectos las escribe la aplicación (nomina/upload, whitelist,
+-- sync_novasoft), que calcula la llave al insertar. BData se carga fuera de la API, así que
+-- su llave es una columna generada.
+
+-- BData: columna generada (la carga externa no tiene que conocerla)
+ALTER TABLE `BData`
+  ADD COLUMN `cedula_norm` varchar(20) GENERATED ALWAYS AS (upper(replace(replace(replace(replace(trim(`cedula`),'.',''),'-',''),' ',''),',',''))) STORED,
+  ADD KEY `idx_cedula_norm` (`cedula_norm`);
+
+-- BNomina
+ALTER TABLE `BNomina`
+  ADD COLUMN `cod_emp_norm` varchar(50) DEFAULT NULL,
+  ADD COLUMN `proyecto_norm` varchar(100) DEFAULT NULL,
+  ADD KEY `idx_cod_emp_norm` (`cod_emp_norm`,`periodo`),
+  ADD KEY `idx_proyecto_norm` (`proyecto_norm`);
+
+UPDATE `BNomina`
+SET `cod_emp_norm` = NULLIF(REGEXP_REPLACE(UPPER(TRIM(`cod_emp`)), '[^0-9A-Z]', ''), ''),
+    `proyecto_norm` = CASE
+        WHEN TRIM(`id_proyecto`) REGEXP '^[0-9]+$' AND CAST(TRIM(`id_proyecto`) AS UNSIGNED) > 999
+            THEN CAST(CAST(TRIM(`id_proyecto`) AS UNSIGNED) AS CHAR)
+        WHEN TRIM(`id_proyecto`) REGEXP '^[0-9]+$'
+            THEN LPAD(CAST(CAST(TRIM(`id_proyecto`) AS UNSIGNED) AS CHAR), 3, '0')
+        ELSE NULLIF(TRIM(`id_proyecto`), '')
+    END;
+
+-- BWhitelist
+ALTER TABLE `BWhitelist`
+  ADD COLUMN `cedula_norm` varchar(20) DEFAULT NULL,
+  ADD KEY `idx_cedula_norm` (`cedula_norm`);
+
+UPDATE `BWhitelist`
+SET `cedula_norm` = NULLIF(REGEXP_REPLACE(UPPER(TRIM(`cedula`)), '[^0-9A-Z]', ''), '');
+
+-- Catálogos de proyectos
+ALTER TABLE `dim_proyectos`
+  ADD COLUMN `codigo_norm` varchar(50) DEFAULT NULL,
+  ADD KEY `idx_codigo_norm` (`codigo_norm`);
+
+ALTER TABLE `dim_proyectos_otros`
+  ADD COLUMN `codigo_norm` varchar(50) DEFAULT NULL,
+  ADD KEY `idx_codigo_norm` (`codigo_norm`);
+
+UPDATE `dim_proyectos`
+SET `codigo_norm` = CASE
+    WHEN TRIM(`codigo`) REGEXP '^[0-9]+$' AND CAST(TRIM(`codigo`) AS UNSIGNED) > 999
+        THEN CAST(CAST(TRIM(`codigo`) AS UNSIGNED) AS CHAR)
+    WHEN TRIM(`codigo`) REGEXP '^[0-9]+$'
+        THEN LPAD(CAST(CAST(TRIM(`codigo`) AS UNSIGNED) AS CHAR), 3, '0')
+    ELSE NULLIF(TRIM(`codigo`), '')
+END;
+
+UPDATE `dim_proyectos_otros`
+SET `codigo_norm` = CASE
+    WHEN TRIM(`codigo`) REGEXP '^[0-9]+$' AND CAST(TRIM(`codigo`) AS UNSIGNED) > 999
+        THEN CAST(CAST(TRIM(`codigo`) AS UNSIGNED) AS CHAR)
+    WHEN TRIM(`codigo`) REGEXP '^[0-9]+$'
+        THEN LPAD(CAST(CAST(TRIM(`codigo`) AS UNSIGNED) AS CHAR), 3, '0')
+    ELSE NULLIF(TRIM(`codigo`), '')
+END;
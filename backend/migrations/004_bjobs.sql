@@ -0,0 +1,19 @@
+-- Trabajos en segundo plano (app/services/jobs.py): snapshots, cargas de nómina y sincronizaciones.
+CREATE TABLE IF NOT EXISTS `BJobs` (
+  `id` char(32) NOT NULL,
+  `tipo` varchar(50) NOT NULL,
+  `estado` varchar(20) NOT NULL DEFAULT 'PENDIENTE',
+  `parametros` json DEFAULT NULL,
+  `progreso` decimal(5,1) NOT NULL DEFAULT '0.0',
+  `mensaje` varchar(500) DEFAULT NULL,
+  `resultado` json DEFAULT NULL,
+  `error` text,
+  `intentos` int NOT NULL DEFAULT '1',
+  `creado_por` varchar(150) DEFAULT NULL,
+  `fecha_creacion` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `fecha_inicio` datetime DEFAULT NULL,
+  `fecha_fin` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_estado_fecha` (`estado`,`fecha_creacion`),
+  KEY `idx_tipo_fecha` (`tipo`,`fecha_creacion`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
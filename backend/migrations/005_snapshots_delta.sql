@@ -0,0 +1,11 @@
+-- Snapshots de presupuesto como deltas (app/services/snapshots.py).
+-- Las versiones existentes son copias completas: quedan como checkpoints (es_checkpoint = 1)
+-- y sus filas como 'A'. Las nuevas versiones guardan solo los cambios contra la anterior.
+ALTER TABLE `Presupuesto_Versiones`
+  ADD COLUMN `base_version_id` int DEFAULT NULL,
+  ADD COLUMN `es_checkpoint` tinyint(1) NOT NULL DEFAULT '1',
+  ADD KEY `idx_base_version` (`base_version_id`);
+
+ALTER TABLE `BFinanciacion_Snapshot`
+  ADD COLUMN `op` char(1) NOT NULL DEFAULT 'A' AFTER `original_id_financiacion`,
+  ADD KEY `idx_version_original` (`version_id`,`original_id_financiacion`);
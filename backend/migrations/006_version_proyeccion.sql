@@ -0,0 +1,13 @@
+-- Proyección anual guardada por versión congelada (app/services/snapshots.py).
+-- Se llena sola: al crear la versión (año en curso) y en la primera comparación de cada año.
+CREATE TABLE IF NOT EXISTS `Presupuesto_Version_Proyeccion` (
+  `version_id` int NOT NULL,
+  `anio` int NOT NULL,
+  `firma_incrementos` char(40) NOT NULL,
+  `total` decimal(20,2) NOT NULL DEFAULT '0.00',
+  `headcount` int NOT NULL DEFAULT '0',
+  `resultado` longtext NOT NULL,
+  `fecha_calculo` datetime NOT NULL,
+  PRIMARY KEY (`version_id`,`anio`),
+  CONSTRAINT `Presupuesto_Version_Proyeccion_ibfk_1` FOREIGN KEY (`version_id`) REFERENCES `Presupuesto_Versiones` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
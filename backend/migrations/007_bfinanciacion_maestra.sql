@@ -0,0 +1,5 @@
+-- Tabla maestra de financiación (admin_maestra.get_maestra_financiacion): paginación keyset
+-- sobre (fecha_modificacion, id_financiacion) y filtro por prefijo de proyecto.
+ALTER TABLE `BFinanciacion`
+  ADD KEY `idx_fecha_modificacion` (`fecha_modificacion`,`id_financiacion`),
+  ADD KEY `idx_id_proyecto` (`id_proyecto`);
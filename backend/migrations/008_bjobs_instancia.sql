@@ -0,0 +1,7 @@
+-- BJobs con varias instancias de Cloud Run (app/services/jobs.py): instancia dueña, latido
+-- que esa instancia renueva y cancelación pedida desde cualquier instancia.
+ALTER TABLE `BJobs`
+  ADD COLUMN `instancia` varchar(80) DEFAULT NULL,
+  ADD COLUMN `latido` datetime DEFAULT NULL,
+  ADD COLUMN `cancelar` tinyint(1) NOT NULL DEFAULT '0',
+  ADD KEY `idx_instancia_estado` (`instancia`,`estado`);
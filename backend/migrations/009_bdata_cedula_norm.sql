@@ -0,0 +1,6 @@
+-- BData.cedula_norm con la misma regla que normalizar_cedula (app/core/utils.py): solo letras
+-- y dígitos. La versión de 003 solo quitaba '.', '-', ' ' y ',', así que cédulas con otros
+-- separadores ('/', '_', tabuladores...) no cruzaban con BNomina.cod_emp_norm ni BWhitelist.
+-- Para bases que ya aplicaron 003; la columna es STORED, así que se recalcula al alterarla.
+ALTER TABLE `BData`
+  MODIFY COLUMN `cedula_norm` varchar(20) GENERATED ALWAYS AS (nullif(upper(regexp_replace(`cedula`,'[^0-9A-Za-z]','')),'')) STORED;
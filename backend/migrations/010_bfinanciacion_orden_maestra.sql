@@ -0,0 +1,6 @@
+-- Orden de la tabla maestra por salario (admin_maestra.MAESTRA_ORDEN): cada columna ordenable
+-- necesita un índice (col, id_financiacion) para que el keyset lea un rango sin filesort.
+-- cedula e id_proyecto ya lo tienen implícito (InnoDB agrega la PK a los índices secundarios).
+ALTER TABLE `BFinanciacion`
+  ADD KEY `idx_salario_base` (`salario_base`,`id_financiacion`),
+  ADD KEY `idx_pago_proyectado` (`pago_proyectado`,`id_financiacion`);
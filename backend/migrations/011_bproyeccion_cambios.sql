@@ -0,0 +1,10 @@
+-- Bitácora de tramos refrescados incrementalmente en BProyeccion_Mensual (proyeccion_mensual.py).
+-- La reconstrucción completa re-aplica sobre su tabla de staging los ids anotados mientras
+-- corría, incluidos los tramos eliminados (que ya no tienen filas que los delaten), y purga
+-- lo anterior a su inicio.
+CREATE TABLE IF NOT EXISTS `BProyeccion_Cambios` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `id_financiacion` varchar(50) NOT NULL,
+  `creado` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -0,0 +1,6 @@
+-- BContrato.cedula_norm: cruce directo BNomina.cod_emp_norm -> contrato (nomina.py, resumen
+-- anual: distribución por Dirección y detalle), sin pasar por BData. Misma regla que
+-- normalizar_cedula y BData.cedula_norm (009): solo letras y dígitos, en mayúscula.
+ALTER TABLE `BContrato`
+  ADD COLUMN `cedula_norm` varchar(20) GENERATED ALWAYS AS (nullif(upper(regexp_replace(`cedula`,'[^0-9A-Za-z]','')),'')) STORED,
+  ADD KEY `idx_cedula_norm` (`cedula_norm`);
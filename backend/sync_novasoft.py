@@ -5,6 +5,8 @@ from urllib.parse import quote_plus
 import logging
 import os
 import traceback
+from sqlalchemy import text
+from app.core.utils import normalizar_proyecto
 
 # 1. CARGAR CONFIGURACIÓN DESDE ENV.YAML
 def load_env():
@@ -76,6 +78,9 @@ def format_id3(val):
     s = str(val).strip()
     return s.zfill(3) if s.isdigit() and len(s) <= 3 else s
 
+# Catálogos de proyectos con llave normalizada (codigo_norm) para los cruces con BNomina
+TABLAS_PROYECTOS = ('dim_proyectos', 'dim_proyectos_otros')
+
 def sync_table(table_erp, table_cloud, erp_engine, cloud_engine):
     """Lógica para subir solo registros nuevos basados en el código"""
     print(f"--- 🔄 Procesando tabla: {table_cloud} ---")
@@ -121,16 +126,42 @@ def sync_table(table_erp, table_cloud, erp_engine, cloud_engine):
         # D. Cargar solo el diferencial
         if not df_new.empty:
             # Solo enviamos las columnas 'codigo' y 'nombre' para mantener consistencia
-            df_new[['codigo', 'nombre']].to_sql(table_cloud, cloud_engine, if_exists='append', index=False)
+            cols = ['codigo', 'nombre']
+            if table_cloud in TABLAS_PROYECTOS:
+                df_new = df_new.assign(codigo_norm=df_new['codigo'].apply(normalizar_proyecto))
+                cols.append('codigo_norm')
+            df_new[cols].to_sql(table_cloud, cloud_engine, if_exists='append', index=False)
             print(f"✅ Éxito: Se agregaron {len(df_new)} registros nuevos.")
         else:
             print(f"ℹ️ Al día: No hay códigos nuevos para agregar.")
+        return len(df_new)
 
     except Exception as e:
         print(f"❌ Error procesando {table_cloud}: {e}")
         traceback.print_exc()
+        return f"error: {e}"
+
+def completar_codigos_norm(cloud_engine):
+    """Calcula codigo_norm de los proyectos cargados por fuera del sync (p.ej. dim_proyectos_otros a mano)"""
+    for tabla in TABLAS_PROYECTOS:
+        try:
+            with cloud_engine.begin() as conn:
+                codigos = [r[0] for r in conn.execute(text(f"SELECT codigo FROM {tabla} WHERE codigo_norm IS NULL"))]
+                for codigo in codigos:
+                    conn.execute(
+                        text(f"UPDATE {tabla} SET codigo_norm = :norm WHERE codigo = :codigo"),
+                        {"norm": normalizar_proyecto(codigo), "codigo": codigo}
+                    )
+            if codigos:
+                print(f"✅ {tabla}: codigo_norm calculado para {len(codigos)} registros.")
+        except Exception as e:
+            print(f"❌ Error normalizando {tabla}: {e}")
 
-def run_sync():
+def run_sync(progreso=None):
+    """
+    Sincroniza los catálogos. `progreso(porcentaje, mensaje)` es opcional (trabajo
+    "sync_novasoft" en app/services/jobs.py). Retorna {tabla: registros nuevos o error}.
+    """
     # Motores de base de datos
     import pyodbc
     drivers = pyodbc.drivers()
@@ -156,10 +187,25 @@ def run_sync():
     
     print("🚀 Iniciando proceso de sincronización integral...")
     
-    for erp_tab, cloud_tab in TABLAS_A_SINCRONIZAR.items():
-        sync_table(erp_tab, cloud_tab, erp_engine, cloud_engine)
+    resumen = {}
+    for i, (erp_tab, cloud_tab) in enumerate(TABLAS_A_SINCRONIZAR.items()):
+        if progreso:
+            progreso(i / len(TABLAS_A_SINCRONIZAR) * 100, f"Procesando {cloud_tab}")
+        resumen[cloud_tab] = sync_table(erp_tab, cloud_tab, erp_engine, cloud_engine)
+
+    completar_codigos_norm(cloud_engine)
     
+    # Catálogos dim_* y BIncremento pudieron cambiar: invalidar la caché de referencia.
+    # Solo tiene efecto si run_sync se ejecuta dentro del proceso de la API; corriendo
+    # como script, el API lo refleja al vencer REFERENCE_CACHE_TTL_SECONDS.
+    try:
+        from app.services.reference_data import invalidate_reference_data
+        invalidate_reference_data()
+    except ImportError:
+        pass
+
     print("\n🏁 Proceso finalizado.")
+    return resumen
 
 if __name__ == "__main__":
     run_sync()
@@ -34,6 +34,7 @@ def sync_posicion_states():
         print(f"Posiciones actualizadas a 'Vacante': {res_vacante.rowcount}")
         
         print("Sincronización completada.")
+    return {"activas": res_activo.rowcount, "vacantes": res_vacante.rowcount}
 
 if __name__ == "__main__":
     sync_posicion_states()
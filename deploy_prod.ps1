@@ -25,6 +25,9 @@ if (-not $envMap.ContainsKey("CORS_ORIGINS_RAW") -and $envMap.ContainsKey("CORS_
 if (-not $envMap.ContainsKey("ALLOW_LOCAL_DEBUG_BYPASS")) {
   $envMap["ALLOW_LOCAL_DEBUG_BYPASS"] = "false"
 }
+if (-not $envMap.ContainsKey("AUDIT_SPILL_FILE")) {
+  $envMap["AUDIT_SPILL_FILE"] = ""
+}
 
 $requiredVars = @(
   "DB_USER","DB_PASS","DB_NAME","CLOUDSQL_CONNECTION_NAME",
@@ -59,7 +62,8 @@ $yamlLines = @(
   "ALLOWED_DOMAIN: `"$([Escape-Yaml $envMap['ALLOWED_DOMAIN'])`"",
   "CORS_ORIGINS_RAW: `"$([Escape-Yaml $envMap['CORS_ORIGINS_RAW'])`"",
   "AUDIENCE: `"$([Escape-Yaml $envMap['AUDIENCE'])`"",
-  "ALLOW_LOCAL_DEBUG_BYPASS: `"$([Escape-Yaml $envMap['ALLOW_LOCAL_DEBUG_BYPASS'])`""
+  "ALLOW_LOCAL_DEBUG_BYPASS: `"$([Escape-Yaml $envMap['ALLOW_LOCAL_DEBUG_BYPASS'])`"",
+  "AUDIT_SPILL_FILE: `"$([Escape-Yaml $envMap['AUDIT_SPILL_FILE'])`""
 )
 $yamlLines | Set-Content -Path $tmpEnvFile -Encoding UTF8
 
@@ -78,7 +82,7 @@ try {
     --add-cloudsql-instances "bosque-485105:southamerica-east1:bosquebd" `
     --env-vars-file $tmpEnvFile `
     --project bosque-485105 `
-    --memory 2Gi --cpu 1 --cpu-boost --timeout 300
+    --memory 2Gi --cpu 1 --cpu-boost --no-cpu-throttling --timeout 300
 
   # 3. Actualizar el JOB de Sincronización (bosque)
   Write-Host "Actualizando Job bosque..."
@@ -60,6 +60,7 @@ ALLOWED_DOMAIN: "$(yaml_escape "$ALLOWED_DOMAIN")"
 CORS_ORIGINS_RAW: "$(yaml_escape "$CORS_ORIGINS_RAW")"
 AUDIENCE: "$(yaml_escape "$AUDIENCE")"
 ALLOW_LOCAL_DEBUG_BYPASS: "${ALLOW_LOCAL_DEBUG_BYPASS:-false}"
+AUDIT_SPILL_FILE: "$(yaml_escape "${AUDIT_SPILL_FILE:-}")"
 EOF
 
 # 1. Generar Tag único y construir la imagen
@@ -87,6 +88,7 @@ gcloud run deploy bosque-api \
     --memory 2Gi \
     --cpu 1 \
     --cpu-boost \
+    --no-cpu-throttling \
     --timeout 300
 
 # 3. Actualizar el JOB de Sincronización (bosque)
@@ -92,8 +92,10 @@ CREATE TABLE `BContrato` (
   `causal_retiro` varchar(255) DEFAULT NULL,
   `usuario` varchar(100) DEFAULT NULL,
   `modificacion` datetime DEFAULT NULL,
+  `cedula_norm` varchar(20) GENERATED ALWAYS AS (nullif(upper(regexp_replace(`cedula`,_utf8mb4'[^0-9A-Za-z]',_utf8mb4'')),_utf8mb4'')) STORED,
   PRIMARY KEY (`id_contrato`),
   KEY `cedula` (`cedula`),
+  KEY `idx_cedula_norm` (`cedula_norm`),
   KEY `fk_contrato_posicion` (`posicion`),
   CONSTRAINT `BContrato_ibfk_1` FOREIGN KEY (`cedula`) REFERENCES `BData` (`cedula`),
   CONSTRAINT `fk_contrato_posicion` FOREIGN KEY (`posicion`) REFERENCES `BPosicion` (`IDPosicion`)
@@ -126,7 +128,9 @@ CREATE TABLE `BData` (
   `ciudad` varchar(100) DEFAULT NULL,
   `usuario` varchar(100) DEFAULT NULL,
   `modificacion` datetime DEFAULT NULL,
-  PRIMARY KEY (`cedula`)
+  `cedula_norm` varchar(20) GENERATED ALWAYS AS (nullif(upper(regexp_replace(`cedula`,_utf8mb4'[^0-9A-Za-z]',_utf8mb4'')),_utf8mb4'')) STORED,
+  PRIMARY KEY (`cedula`),
+  KEY `idx_cedula_norm` (`cedula_norm`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -160,6 +164,10 @@ CREATE TABLE `BFinanciacion` (
   PRIMARY KEY (`id_financiacion`),
   KEY `cedula` (`cedula`),
   KEY `id_contrato` (`id_contrato`),
+  KEY `idx_fecha_modificacion` (`fecha_modificacion`,`id_financiacion`),
+  KEY `idx_id_proyecto` (`id_proyecto`),
+  KEY `idx_salario_base` (`salario_base`,`id_financiacion`),
+  KEY `idx_pago_proyectado` (`pago_proyectado`,`id_financiacion`),
   CONSTRAINT `BFinanciacion_ibfk_1` FOREIGN KEY (`cedula`) REFERENCES `BData` (`cedula`),
   CONSTRAINT `BFinanciacion_ibfk_2` FOREIGN KEY (`id_contrato`) REFERENCES `BContrato` (`id_contrato`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -176,6 +184,7 @@ CREATE TABLE `BFinanciacion_Snapshot` (
   `snapshot_id` bigint NOT NULL AUTO_INCREMENT,
   `version_id` int NOT NULL,
   `original_id_financiacion` varchar(50) DEFAULT NULL,
+  `op` char(1) NOT NULL DEFAULT 'A',
   `cedula` varchar(20) DEFAULT NULL,
   `id_proyecto` varchar(50) DEFAULT NULL,
   `id_contrato` varchar(50) DEFAULT NULL,
@@ -194,6 +203,7 @@ CREATE TABLE `BFinanciacion_Snapshot` (
   `fecha_fin` date DEFAULT NULL,
   PRIMARY KEY (`snapshot_id`),
   KEY `IDX_Snapshot_Version` (`version_id`),
+  KEY `idx_version_original` (`version_id`,`original_id_financiacion`),
   CONSTRAINT `BFinanciacion_Snapshot_ibfk_1` FOREIGN KEY (`version_id`) REFERENCES `Presupuesto_Versiones` (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=10236 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -217,6 +227,37 @@ CREATE TABLE `BIncremento` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `BJobs`
+--
+
+DROP TABLE IF EXISTS `BJobs`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `BJobs` (
+  `id` char(32) NOT NULL,
+  `tipo` varchar(50) NOT NULL,
+  `estado` varchar(20) NOT NULL DEFAULT 'PENDIENTE',
+  `parametros` json DEFAULT NULL,
+  `progreso` decimal(5,1) NOT NULL DEFAULT '0.0',
+  `mensaje` varchar(500) DEFAULT NULL,
+  `resultado` json DEFAULT NULL,
+  `error` text,
+  `intentos` int NOT NULL DEFAULT '1',
+  `creado_por` varchar(150) DEFAULT NULL,
+  `fecha_creacion` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `fecha_inicio` datetime DEFAULT NULL,
+  `fecha_fin` datetime DEFAULT NULL,
+  `instancia` varchar(80) DEFAULT NULL,
+  `latido` datetime DEFAULT NULL,
+  `cancelar` tinyint(1) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`id`),
+  KEY `idx_estado_fecha` (`estado`,`fecha_creacion`),
+  KEY `idx_tipo_fecha` (`tipo`,`fecha_creacion`),
+  KEY `idx_instancia_estado` (`instancia`,`estado`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `BNomina`
 --
@@ -246,9 +287,16 @@ CREATE TABLE `BNomina` (
   `id_categoria` varchar(100) DEFAULT NULL,
   `id_responsable` varchar(100) DEFAULT NULL,
   `fecha_carga` datetime DEFAULT CURRENT_TIMESTAMP,
+  `periodo` char(7) GENERATED ALWAYS AS (date_format(`fec_liq`,_utf8mb4'%Y-%m')) STORED,
+  `cod_emp_norm` varchar(50) DEFAULT NULL,
+  `proyecto_norm` varchar(100) DEFAULT NULL,
   PRIMARY KEY (`id`),
   KEY `idx_ced_fec` (`cod_emp`,`fec_liq`),
-  KEY `idx_granularity` (`cod_emp`,`fec_liq`,`id_proyecto`,`id_fuente`,`id_componente`)
+  KEY `idx_granularity` (`cod_emp`,`fec_liq`,`id_proyecto`,`id_fuente`,`id_componente`),
+  KEY `idx_periodo` (`periodo`),
+  KEY `idx_fec_liq` (`fec_liq`),
+  KEY `idx_cod_emp_norm` (`cod_emp_norm`,`periodo`),
+  KEY `idx_proyecto_norm` (`proyecto_norm`)
 ) ENGINE=InnoDB AUTO_INCREMENT=8950 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -301,6 +349,58 @@ CREATE TABLE `BPosicion` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `BProyeccion_Mensual`
+--
+
+DROP TABLE IF EXISTS `BProyeccion_Mensual`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `BProyeccion_Mensual` (
+  `id_financiacion` varchar(50) NOT NULL,
+  `anio_mes` date NOT NULL,
+  `cedula` varchar(20) DEFAULT NULL,
+  `id_contrato` varchar(50) DEFAULT NULL,
+  `id_proyecto` varchar(50) DEFAULT NULL,
+  `dias` tinyint NOT NULL,
+  `valor` bigint NOT NULL,
+  `salario_mes` bigint NOT NULL DEFAULT '0',
+  `aux_transporte` bigint NOT NULL DEFAULT '0',
+  `dotacion` bigint NOT NULL DEFAULT '0',
+  `primas` bigint NOT NULL DEFAULT '0',
+  `prima_vacaciones` bigint NOT NULL DEFAULT '0',
+  `sueldo_vacaciones` bigint NOT NULL DEFAULT '0',
+  `cesantias` bigint NOT NULL DEFAULT '0',
+  `i_cesantias` bigint NOT NULL DEFAULT '0',
+  `salud` bigint NOT NULL DEFAULT '0',
+  `pension` bigint NOT NULL DEFAULT '0',
+  `arl` bigint NOT NULL DEFAULT '0',
+  `ccf` bigint NOT NULL DEFAULT '0',
+  `sena` bigint NOT NULL DEFAULT '0',
+  `icbf` bigint NOT NULL DEFAULT '0',
+  `actualizado` datetime NOT NULL,
+  PRIMARY KEY (`id_financiacion`,`anio_mes`),
+  KEY `idx_proyeccion_mes_proyecto` (`anio_mes`,`id_proyecto`),
+  KEY `idx_proyeccion_cedula_mes` (`cedula`,`anio_mes`),
+  KEY `idx_proyeccion_contrato` (`id_contrato`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `BProyeccion_Cambios`
+--
+
+DROP TABLE IF EXISTS `BProyeccion_Cambios`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `BProyeccion_Cambios` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `id_financiacion` varchar(50) NOT NULL,
+  `creado` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `BSolicitud_Cambio`
 --
@@ -338,7 +438,9 @@ CREATE TABLE `BWhitelist` (
   `role` varchar(50) DEFAULT 'admin',
   `created_at` datetime DEFAULT CURRENT_TIMESTAMP,
   `cedula` varchar(20) DEFAULT NULL,
-  PRIMARY KEY (`email`)
+  `cedula_norm` varchar(20) DEFAULT NULL,
+  PRIMARY KEY (`email`),
+  KEY `idx_cedula_norm` (`cedula_norm`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -356,10 +458,33 @@ CREATE TABLE `Presupuesto_Versiones` (
   `creado_por` varchar(100) DEFAULT NULL,
   `descripcion` varchar(500) DEFAULT NULL,
   `bloqueada` tinyint(1) DEFAULT '1',
-  PRIMARY KEY (`id`)
+  `base_version_id` int DEFAULT NULL,
+  `es_checkpoint` tinyint(1) NOT NULL DEFAULT '1',
+  PRIMARY KEY (`id`),
+  KEY `idx_base_version` (`base_version_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=9 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `Presupuesto_Version_Proyeccion`
+--
+
+DROP TABLE IF EXISTS `Presupuesto_Version_Proyeccion`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Presupuesto_Version_Proyeccion` (
+  `version_id` int NOT NULL,
+  `anio` int NOT NULL,
+  `firma_incrementos` char(40) NOT NULL,
+  `total` decimal(20,2) NOT NULL DEFAULT '0.00',
+  `headcount` int NOT NULL DEFAULT '0',
+  `resultado` longtext NOT NULL,
+  `fecha_calculo` datetime NOT NULL,
+  PRIMARY KEY (`version_id`,`anio`),
+  CONSTRAINT `Presupuesto_Version_Proyeccion_ibfk_1` FOREIGN KEY (`version_id`) REFERENCES `Presupuesto_Versiones` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `dim_categorias`
 --
@@ -412,7 +537,9 @@ DROP TABLE IF EXISTS `dim_proyectos`;
 CREATE TABLE `dim_proyectos` (
   `codigo` text,
   `nombre` text,
-  `estado` text
+  `estado` text,
+  `codigo_norm` varchar(50) DEFAULT NULL,
+  KEY `idx_codigo_norm` (`codigo_norm`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -427,7 +554,9 @@ CREATE TABLE `dim_proyectos_otros` (
   `codigo` varchar(50) NOT NULL,
   `nombre` varchar(255) DEFAULT NULL,
   `estado` varchar(50) DEFAULT NULL,
-  PRIMARY KEY (`codigo`)
+  `codigo_norm` varchar(50) DEFAULT NULL,
+  PRIMARY KEY (`codigo`),
+  KEY `idx_codigo_norm` (`codigo_norm`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -188,15 +188,28 @@ window.navigateToConsulta = (cedula) => {
     }
 };
 
+const NOTIF_BASE_URL = (window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1')
+    ? 'http://localhost:8000/api/v1'
+    : 'https://bosque-api-516412770014.southamerica-east1.run.app/api/v1';
+
+let notifUnread = 0;
+let notifStreamActive = false;
+
+const setNotifBadge = (unread) => {
+    notifUnread = Math.max(0, unread);
+    const badge = document.getElementById('notif-badge');
+    if (badge) {
+        badge.textContent = notifUnread;
+        badge.classList.toggle('hidden', notifUnread === 0);
+    }
+};
+
 const checkNotifications = async () => {
     if (!auth.isAuthenticated()) return;
     try {
         // Use a direct fetch to avoid the global api.js 401 -> logout -> reload chain
-        // during background polling.
-        const isLocal = window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1';
-        const baseUrl = isLocal ? 'http://localhost:8000/api/v1' : 'https://bosque-api-516412770014.southamerica-east1.run.app/api/v1';
-
-        const res = await fetch(`${baseUrl}/employees/me/notifications`, {
+        // during background checks.
+        const res = await fetch(`${NOTIF_BASE_URL}/employees/me/notifications`, {
             headers: { 'Authorization': `Bearer ${auth._token}` }
         });
 
@@ -209,18 +222,77 @@ const checkNotifications = async () => {
         const notifs = await res.json();
         if (!Array.isArray(notifs)) return;
 
-        const unread = notifs.filter(n => !n.leido).length;
-        const badge = document.getElementById('notif-badge');
-        if (badge) {
-            badge.textContent = unread;
-            badge.classList.toggle('hidden', unread === 0);
-        }
+        setNotifBadge(notifs.filter(n => !n.leido).length);
     } catch (e) {
-        // Background polling errors should never affect the UI state or trigger reloads
+        // Background errors should never affect the UI state or trigger reloads
         console.warn("Background notification check failed (silent)");
     }
 };
 
+const handleNotificationEvent = (block) => {
+    let event = 'message';
+    let data = '';
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+    });
+    if (!data) return; // keep-alive comments
+    const payload = JSON.parse(data);
+    if (event === 'estado') {
+        setNotifBadge(payload.no_leidas || 0);
+    } else if (event === 'notificacion') {
+        setNotifBadge(notifUnread + 1);
+        ui.showToast(payload.mensaje, payload.tipo === 'SUCCESS' ? 'success' : (payload.tipo === 'ERROR' ? 'error' : 'info'));
+    }
+};
+
+// Live notifications over SSE. Read with fetch because EventSource cannot send the
+// Authorization header. The server closes the stream periodically; reconnect (backoff on errors).
+const startNotificationStream = async () => {
+    if (notifStreamActive || !auth.isAuthenticated()) return;
+    if (!window.ReadableStream || !window.TextDecoder) {
+        checkNotifications();
+        return;
+    }
+    notifStreamActive = true;
+    let delay = 5000;
+    while (auth.isAuthenticated()) {
+        let wait = 1000;
+        try {
+            const res = await fetch(`${NOTIF_BASE_URL}/employees/me/notifications/stream`, {
+                headers: { 'Authorization': `Bearer ${auth._token}` },
+                cache: 'no-store'
+            });
+            if (res.status === 401) {
+                auth.handleSessionExpired('Tu sesión expiró por tiempo de seguridad. Inicia sesión nuevamente.');
+                break;
+            }
+            if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+            delay = 5000;
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true }).replace(/\r/g, '');
+                let idx;
+                while ((idx = buffer.indexOf('\n\n')) >= 0) {
+                    try { handleNotificationEvent(buffer.slice(0, idx)); } catch (_) { /* malformed event */ }
+                    buffer = buffer.slice(idx + 2);
+                }
+            }
+        } catch (e) {
+            console.warn("Notification stream interrupted, reconnecting (silent)");
+            wait = delay;
+            delay = Math.min(delay * 2, 60000);
+        }
+        await new Promise(resolve => setTimeout(resolve, wait));
+    }
+    notifStreamActive = false;
+};
+
 const showNotificationsModal = async () => {
     try {
         const esc = (value) => String(value ?? '')
@@ -303,11 +375,12 @@ const init = () => {
     // Initial Date & Auth
     auth.initGoogleAuth();
 
-    // Check notifications once and start polling
-    // Wait a bit to ensure session is initialized
+    // Open the live notification stream (it sends the unread count on connect).
+    // Wait a bit to ensure session is initialized; the interval only (re)starts the
+    // stream after a later login or a session-expired stop, it makes no requests otherwise.
     setTimeout(() => {
-        checkNotifications();
-        setInterval(checkNotifications, 60000);
+        startNotificationStream();
+        setInterval(startNotificationStream, 60000);
     }, 2000);
 
     const dateEl = document.getElementById('hero-date');
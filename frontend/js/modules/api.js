@@ -113,5 +113,21 @@ export const api = {
                 }
             }
         }
+    },
+
+    /**
+     * Espera un trabajo en segundo plano (/admin/jobs/{id}) hasta que termine.
+     * onProgress(job) se llama en cada consulta. Resuelve con job.resultado o lanza el error del trabajo.
+     */
+    async waitJob(jobId, onProgress, intervalMs = 1000) {
+        while (true) {
+            const job = await this.get(`/admin/jobs/${jobId}`, true);
+            if (onProgress) onProgress(job);
+            if (job.estado === 'COMPLETADO') return job.resultado || {};
+            if (job.estado === 'ERROR' || job.estado === 'CANCELADO') {
+                throw new Error(job.mensaje || `Trabajo ${job.estado.toLowerCase()}`);
+            }
+            await new Promise(r => setTimeout(r, intervalMs));
+        }
     }
 };
@@ -329,7 +329,11 @@ export const controlPresupuestal = {
             btn.innerHTML = "⏳ Procesando..."; btn.disabled = true;
 
             try {
-                const res = await api.post('/admin/presupuesto/congelar', { nombre_version: name, descripcion: desc });
+                const job = await api.post('/admin/presupuesto/congelar', { nombre_version: name, descripcion: desc }, true);
+                // El snapshot corre en segundo plano: esperamos el trabajo
+                const res = await api.waitJob(job.job_id, (j) => {
+                    btn.innerHTML = `⏳ ${j.mensaje || 'Procesando...'}`;
+                });
                 if (res.version_id) {
                     ui.showToast(`✅ Snapshot creado: ${res.tramos_copiados} registros`);
                     close();
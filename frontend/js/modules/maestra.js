@@ -222,55 +222,91 @@ export const maestra = {
             this.table = null;
         }
 
-        try {
-            ui.showLoading("Cargando base maestra...");
-            const data = await api.get('/admin/maestra/financiacion');
-            ui.hideLoading();
+        // Paginación keyset del servidor: cada página trae el cursor de la siguiente.
+        // Tabulator pide páginas 1..n al hacer scroll; se traduce página -> cursor.
+        this._cursors = { 1: null };
+        const filterParams = { cedula: 'cedula', nombre_completo: 'nombre', id_proyecto: 'id_proyecto' };
+
+        this.table = new Tabulator("#maestra-table-container", {
+            height: "100%",
+            layout: "fitColumns",
+            responsiveLayout: false,
+            ajaxURL: "/admin/maestra/financiacion",
+            progressiveLoad: "scroll",
+            paginationSize: 100,
+            sortMode: "remote",
+            filterMode: "remote",
+            ajaxRequestFunc: (url, config, params) => this.fetchPage(url, params, filterParams),
+            initialSort: [{ column: "fecha_modificacion", dir: "desc" }],
+            selectable: 1,
+            placeholder: "Sin registros",
+            columns: [
+                {
+                    title: "", width: 50, hozAlign: "center", headerSort: false,
+                    formatter: () => `<button style="background: var(--primary-lighter); border: none; padding: 4px 8px; border-radius: 6px; cursor: pointer; color: var(--primary-dark); font-weight: 800;">📝</button>`,
+                    cellClick: (e, cell) => this.showDetail(cell.getRow().getData())
+                },
+                { title: "ID", field: "id_financiacion", width: 100 },
+                { title: "Cédula", field: "cedula", width: 110, headerFilter: "input" },
+                { title: "Nombre", field: "nombre_completo", minWidth: 200, headerFilter: "input", headerSort: false },
+                {
+                    title: "Proyecto", field: "id_proyecto", width: 140, headerFilter: "input",
+                    formatter: (cell) => `<span class="id-badge" title="${this.catalogos.id_proyecto?.[cell.getValue()] || ''}">${cell.getValue()}</span>`
+                },
+                {
+                    title: "Salario Base", field: "salario_base", width: 130, hozAlign: "right",
+                    formatter: "money", formatterParams: { symbol: "$", precision: 0, thousand: "." }
+                },
+                {
+                    title: "Referencia", field: "pago_proyectado", width: 130, hozAlign: "right",
+                    formatter: (cell) => `<span class="pago-proy-badge">$${Number(cell.getValue()).toLocaleString()}</span>`
+                },
+                { title: "Modificado", field: "fecha_modificacion", visible: false }
+            ],
+            rowClick: (e, row) => this.showDetail(row.getData())
+        });
+    },
 
-            this.table = new Tabulator("#maestra-table-container", {
-                data: data,
-                layout: "fitColumns",
-                responsiveLayout: false,
-                pagination: "local",
-                paginationSize: 50,
-                initialSort: [{ column: "fecha_modificacion", dir: "desc" }],
-                selectable: 1,
-                columns: [
-                    {
-                        title: "", width: 50, hozAlign: "center", headerSort: false,
-                        formatter: () => `<button style="background: var(--primary-lighter); border: none; padding: 4px 8px; border-radius: 6px; cursor: pointer; color: var(--primary-dark); font-weight: 800;">📝</button>`,
-                        cellClick: (e, cell) => this.showDetail(cell.getRow().getData())
-                    },
-                    { title: "ID", field: "id_financiacion", width: 100 },
-                    { title: "Cédula", field: "cedula", width: 110, headerFilter: "input" },
-                    { title: "Nombre", field: "nombre_completo", minWidth: 200, headerFilter: "input" },
-                    {
-                        title: "Proyecto", field: "id_proyecto", width: 140, headerFilter: "input",
-                        formatter: (cell) => `<span class="id-badge" title="${this.catalogos.id_proyecto?.[cell.getValue()] || ''}">${cell.getValue()}</span>`
-                    },
-                    {
-                        title: "Salario Base", field: "salario_base", width: 130, hozAlign: "right",
-                        formatter: "money", formatterParams: { symbol: "$", precision: 0, thousand: "." }
-                    },
-                    {
-                        title: "Referencia", field: "pago_proyectado", width: 130, hozAlign: "right",
-                        formatter: (cell) => `<span class="pago-proy-badge">$${Number(cell.getValue()).toLocaleString()}</span>`
-                    },
-                    { title: "Modificado", field: "fecha_modificacion", visible: false }
-                ],
-                rowClick: (e, row) => this.showDetail(row.getData())
-            });
+    async fetchPage(url, params, filterParams) {
+        const page = params.page || 1;
+        if (page === 1) this._cursors = { 1: null };
+
+        const query = new URLSearchParams({ limit: params.size || 100 });
+        const sort = params.sort?.[0];
+        query.set('sort', sort?.field || 'fecha_modificacion');
+        query.set('dir', sort?.dir || 'desc');
+        (params.filter || []).forEach(f => {
+            if (filterParams[f.field] && f.value) query.set(filterParams[f.field], f.value);
+        });
+        if (this._search) query.set('search', this._search);
+        if (this._cursors[page]) query.set('cursor', this._cursors[page]);
+
+        try {
+            // Solo la primera página muestra el loader; las siguientes llegan al hacer scroll
+            const res = await api.get(`${url}?${query.toString()}`, page > 1);
+            if (res?.next_cursor) this._cursors[page + 1] = res.next_cursor;
+            return { last_page: res?.next_cursor ? page + 1 : page, data: res?.items || [] };
         } catch (e) {
-            ui.hideLoading();
             ui.showToast("Error al conectar con la base de datos", "error");
+            throw e;
         }
     },
 
     async showDetail(data) {
-        this.currentRecord = data;
         const drawer = document.getElementById('maestra-drawer');
         if (!drawer) return;
 
+        // La grilla solo trae las columnas visibles: el detalle completo se pide por id
+        if (data.id_financiacion) {
+            try {
+                data = await api.get(`/admin/maestra/financiacion/${encodeURIComponent(data.id_financiacion)}`);
+            } catch (e) {
+                ui.showToast("No se pudo cargar el detalle del registro", "error");
+                return;
+            }
+        }
+        this.currentRecord = data;
+
         drawer.classList.add('open');
         this.switchTab('tab-contrato'); // Default tab when opening
 
@@ -363,18 +399,15 @@ export const maestra = {
             btn.addEventListener('click', () => this.switchTab(btn.dataset.tab));
         });
 
-        // Search trigger
+        // Search trigger (servidor, por prefijo): recarga desde la primera página
+        this._search = '';
+        let searchTimer = null;
         document.getElementById('maestra-search')?.addEventListener('input', (e) => {
-            const val = e.target.value.trim();
-            if (!val) {
-                this.table?.clearFilter();
-            } else {
-                this.table?.setFilter([
-                    [{ field: "cedula", type: "like", value: val },
-                    { field: "id_proyecto", type: "like", value: val },
-                    { field: "nombre_completo", type: "like", value: val }]
-                ]);
-            }
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => {
+                this._search = e.target.value.trim();
+                this.table?.setData();
+            }, 300);
         });
 
         // Live hints
@@ -421,8 +454,7 @@ export const maestra = {
             if (res.id) {
                 ui.showToast("Borrador generado", "success");
                 await this.initTable();
-                const fresh = this.table.getData().find(d => d.id_financiacion === res.id);
-                if (fresh) this.showDetail(fresh);
+                this.showDetail({ id_financiacion: res.id });
             }
         } catch (e) {
             ui.hideLoading();
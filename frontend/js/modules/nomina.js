@@ -851,13 +851,18 @@ export const nomina = {
         formData.append('file', file);
 
         try {
-            ui.showLoading("Procesando masivamente la nómina...");
-            const res = await api.upload('/admin/nomina/upload', formData);
+            ui.showLoading("Subiendo archivo de nómina...");
+            const job = await api.upload('/admin/nomina/upload', formData, true);
+            // La carga corre en segundo plano por lotes; mostramos el avance del trabajo
+            const res = await api.waitJob(job.job_id, (j) => {
+                const pct = j.estado === 'EJECUTANDO' ? ` ${Math.round(j.progreso)}%` : '';
+                ui.showLoading(`Procesando masivamente la nómina...${pct} ${j.mensaje || ''}`);
+            });
             if (res.ok) {
                 ui.showToast(res.message, "success");
                 await this.fetchSummary();
             } else {
-                ui.showToast(res.detail || "Error al subir", "error");
+                ui.showToast(res.message || res.detail || "Error al subir", "error");
             }
         } catch (err) {
             ui.showToast(err.message || "Error de conexión", "error");
@@ -5,6 +5,7 @@ from urllib.parse import quote_plus
 import logging
 import os
 import traceback
+from sqlalchemy import text
 
 # 1. CONFIGURACIÓN DE CREDENCIALES
 ERP_USER = os.environ.get("ERP_USER")
@@ -54,6 +55,18 @@ def format_id3(val):
     s = str(val).strip()
     return s.zfill(3) if s.isdigit() and len(s) <= 3 else s
 
+def normalizar_proyecto(val):
+    """Llave de cruce del código de proyecto (misma regla que app.core.utils.normalizar_proyecto)"""
+    if val is None:
+        return None
+    s = str(val).strip()
+    if not s:
+        return None
+    return str(int(s)).zfill(3) if s.isdigit() else s
+
+# Catálogos de proyectos con llave normalizada (codigo_norm) para los cruces con BNomina
+TABLAS_PROYECTOS = ('dim_proyectos', 'dim_proyectos_otros')
+
 def sync_table(table_erp, table_cloud, erp_engine, cloud_engine):
     """Lógica para subir solo registros nuevos basados en el código"""
     print(f"--- 🔄 Procesando tabla: {table_cloud} ---")
@@ -99,7 +112,11 @@ def sync_table(table_erp, table_cloud, erp_engine, cloud_engine):
         # D. Cargar solo el diferencial
         if not df_new.empty:
             # Solo enviamos las columnas 'codigo' y 'nombre' para mantener consistencia
-            df_new[['codigo', 'nombre']].to_sql(table_cloud, cloud_engine, if_exists='append', index=False)
+            cols = ['codigo', 'nombre']
+            if table_cloud in TABLAS_PROYECTOS:
+                df_new = df_new.assign(codigo_norm=df_new['codigo'].apply(normalizar_proyecto))
+                cols.append('codigo_norm')
+            df_new[cols].to_sql(table_cloud, cloud_engine, if_exists='append', index=False)
             print(f"✅ Éxito: Se agregaron {len(df_new)} registros nuevos.")
         else:
             print(f"ℹ️ Al día: No hay códigos nuevos para agregar.")
@@ -108,6 +125,22 @@ def sync_table(table_erp, table_cloud, erp_engine, cloud_engine):
         print(f"❌ Error procesando {table_cloud}: {e}")
         traceback.print_exc()
 
+def completar_codigos_norm(cloud_engine):
+    """Calcula codigo_norm de los proyectos cargados por fuera del sync (p.ej. dim_proyectos_otros a mano)"""
+    for tabla in TABLAS_PROYECTOS:
+        try:
+            with cloud_engine.begin() as conn:
+                codigos = [r[0] for r in conn.execute(text(f"SELECT codigo FROM {tabla} WHERE codigo_norm IS NULL"))]
+                for codigo in codigos:
+                    conn.execute(
+                        text(f"UPDATE {tabla} SET codigo_norm = :norm WHERE codigo = :codigo"),
+                        {"norm": normalizar_proyecto(codigo), "codigo": codigo}
+                    )
+            if codigos:
+                print(f"✅ {tabla}: codigo_norm calculado para {len(codigos)} registros.")
+        except Exception as e:
+            print(f"❌ Error normalizando {tabla}: {e}")
+
 def run_sync():
     # Motores de base de datos
     import pyodbc
@@ -136,6 +169,8 @@ def run_sync():
     
     for erp_tab, cloud_tab in TABLAS_A_SINCRONIZAR.items():
         sync_table(erp_tab, cloud_tab, erp_engine, cloud_engine)
+
+    completar_codigos_norm(cloud_engine)
     
     print("\n🏁 Proceso finalizado.")
 